@@ -0,0 +1,280 @@
+"""Module storing packed, compressed archive of raw API responses, which replaces thousands of small JSON files.
+
+Every fetch run appends its responses into a single segment file. Each record is zlib compressed and prefixed with a
+small header (endpoint and key), so the segment can be read as a sequential stream or indexed again, when its index
+file is lost. Index file maps (endpoint, key) to record offset, so any single response can be read randomly.
+"""
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Tuple, List, Iterator
+from utils import FILES_DIR
+
+ARCHIVE_DIR: Path = FILES_DIR / "archive"
+
+# record header: magic, compressed payload length, endpoint length, key length
+RECORD_MAGIC: bytes = b"NHLR"
+RECORD_HEADER = struct.Struct("<4sIHH")
+COMPRESSION_LEVEL: int = 6
+
+
+class Archive:
+    """Append-only segment archive with offset index keyed by endpoint and entity key.
+
+    NOTES
+    -----
+    Endpoint is the name of the sub-folder, which would be used for loose files (e.g. 'player_stats', 'team_roster')
+    and key is the filename without extension. Method save() has the same signature as utils.save_json(), so archive
+    can be passed into fetch_files() instead of writing loose files. Appending is thread-safe.
+
+    Segment is appended before the index, so after a crash the index can miss records at the end of the segment (or
+    point past its end, when the segment write was lost). Index is therefore checked against the segment on open and
+    rebuilt by scanning the segment, when they differ; incomplete record at the end of the segment is truncated.
+
+    USAGE
+    _____
+    >>> import tempfile
+    >>> with Archive(Path(tempfile.mkdtemp()) / "run.seg") as archive:
+    ...     archive.save(b'{"stats": []}', "Connor McDavid_8478402_stats.json", "player_stats")
+    ...     archive.load_json("player_stats", "connor mcdavid_8478402_stats")
+    {'stats': []}
+    """
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.index_path = path.with_suffix(".idx")
+        self.index: Dict[Tuple[str, str], Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+        if self.index_path.exists():
+            self._load_index()
+            self._reconcile()
+        elif path.exists():
+            self._rebuild_index()
+            self._truncate_incomplete()
+
+        self._segment = open(path, "ab")
+        self._index_file = open(self.index_path, "a", encoding="utf-8")
+        self._reader = open(path, "rb")
+
+    @classmethod
+    def for_run(cls, run_id: str = None, archive_dir: Path = ARCHIVE_DIR) -> "Archive":
+        """Open archive of a fetch run; new run id is generated from current time if not selected.
+
+        :param run_id: identifier of the fetch run
+        :param archive_dir: directory storing archive segments
+
+        :return: Archive object
+        """
+        run_id = run_id or datetime.now().strftime("%Y%m%d_%H%M%S")
+        return cls(archive_dir / f"{run_id}.seg")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self._segment.close()
+        self._index_file.close()
+        self._reader.close()
+
+    def _load_index(self) -> None:
+        with open(self.index_path, encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    endpoint, key, offset, length = json.loads(line)
+                except ValueError:
+                    # last line might be incomplete after a crash
+                    continue
+                self.index[(endpoint, key)] = (offset, length)
+
+    def _end(self) -> int:
+        """Get end offset of the last indexed record (the last appended record is never superseded)."""
+        return max((offset + length for offset, length in self.index.values()), default=0)
+
+    def _reconcile(self) -> None:
+        """Rebuild index, when it does not end exactly where the segment ends."""
+        size = self.path.stat().st_size if self.path.exists() else 0
+        if self._end() == size:
+            return
+        print(f"Index of archive [{self.path}] does not match its segment, index is rebuilt")
+        self.index = {}
+        self._rebuild_index()
+        self._truncate_incomplete()
+
+    def _truncate_incomplete(self) -> None:
+        """Cut off bytes after the last complete record (record, whose write was interrupted)."""
+        if self.path.exists() and self.path.stat().st_size > self._end():
+            os.truncate(self.path, self._end())
+
+    def _rebuild_index(self) -> None:
+        for endpoint, key, offset, length in self._scan():
+            self.index[(endpoint, key)] = (offset, length)
+        with open(self.index_path, "w", encoding="utf-8") as fh:
+            for (endpoint, key), (offset, length) in self.index.items():
+                fh.write(json.dumps([endpoint, key, offset, length]) + "\n")
+
+    def _scan(self) -> Iterator[Tuple[str, str, int, int]]:
+        """Walk through record headers of the segment and yield (endpoint, key, payload offset, payload length).
+
+        Scan stops at incomplete record at the end of the segment.
+        """
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as fh:
+            size = os.fstat(fh.fileno()).st_size
+            while header := fh.read(RECORD_HEADER.size):
+                if len(header) < RECORD_HEADER.size:
+                    break
+                magic, length, endpoint_length, key_length = RECORD_HEADER.unpack(header)
+                if magic != RECORD_MAGIC:
+                    raise ValueError(f"Corrupted archive segment [{self.path}] at offset [{fh.tell()}]")
+                offset = fh.tell() + endpoint_length + key_length
+                if offset + length > size:
+                    break
+                endpoint = fh.read(endpoint_length).decode("utf-8")
+                key = fh.read(key_length).decode("utf-8")
+                fh.seek(length, os.SEEK_CUR)
+                yield endpoint, key, offset, length
+
+    def append(self, endpoint: str, key: str, data: bytes) -> None:
+        """Append compressed record into the segment and its offset into the index.
+
+        :param endpoint: name of the endpoint (sub-folder)
+        :param key: entity key (filename without extension)
+        :param data: raw response data
+
+        :return: None
+        """
+        payload = zlib.compress(data, COMPRESSION_LEVEL)
+        endpoint_bytes, key_bytes = endpoint.encode("utf-8"), key.encode("utf-8")
+        header = RECORD_HEADER.pack(RECORD_MAGIC, len(payload), len(endpoint_bytes), len(key_bytes))
+
+        with self._lock:
+            self._segment.seek(0, os.SEEK_END)
+            offset = self._segment.tell() + len(header) + len(endpoint_bytes) + len(key_bytes)
+            self._segment.write(header + endpoint_bytes + key_bytes + payload)
+            self._segment.flush()
+            self._index_file.write(json.dumps([endpoint, key, offset, len(payload)]) + "\n")
+            self._index_file.flush()
+            self.index[(endpoint, key)] = (offset, len(payload))
+
+    def save(self, data: bytes, filename: str, subfolder: str) -> None:
+        """Drop-in replacement of utils.save_json(), which appends data into the archive.
+
+        :param data: raw response data
+        :param filename: name of the file with downloaded data
+        :param subfolder: name of the sub-folder, where downloaded files would be stored
+
+        :return: None
+        """
+        self.append(subfolder, filename.lower().removesuffix(".json"), data)
+
+    def get(self, endpoint: str, key: str) -> bytes:
+        """Read single record.
+
+        :param endpoint: name of the endpoint (sub-folder)
+        :param key: entity key (filename without extension); keys are case-insensitive
+
+        :return: raw response data
+        """
+        offset, length = self.index[(endpoint, key.lower())]
+        with self._lock:
+            self._reader.seek(offset)
+            payload = self._reader.read(length)
+        return zlib.decompress(payload)
+
+    def load_json(self, endpoint: str, key: str) -> dict:
+        """Read single record as JSON data."""
+        return json.loads(self.get(endpoint, key))
+
+    def contains(self, endpoint: str, key: str) -> bool:
+        return (endpoint, key.lower()) in self.index
+
+    def keys(self, endpoint: str) -> List[str]:
+        """Get keys of all records of the endpoint."""
+        return [key for record_endpoint, key in self.index if record_endpoint == endpoint]
+
+    def iter_records(self, endpoint: str = None) -> Iterator[Tuple[str, str, bytes]]:
+        """Stream records sequentially in the order they were appended.
+
+        :param endpoint: name of the endpoint; all records are streamed if not selected
+
+        :return: iterator of (endpoint, key, raw response data)
+        """
+        with open(self.path, "rb") as fh:
+            for record_endpoint, key, offset, length in self._scan():
+                if endpoint is not None and record_endpoint != endpoint:
+                    continue
+                # superseded records (same key appended again) are skipped
+                if self.index.get((record_endpoint, key)) != (offset, length):
+                    continue
+                fh.seek(offset)
+                yield record_endpoint, key, zlib.decompress(fh.read(length))
+
+
+def compare_with_loose_files(archive: Archive, endpoint: str, files_dir: Path = FILES_DIR) -> Dict[str, dict]:
+    """Compare file count, disk bytes and read time of archived endpoint with loose JSON files of the same endpoint.
+
+    NOTES
+    -----
+    Read time is measured by reading and parsing all records; for truly cold numbers OS page cache should be dropped
+    before running the comparison.
+
+    :param archive: Archive object
+    :param endpoint: name of the endpoint (sub-folder)
+    :param files_dir: path to files directory with loose files
+
+    :return: dictionary {"loose_files": {...}, "archive": {...}}
+    """
+    loose_files = sorted((files_dir / endpoint).glob("*.json"))
+    start = time.perf_counter()
+    for file in loose_files:
+        with open(file, encoding="utf-8") as fh:
+            json.load(fh)
+    loose_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    records = sum(1 for _, _, data in archive.iter_records(endpoint) if json.loads(data) is not None)
+    archive_seconds = time.perf_counter() - start
+
+    comparison = {
+        "loose_files": {"records": len(loose_files), "files": len(loose_files),
+                        "bytes": sum(file.stat().st_size for file in loose_files),
+                        "read_seconds": round(loose_seconds, 4)},
+        "archive": {"records": records, "files": 2,
+                    "bytes": archive.path.stat().st_size + archive.index_path.stat().st_size,
+                    "read_seconds": round(archive_seconds, 4)}
+    }
+    print(f"Archive comparison for [{endpoint}]: [{comparison}]")
+
+    return comparison
+
+
+def archive_loose_files(archive: Archive, endpoint: str, files_dir: Path = FILES_DIR) -> int:
+    """Pack already downloaded loose JSON files of the endpoint into the archive.
+
+    :param archive: Archive object
+    :param endpoint: name of the endpoint (sub-folder)
+    :param files_dir: path to files directory with loose files
+
+    :return: number of archived files
+    """
+    files = sorted((files_dir / endpoint).glob("*.json"))
+    for file in files:
+        archive.append(endpoint, file.stem.lower(), file.read_bytes())
+
+    return len(files)
+
+
+if __name__ == "__main__":
+    with Archive.for_run("loose_files") as loose_archive:
+        archive_loose_files(loose_archive, "player_stats")
+        compare_with_loose_files(loose_archive, "player_stats")
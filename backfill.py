@@ -0,0 +1,310 @@
+"""Module storing functions for resumable multi-season historical backfill of player game logs."""
+import asyncio
+import json
+import sqlite3
+import time
+from itertools import groupby
+from pathlib import Path
+from typing import List, Tuple, Dict, Iterable, Optional
+from utils import FrozenJSON, HTTPClient, fetch_files, FILES_DIR
+from get_data_stats_files import BASE_URL
+
+# name of the sub-folder storing backfill data; every season gets its own sub-folder
+BACKFILL_DIR: str = "backfill"
+MANIFEST_PATH: Path = FILES_DIR / BACKFILL_DIR / "manifest.sqlite"
+
+# number of work units, which are fetched (and checkpointed) together
+BATCH_SIZE: int = 200
+MAX_ATTEMPTS: int = 3
+
+# work unit kinds in order of processing; each kind is produced from files downloaded by the previous one
+TEAMS: str = "teams"
+ROSTER: str = "roster"
+PLAYER: str = "player"
+
+# work unit statuses
+PENDING: str = "pending"
+DONE: str = "done"
+FAILED: str = "failed"
+
+# errors of downloaded files, which are missing, are not JSON (e.g. error page) or have unexpected structure
+UNREADABLE_FILE_ERRORS = (OSError, ValueError, AttributeError, KeyError, TypeError)
+
+CREATE_UNITS_TABLE_QUERY: str = """
+CREATE TABLE IF NOT EXISTS units
+(
+    kind TEXT NOT NULL,
+    season TEXT NOT NULL,
+    entity_id INTEGER NOT NULL,
+    team_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    url TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL,
+    PRIMARY KEY (kind, season, entity_id)
+);
+"""
+
+
+def season_range(first_season: int, last_season: int) -> List[str]:
+    """Get list of season ids for a range of seasons given by their starting years.
+
+    USAGE
+    _____
+    >>> season_range(2020, 2022)
+    ['20202021', '20212022', '20222023']
+
+    :param first_season: starting year of the first season
+    :param last_season: starting year of the last season
+
+    :return: list of season ids in yyyyYYYY format
+    """
+    return [f"{year}{year + 1}" for year in range(first_season, last_season + 1)]
+
+
+def season_subfolder(season: str, kind: str) -> str:
+    """Get name of the sub-folder, where data of given season and work unit kind are stored.
+
+    :param season: season id in yyyyYYYY format
+    :param kind: work unit kind
+
+    :return: sub-folder path relative to files directory
+    """
+    subfolders = {TEAMS: "", ROSTER: "team_roster", PLAYER: "player_stats"}
+    return str(Path(BACKFILL_DIR) / season / subfolders[kind])
+
+
+class BackfillManifest:
+    """Persistent checkpoint manifest of backfill work units stored in SQLite database.
+
+    NOTES
+    -----
+    Each work unit is identified by (kind, season, entity_id), where entity is a team for 'teams' & 'roster' units and
+    a player for 'player' units. Units are inserted idempotently and statuses of a whole batch are updated within one
+    transaction, therefore a crash can lose only the batch, which was in-flight.
+    """
+    def __init__(self, path: Path = MANIFEST_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute(CREATE_UNITS_TABLE_QUERY)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def add_units(self, kind: str, units: Iterable[Tuple[str, int, int, str, str]]) -> int:
+        """Register new work units; already known units are left untouched.
+
+        :param kind: work unit kind
+        :param units: iterable of (season, entity_id, team_id, filename, url) tuples
+
+        :return: number of newly registered units
+        """
+        with self.connection:
+            cursor = self.connection.executemany(
+                "INSERT OR IGNORE INTO units(kind, season, entity_id, team_id, filename, url, status) "
+                "VALUES(?, ?, ?, ?, ?, ?, ?)",
+                [(kind, *unit, PENDING) for unit in units]
+            )
+        return cursor.rowcount
+
+    def pending_units(self, kind: str, max_attempts: int = MAX_ATTEMPTS, limit: int = BATCH_SIZE) -> List[sqlite3.Row]:
+        """Get next batch of work units, which were not completed yet and can still be retried.
+
+        NOTES
+        -----
+        Units are ordered by season and team, so that a batch is sharded by season and team as much as possible.
+
+        :param kind: work unit kind
+        :param max_attempts: maximal number of attempts for a single unit
+        :param limit: maximal number of returned units
+
+        :return: list of work unit rows
+        """
+        return self.connection.execute(
+            "SELECT * FROM units WHERE kind = ? AND status != ? AND attempts < ? "
+            "ORDER BY season, team_id, entity_id LIMIT ?",
+            (kind, DONE, max_attempts, limit)
+        ).fetchall()
+
+    def done_units(self, kind: str) -> List[sqlite3.Row]:
+        """Get all completed work units of given kind.
+
+        :param kind: work unit kind
+
+        :return: list of work unit rows
+        """
+        return self.connection.execute(
+            "SELECT * FROM units WHERE kind = ? AND status = ? ORDER BY season, team_id, entity_id", (kind, DONE)
+        ).fetchall()
+
+    def mark_batch(self, kind: str, results: Iterable[Tuple[str, int, Optional[str]]]) -> None:
+        """Store results of a processed batch in a single transaction.
+
+        :param kind: work unit kind
+        :param results: iterable of (season, entity_id, error) tuples; error is None for successful units
+
+        :return: None
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE units SET status = ?, attempts = attempts + 1, error = ?, updated_at = ? "
+                "WHERE kind = ? AND season = ? AND entity_id = ?",
+                [(DONE if error is None else FAILED, error, now, kind, season, entity_id)
+                 for season, entity_id, error in results]
+            )
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        """Get number of work units per kind and status.
+
+        :return: dictionary {kind: {status: count}}
+        """
+        rows = self.connection.execute("SELECT kind, status, COUNT(*) FROM units GROUP BY kind, status").fetchall()
+        result: Dict[str, Dict[str, int]] = {}
+        for kind, status, count in rows:
+            result.setdefault(kind, {})[status] = count
+        return result
+
+
+def _load_json(subfolder: str, filename: str) -> FrozenJSON:
+    """Load downloaded JSON file into FrozenJSON navigator."""
+    with open(FILES_DIR / subfolder / (filename + ".json"), encoding="utf-8") as fh:
+        return FrozenJSON(json.load(fh))
+
+
+def expand_roster_units(manifest: BackfillManifest) -> int:
+    """Register roster work units for all teams of already downloaded season team lists.
+
+    :param manifest: backfill checkpoint manifest
+
+    :return: number of newly registered units
+    """
+    units, failed = [], []
+    for unit in manifest.done_units(TEAMS):
+        try:
+            json_navigator = _load_json(season_subfolder(unit["season"], TEAMS), unit["filename"])
+            units += [(unit["season"], team.id, team.id, f"{team.id}_roster",
+                       BASE_URL + team.link + f"/roster?season={unit['season']}")
+                      for team in json_navigator.teams]
+        except UNREADABLE_FILE_ERRORS as e:
+            failed.append((unit["season"], unit["entity_id"], repr(e)))
+
+    # unreadable file is downloaded again, so one broken response cannot stop the whole backfill
+    manifest.mark_batch(TEAMS, failed)
+
+    return manifest.add_units(ROSTER, units)
+
+
+def expand_player_units(manifest: BackfillManifest) -> int:
+    """Register player game log work units for all skaters of already downloaded season team rosters.
+
+    NOTES
+    -----
+    Player traded during a season appears on multiple rosters, but only the first registered unit is kept, because
+    game log for a season covers all his teams. Roster file, which cannot be read, marks its unit as failed.
+
+    :param manifest: backfill checkpoint manifest
+
+    :return: number of newly registered units
+    """
+    units, failed = [], []
+    for unit in manifest.done_units(ROSTER):
+        try:
+            json_navigator = _load_json(season_subfolder(unit["season"], ROSTER), unit["filename"])
+            roster = getattr(json_navigator, "roster", [])
+            units += [(unit["season"], player.person.id, unit["team_id"],
+                       f"{player.person.fullName}_{player.person.id}_stats".lower(),
+                       BASE_URL + player.person.link + f"/stats?stats=gameLog&season={unit['season']}")
+                      for player in roster if player.position.name != "Goalie"]
+        except UNREADABLE_FILE_ERRORS as e:
+            failed.append((unit["season"], unit["entity_id"], repr(e)))
+
+    # unreadable roster is downloaded again on next run, so one broken response cannot stop the whole backfill
+    manifest.mark_batch(ROSTER, failed)
+
+    return manifest.add_units(PLAYER, units)
+
+
+async def process_units(manifest: BackfillManifest, kind: str, batch_size: int = BATCH_SIZE,
+                        max_attempts: int = MAX_ATTEMPTS, client: HTTPClient = None) -> int:
+    """Download all pending work units of given kind batch by batch and checkpoint results after each batch.
+
+    :param manifest: backfill checkpoint manifest
+    :param kind: work unit kind
+    :param batch_size: number of units downloaded concurrently and checkpointed together
+    :param max_attempts: maximal number of attempts for a single unit
+    :param client: shared HTTP client; temporary client is created for every batch if not selected
+
+    :return: number of processed units
+    """
+    processed = 0
+    while units := manifest.pending_units(kind, max_attempts=max_attempts, limit=batch_size):
+        batch_results = []
+        for season, season_units in groupby(units, key=lambda unit: unit["season"]):
+            season_units = list(season_units)
+            subfolder = season_subfolder(season, kind)
+            (FILES_DIR / subfolder).mkdir(parents=True, exist_ok=True)
+
+            results = await fetch_files([unit["url"] for unit in season_units],
+                                        [unit["filename"] for unit in season_units], subfolder, client=client)
+            batch_results += [(season, unit["entity_id"], repr(result) if isinstance(result, Exception) else None)
+                              for unit, result in zip(season_units, results)]
+
+        manifest.mark_batch(kind, batch_results)
+        processed += len(units)
+
+    return processed
+
+
+async def run_backfill(first_season: int, last_season: int, batch_size: int = BATCH_SIZE,
+                       max_attempts: int = MAX_ATTEMPTS,
+                       manifest_path: Path = MANIFEST_PATH) -> Dict[str, Dict[str, int]]:
+    """Backfill player game logs for a range of seasons; interrupted run continues where it stopped.
+
+    NOTES
+    -----
+    The work is split into season team lists, then season team rosters and finally season player game logs. Failed
+    units are retried on next run until max_attempts is reached.
+
+    :param first_season: starting year of the first season (e.g. 2019 for season 2019/2020)
+    :param last_season: starting year of the last season
+    :param batch_size: number of units downloaded concurrently and checkpointed together
+    :param max_attempts: maximal number of attempts for a single unit
+    :param manifest_path: path to checkpoint manifest database
+
+    :return: summary of work units per kind and status
+    """
+    async with HTTPClient() as client:
+        with BackfillManifest(manifest_path) as manifest:
+            manifest.add_units(TEAMS, [(season, 0, 0, "teams", BASE_URL + f"api/v1/teams?season={season}")
+                                       for season in season_range(first_season, last_season)])
+            await process_units(manifest, TEAMS, batch_size, max_attempts, client)
+
+            expand_roster_units(manifest)
+            await process_units(manifest, ROSTER, batch_size, max_attempts, client)
+
+            expand_player_units(manifest)
+            await process_units(manifest, PLAYER, batch_size, max_attempts, client)
+
+            summary = manifest.summary()
+
+    print(f"Backfill summary: [{summary}]")
+    print(f"HTTP client stats: [{client.stats}]")
+
+    return summary
+
+
+if __name__ == "__main__":
+    asyncio.run(run_backfill(first_season=2019, last_season=2022))
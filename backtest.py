@@ -0,0 +1,174 @@
+"""Module storing point-in-time backtest of scorer reports over every game date of a season.
+
+For every game of every player, report aggregates are computed only from games of the player played before the date
+of the game (prefix sums over date-ordered game logs located by searchsorted), players are ranked within their team
+for that date, and picks of both reports are scored by goals scored in the game itself - the game, which the report
+of that date would be used for. All dates are computed together without re-running aggregation per date.
+"""
+from typing import Dict, List, Tuple
+import numpy as np
+import pandas as pd
+from data_analysis import (convert_time_column_to_seconds, TOP_SCORER_SORT_COLUMNS, OFF_FIRE_SORT_COLUMNS,
+                           AVERAGE_STATS_PERIOD, OFF_FIRE_PERIOD, MEAN_DECIMALS)
+
+ON_FIRE: str = "on_fire"
+OFF_FIRE: str = "off_fire"
+
+
+class AsOfStore:
+    """Prefix sums over ascending date-ordered game logs, which give "last K games before date" windows of any player.
+
+    USAGE
+    _____
+    >>> log = pd.DataFrame({"name": ["A", "A", "A"], "team": ["X", "X", "X"], "goals": [1, 0, 2],
+    ...                     "match_date": ["2023-01-03", "2023-01-01", "2023-01-02"]})
+    >>> store = AsOfStore(log, columns=["goals"])
+    >>> store.history.tolist()
+    [0, 1, 2]
+    >>> store.window_sum("goals", 2).tolist()
+    [0.0, 0.0, 2.0]
+    """
+    def __init__(self, data: pd.DataFrame, columns: List[str]):
+        df = data.reset_index(drop=True)
+        df = df.assign(time_on_ice_seconds=convert_time_column_to_seconds(df, "timeOnIce"),
+                       time_power_play_seconds=convert_time_column_to_seconds(df, "powerPlayTimeOnIce"))
+        df = df.sort_values(["name", "team", "match_date"], kind="mergesort").reset_index(drop=True)
+        self.games = df
+
+        # composite (player, day) keys are globally sorted, so one searchsorted locates games before every date
+        new_player = (df["name"].ne(df["name"].shift()) | df["team"].ne(df["team"].shift())).to_numpy()
+        player = np.cumsum(new_player) - 1
+        days = pd.to_datetime(df["match_date"]).to_numpy().astype("datetime64[D]").astype(np.int64)
+        keys = player * (days.max() - days.min() + 2) + (days - days.min())
+        starts = np.flatnonzero(new_player)[player]
+
+        # end of history (exclusive) of every game row and number of games before it
+        self.ends: np.ndarray = np.searchsorted(keys, keys, side="left")
+        self.history: np.ndarray = self.ends - starts
+
+        self.sums: Dict[str, np.ndarray] = {}
+        self.valid: Dict[str, np.ndarray] = {}
+        for column in columns:
+            values = pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=float) if column in df \
+                else np.full(len(df), np.nan)
+            is_valid = ~np.isnan(values)
+            self.sums[column] = np.concatenate([[0.0], np.cumsum(np.where(is_valid, values, 0.0))])
+            self.valid[column] = np.concatenate([[0], np.cumsum(is_valid)])
+
+    def _begins(self, window) -> np.ndarray:
+        if window is None:
+            return self.ends - self.history
+        return self.ends - np.minimum(self.history, window)
+
+    def window_sum(self, column: str, window: int = None) -> np.ndarray:
+        """Get sum of the column over last `window` games (all games if None) before every game row."""
+        return self.sums[column][self.ends] - self.sums[column][self._begins(window)]
+
+    def window_mean(self, column: str, window: int = None) -> np.ndarray:
+        """Get mean of the column (missing values skipped) over last `window` games before every game row."""
+        counts = self.valid[column][self.ends] - self.valid[column][self._begins(window)]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # rounding removes noise of prefix sum differences, so equal means stay equal when ranking ties
+            return np.where(counts > 0, np.round(self.window_sum(column, window) / counts, MEAN_DECIMALS), np.nan)
+
+
+def as_of_aggregates(store: AsOfStore, average_stats_period: int = AVERAGE_STATS_PERIOD,
+                     off_fire_period: int = OFF_FIRE_PERIOD) -> pd.DataFrame:
+    """Aggregate stats of both reports for every game row using only games played before its date.
+
+    :param store: as-of store with player game logs
+    :param average_stats_period: number of last matches used for average stats
+    :param off_fire_period: number of last matches without a goal
+
+    :return: new Dataframe with one row per game row (player & date), which has at least one previous game
+    """
+    games = store.games
+    team_column = "match_team" if "match_team" in games else "team"
+    df_agg = pd.DataFrame({
+        "match_date": games["match_date"],
+        "name": games["name"],
+        # team of the player on that date (traded players are ranked within their team at the time)
+        "team": games[team_column],
+        "next_goals": pd.to_numeric(games["goals"], errors="coerce").fillna(0).to_numpy(),
+        "games_before": store.history,
+        "goals_total": store.window_sum("goals"),
+        "goals_last_5": store.window_sum("goals", 5),
+        "goals_last_10": store.window_sum("goals", 10),
+        "goals_last_15": store.window_sum("goals", 15),
+        "goals_last_3": store.window_sum("goals", off_fire_period),
+        "assists_last_3": store.window_sum("assists", off_fire_period),
+        "shot_efficiency": store.window_mean("shotPct", average_stats_period),
+        "shots_avg": store.window_mean("shots", average_stats_period),
+        "time_on_ice_min": store.window_mean("time_on_ice_seconds", average_stats_period) / 60,
+        "powerplay_time_min": store.window_mean("time_power_play_seconds", average_stats_period) / 60,
+    })
+
+    return df_agg[df_agg["games_before"] > 0].reset_index(drop=True)
+
+
+def _rank_within_team_per_date(df_agg: pd.DataFrame, sort_columns: List[str]) -> np.ndarray:
+    """Rank players within (date, team) groups of all dates at once (descending sort columns, missing values last)."""
+    dates, teams = pd.factorize(df_agg["match_date"])[0], pd.factorize(df_agg["team"])[0]
+    keys = [-df_agg[column].to_numpy(dtype=float) for column in reversed(sort_columns)]
+    order = np.lexsort(keys + [teams, dates])
+
+    new_group = np.concatenate([[True], (np.diff(dates[order]) != 0) | (np.diff(teams[order]) != 0)])
+    group_starts = np.maximum.accumulate(np.where(new_group, np.arange(len(order)), 0))
+
+    ranks = np.empty(len(order), dtype=int)
+    ranks[order] = np.arange(len(order)) - group_starts
+    return ranks
+
+
+def backtest_scorer_reports(data: pd.DataFrame, top_n_players: int = 5,
+                            average_stats_period: int = AVERAGE_STATS_PERIOD,
+                            off_fire_period: int = OFF_FIRE_PERIOD) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Backtest on fire and off fire scorer reports over every game date of the game logs.
+
+    NOTES
+    -----
+    Report of a date ranks players, who play on that date and have at least one previous game, by aggregates of their
+    previous games. Picks of the report are scored by their goals in the game of that date; baseline is the average
+    over all ranked players of the same dates. On fire picks should score more than baseline and off fire picks are
+    expected to bounce back.
+
+    USAGE
+    _____
+    >>> log = pd.DataFrame({"name": ["A", "A", "A", "B", "B", "B"], "team": "X", "goals": [1, 1, 0, 0, 0, 1],
+    ...                     "match_date": ["2023-01-01", "2023-01-02", "2023-01-03"] * 2, "timeOnIce": "15:00"})
+    >>> picks, summary = backtest_scorer_reports(log, top_n_players=1)
+    >>> picks[["report", "match_date", "name", "next_goals"]].values.tolist()
+    [['on_fire', '2023-01-02', 'A', 1], ['on_fire', '2023-01-03', 'A', 0]]
+    >>> summary.loc["on_fire", ["scoring_rate", "baseline_scoring_rate", "lift"]].tolist()
+    [0.5, 0.5, 1.0]
+
+    :param data: Dataframe with player stats game logs of a season
+    :param top_n_players: number of players picked for every team
+    :param average_stats_period: number of last matches used for average stats
+    :param off_fire_period: number of last matches without a goal
+
+    :return: tuple with Dataframe of picks (one row per report, date and player) and Dataframe with summary per report
+    """
+    store = AsOfStore(data, columns=["goals", "assists", "shots", "shotPct", "time_on_ice_seconds",
+                                     "time_power_play_seconds"])
+    df_agg = as_of_aggregates(store, average_stats_period, off_fire_period)
+
+    on_fire_rank = _rank_within_team_per_date(df_agg, TOP_SCORER_SORT_COLUMNS)
+    off_fire_rank = _rank_within_team_per_date(df_agg, OFF_FIRE_SORT_COLUMNS)
+
+    picks = pd.concat([
+        df_agg.assign(report=ON_FIRE, group_rank=on_fire_rank)[on_fire_rank < top_n_players],
+        df_agg.assign(report=OFF_FIRE, group_rank=off_fire_rank)[(off_fire_rank < top_n_players) &
+                                                                 (df_agg["goals_last_3"] == 0).to_numpy()]
+    ], ignore_index=True).sort_values(["report", "match_date", "team", "group_rank"])
+
+    scored = df_agg["next_goals"] > 0
+    baseline = {"baseline_goals_per_player": df_agg["next_goals"].mean(), "baseline_scoring_rate": scored.mean()}
+
+    summary = picks.groupby("report").agg(dates=("match_date", "nunique"), picks=("name", "size"),
+                                          goals_per_pick=("next_goals", "mean"),
+                                          scoring_rate=("next_goals", lambda goals: (goals > 0).mean()))
+    summary = summary.assign(**baseline)
+    summary["lift"] = summary["scoring_rate"] / summary["baseline_scoring_rate"]
+
+    return picks.reset_index(drop=True), summary
@@ -0,0 +1,177 @@
+"""Module storing scaling benchmarks of loading, analysis and DB parsing stages on synthetic leagues.
+
+Every stage is run on leagues of growing size, its time and peak memory are recorded and growth of both is compared
+with growth of the number of game log rows. The run fails (exit code 1), when any stage grows worse than linearly.
+
+USAGE
+_____
+python benchmarks.py
+python benchmarks.py --multi-season     # adds leagues with 10 and 100 seasons of game logs (slow, needs a lot of disk)
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple, Iterator
+import numpy as np
+import pandas as pd
+from utils import FILES_DIR
+from synthetic_league import generate_league
+from get_data_stats_files import load_player_stats_into_dataframe
+from data_analysis import (WindowStore, show_top_scorer_stats_from_schedule_matches,
+                           show_off_fire_scorer_stats_from_schedule_matches)
+from db_connection.parse_json_for_db import parse_player_stats_insert
+
+# league sizes (teams, players per team, games); game log rows grow roughly 2x between consecutive sizes
+SIZES: List[Tuple[int, int, int]] = [(8, 23, 20), (16, 23, 20), (16, 23, 40), (32, 23, 40), (32, 23, 82)]
+
+# the largest default size is one real season; game logs of 10 and 100 seasons check growth at 10x and 100x of it
+SEASON_GAMES: int = 82
+MULTI_SEASON_SIZES: List[Tuple[int, int, int]] = [(32, 23, SEASON_GAMES * seasons) for seasons in (10, 100)]
+
+# maximal allowed slope of log(cost) ~ log(rows); 1.0 is linear growth, margin absorbs measurement noise
+MAX_SCALING_EXPONENT: float = 1.2
+REPEATS: int = 3
+RESULTS_DIR: Path = FILES_DIR / "benchmarks"
+
+
+@contextmanager
+def working_directory(path: Path) -> Iterator[None]:
+    """Temporarily change working directory (load_player_stats_into_dataframe() reads files relative to it)."""
+    previous = Path.cwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def measure(func: Callable, repeats: int = REPEATS) -> Tuple[float, int]:
+    """Measure the best time of several runs and peak memory allocated by a single (separate) run.
+
+    :param func: function without arguments
+    :param repeats: number of timed runs
+
+    :return: tuple with time in seconds and peak memory in bytes
+    """
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+
+    # memory is traced separately, because tracing slows allocations down considerably
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return min(seconds), peak
+
+
+def benchmark_league(root: Path, n_teams: int, players_per_team: int, n_games: int,
+                     repeats: int = REPEATS) -> List[Dict[str, float]]:
+    """Generate league of given size and benchmark all stages on it.
+
+    :param root: working directory, under which 'files' directory of the league is generated
+    :param n_teams: number of teams
+    :param players_per_team: number of players of every team
+    :param n_games: number of games of every team
+    :param repeats: number of timed runs of every stage
+
+    :return: list of results {stage, teams, players, games, rows, seconds, peak_bytes}
+    """
+    league = generate_league(root / "files", n_teams, players_per_team, n_games)
+    stats_dir = root / "files" / "player_stats"
+
+    with working_directory(root):
+        df_agg = pd.concat([load_player_stats_into_dataframe(file) for file in league.player_stats_filenames])
+
+        stages = {
+            "load_player_stats_into_dataframe": lambda: pd.concat(
+                [load_player_stats_into_dataframe(file) for file in league.player_stats_filenames]),
+            "show_top_scorer_stats_from_schedule_matches": lambda: show_top_scorer_stats_from_schedule_matches(
+                df_agg, store=WindowStore(df_agg)),
+            "show_off_fire_scorer_stats_from_schedule_matches":
+                lambda: show_off_fire_scorer_stats_from_schedule_matches(df_agg, store=WindowStore(df_agg)),
+            "parse_player_stats_insert": lambda: [parse_player_stats_insert(stats_dir / (file + ".json"))
+                                                  for file in league.player_stats_filenames],
+        }
+
+        results = []
+        for stage, func in stages.items():
+            seconds, peak = measure(func, repeats)
+            results.append({"stage": stage, "teams": n_teams, "players": len(league.player_stats_filenames),
+                            "games": n_games, "rows": len(df_agg), "seconds": round(seconds, 4), "peak_bytes": peak})
+            print(f"Stage [{stage}] on [{len(df_agg)}] rows: [{seconds:.4f}] seconds, [{peak / 2 ** 20:.1f}] MiB")
+
+    return results
+
+
+def scaling_exponents(results: pd.DataFrame) -> pd.DataFrame:
+    """Fit slope of log(cost) ~ log(rows) for time and peak memory of every stage.
+
+    USAGE
+    _____
+    >>> df = pd.DataFrame({"stage": ["a"] * 3, "rows": [100, 200, 400], "seconds": [1.0, 2.0, 4.0],
+    ...                    "peak_bytes": [10, 40, 160]})
+    >>> scaling_exponents(df).round(2).to_dict("index")
+    {'a': {'seconds': 1.0, 'peak_bytes': 2.0}}
+
+    :param results: Dataframe with benchmark results
+
+    :return: Dataframe with exponent of time ('seconds') and memory ('peak_bytes') per stage
+    """
+    def slope(df: pd.DataFrame, column: str) -> float:
+        return np.polyfit(np.log(df["rows"]), np.log(df[column].clip(lower=1e-9)), 1)[0]
+
+    return pd.DataFrame({stage: {"seconds": slope(df, "seconds"), "peak_bytes": slope(df, "peak_bytes")}
+                         for stage, df in results.groupby("stage")}).T
+
+
+def run_benchmarks(sizes: List[Tuple[int, int, int]] = None, repeats: int = REPEATS,
+                   max_exponent: float = MAX_SCALING_EXPONENT) -> Tuple[pd.DataFrame, List[str]]:
+    """Run scaling benchmarks of all stages and check their growth.
+
+    :param sizes: list of league sizes (teams, players per team, games)
+    :param repeats: number of timed runs of every stage
+    :param max_exponent: maximal allowed scaling exponent of time and memory
+
+    :return: tuple with Dataframe of results and list of failures (stages growing worse than linearly)
+    """
+    sizes = sizes or SIZES
+    results = []
+    for n_teams, players_per_team, n_games in sizes:
+        with tempfile.TemporaryDirectory() as root:
+            results += benchmark_league(Path(root), n_teams, players_per_team, n_games, repeats)
+
+    df_results = pd.DataFrame(results)
+    exponents = scaling_exponents(df_results)
+    print(f"Scaling exponents:\n{exponents.round(2)}")
+
+    failures = [f"Stage [{stage}] {metric} grows with exponent [{exponent:.2f}] > [{max_exponent}]"
+                for stage, row in exponents.iterrows() for metric, exponent in row.items() if exponent > max_exponent]
+
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    df_results.to_csv(RESULTS_DIR / f"scaling_{time.strftime('%Y%m%d_%H%M%S')}.csv", index=False)
+
+    return df_results, failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run scaling benchmarks of loading, analysis and DB parsing stages.")
+    parser.add_argument("--multi-season", action="store_true",
+                        help="add leagues with game logs of 10 and 100 seasons (10x and 100x of one season)")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="number of timed runs of every stage")
+    args = parser.parse_args()
+
+    _, scaling_failures = run_benchmarks(SIZES + MULTI_SEASON_SIZES if args.multi_season else SIZES, args.repeats)
+    for failure in scaling_failures:
+        print(failure)
+    sys.exit(1 if scaling_failures else 0)
@@ -0,0 +1,247 @@
+"""Module storing persistent catalog of teams, players and their downloaded files keyed by API id.
+
+Catalog is written during fetching and replaces recovering of ids and names from filenames (and globbing of
+directories) by readers: every team, player and downloaded file is looked up by its API id through a primary key.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from utils import FILES_DIR
+from archive import Archive
+
+CATALOG_PATH: Path = FILES_DIR / "catalog.sqlite"
+
+# location of files stored loosely in FILES_DIR/<kind>/<key>.json; archived files store path to archive segment
+LOOSE_FILES: str = ""
+
+CREATE_CATALOG_TABLES_QUERY: str = """
+CREATE TABLE IF NOT EXISTS teams
+(
+    api_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    abbreviation TEXT
+);
+CREATE TABLE IF NOT EXISTS players
+(
+    api_id INTEGER PRIMARY KEY,
+    full_name TEXT NOT NULL,
+    team_api_id INTEGER,
+    position TEXT,
+    position_type TEXT
+);
+CREATE TABLE IF NOT EXISTS files
+(
+    kind TEXT NOT NULL,
+    api_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    location TEXT NOT NULL,
+    fetched_at REAL,
+    content_hash TEXT,
+    PRIMARY KEY (kind, api_id)
+);
+CREATE INDEX IF NOT EXISTS files_key ON files(kind, key);
+CREATE INDEX IF NOT EXISTS players_team ON players(team_api_id);
+"""
+
+
+def content_hash(data: bytes) -> str:
+    """Get hash of downloaded content.
+
+    >>> content_hash(b'{"roster": []}')
+    '836d9baf95c73bfacf9e65105a35ec21131a58cc'
+    """
+    return hashlib.sha1(data).hexdigest()
+
+
+class Catalog:
+    """Teams, players and their downloaded files (team rosters, player bios & game logs) stored in SQLite database.
+
+    NOTES
+    -----
+    File kind is the name of the sub-folder (archive endpoint) of the file, e.g. 'team_roster', 'players' or
+    'player_stats'. Content hash and fetch time of files are captured by save function returned by tracking_save(),
+    which is passed into fetch_files() instead of save_json(). Catalog depends only on FILES_DIR of utils, so it can be
+    used by db_connection scripts as well.
+
+    USAGE
+    _____
+    >>> async def run():
+    ...     with Catalog() as catalog:
+    ...         roster_filenames = await get_all_team_rosters(catalog=catalog)
+    ...         await get_player_stats(roster_filenames, catalog=catalog)
+    ...         return load_player_stats_by_id(8478402, catalog)
+    """
+    def __init__(self, path: Path = CATALOG_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.executescript(CREATE_CATALOG_TABLES_QUERY)
+
+        self._fetched: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._archives: Dict[str, Archive] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        for archive in self._archives.values():
+            archive.close()
+        self.connection.close()
+
+    def tracking_save(self, save: Callable) -> Callable:
+        """Wrap save function, so that content hash and fetch time of every saved file are captured.
+
+        :param save: function storing downloaded data (utils.save_json() or Archive.save())
+
+        :return: save function with the same signature as save_json()
+        """
+        def tracked(data: bytes, filename: str, subfolder: str) -> None:
+            save(data, filename, subfolder)
+            with self._lock:
+                self._fetched[(subfolder, filename.lower().removesuffix(".json"))] = (content_hash(data), time.time())
+
+        return tracked
+
+    def add_teams(self, teams: Iterable[Tuple[int, str, Optional[str]]]) -> None:
+        """Insert or update teams.
+
+        :param teams: iterable of (api_id, name, abbreviation) tuples
+
+        :return: None
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO teams(api_id, name, abbreviation) VALUES(?, ?, ?) "
+                "ON CONFLICT(api_id) DO UPDATE SET name = excluded.name, abbreviation = excluded.abbreviation",
+                teams
+            )
+
+    def add_players(self, players: Iterable[Tuple[int, str, Optional[int], Optional[str], Optional[str]]]) -> None:
+        """Insert or update players; known team of a player is kept, when new team is not known.
+
+        :param players: iterable of (api_id, full_name, team_api_id, position, position_type) tuples
+
+        :return: None
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO players(api_id, full_name, team_api_id, position, position_type) VALUES(?, ?, ?, ?, ?) "
+                "ON CONFLICT(api_id) DO UPDATE SET full_name = excluded.full_name, "
+                "team_api_id = COALESCE(excluded.team_api_id, team_api_id), position = excluded.position, "
+                "position_type = excluded.position_type",
+                players
+            )
+
+    def add_files(self, kind: str, files: Iterable[Tuple[int, str]], archive: Archive = None,
+                  hashes: Dict[str, Tuple[str, float]] = None) -> int:
+        """Register downloaded files.
+
+        NOTES
+        -----
+        Content hash and fetch time are taken from hashes, or from files captured by tracking_save().
+
+        :param kind: file kind (sub-folder or archive endpoint)
+        :param files: iterable of (api_id, key) tuples, where key is filename without extension
+        :param archive: archive storing the files; files are stored loosely if not selected
+        :param hashes: dictionary {key: (content hash, fetch time)}
+
+        :return: number of registered files
+        """
+        location = str(archive.path.resolve()) if archive is not None else LOOSE_FILES
+        with self._lock:
+            rows = []
+            for api_id, key in files:
+                key = key.lower()
+                fetched = (hashes or {}).get(key) or self._fetched.pop((kind, key), (None, None))
+                rows.append((kind, api_id, key, location, fetched[1], fetched[0]))
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO files(kind, api_id, key, location, fetched_at, content_hash) "
+                "VALUES(?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        return len(rows)
+
+    def team(self, api_id: int) -> Optional[sqlite3.Row]:
+        return self.connection.execute("SELECT * FROM teams WHERE api_id = ?", (api_id,)).fetchone()
+
+    def player(self, api_id: int) -> Optional[sqlite3.Row]:
+        return self.connection.execute("SELECT * FROM players WHERE api_id = ?", (api_id,)).fetchone()
+
+    def file(self, kind: str, api_id: int) -> Optional[sqlite3.Row]:
+        return self.connection.execute("SELECT * FROM files WHERE kind = ? AND api_id = ?", (kind, api_id)).fetchone()
+
+    def file_by_key(self, kind: str, key: str) -> Optional[sqlite3.Row]:
+        return self.connection.execute("SELECT * FROM files WHERE kind = ? AND key = ?", (kind, key.lower())).fetchone()
+
+    def files(self, kind: str, api_ids: Iterable[int] = None) -> List[sqlite3.Row]:
+        """Get registered files of given kind ordered by API id.
+
+        :param kind: file kind (sub-folder or archive endpoint)
+        :param api_ids: API ids of teams or players; all files of the kind are returned if not selected
+
+        :return: list of file rows
+        """
+        if api_ids is not None:
+            return [row for row in (self.file(kind, api_id) for api_id in sorted(set(api_ids))) if row is not None]
+        return self.connection.execute("SELECT * FROM files WHERE kind = ? ORDER BY api_id", (kind,)).fetchall()
+
+    def players(self, team_api_ids: Iterable[int] = None, skaters_only: bool = True) -> List[sqlite3.Row]:
+        """Get players ordered by API id.
+
+        :param team_api_ids: API ids of teams; players of all teams are returned if not selected
+        :param skaters_only: leave out goalies (they have no skater game logs)
+
+        :return: list of player rows
+        """
+        query, params = "SELECT * FROM players", []
+        if team_api_ids is not None:
+            team_api_ids = list(team_api_ids)
+            query += f" WHERE team_api_id IN ({', '.join('?' * len(team_api_ids))})"
+            params = team_api_ids
+        rows = self.connection.execute(query + " ORDER BY api_id", params).fetchall()
+        return [row for row in rows if not (skaters_only and row["position"] == "Goalie")]
+
+    def archive(self, location: str) -> Optional[Archive]:
+        """Get opened archive of given location; None for loose files."""
+        if location == LOOSE_FILES:
+            return None
+        if location not in self._archives:
+            self._archives[location] = Archive(Path(location))
+        return self._archives[location]
+
+    def file_path(self, row: sqlite3.Row, files_dir: Path = FILES_DIR) -> Path:
+        """Get path of registered loose file (or key of archived file as path)."""
+        if row["location"] == LOOSE_FILES:
+            return files_dir / row["kind"] / (row["key"] + ".json")
+        return Path(row["key"])
+
+    def load_json(self, kind: str, api_id: int, files_dir: Path = FILES_DIR) -> dict:
+        """Read registered file from its location.
+
+        :param kind: file kind (sub-folder or archive endpoint)
+        :param api_id: API id of the team or player
+        :param files_dir: path to files directory with loose files
+
+        :return: JSON data
+        """
+        row = self.file(kind, api_id)
+        if row is None:
+            raise KeyError(f"File [{kind}] of [{api_id}] is not registered in catalog")
+
+        archive = self.archive(row["location"])
+        if archive is not None:
+            return archive.load_json(kind, row["key"])
+        with open(self.file_path(row, files_dir), encoding="utf-8") as fh:
+            return json.load(fh)
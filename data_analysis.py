@@ -1,105 +1,337 @@
 """Module storing few functions for analyzing data retrieved from NHL API"""
 import numpy as np
 import pandas as pd
-import re
-from typing import Dict, List
+from typing import Dict, List, Iterable, Optional
+from profiling import profile_stage
 
 # number of matches, which should be considering for some stats
 AVERAGE_STATS_PERIOD: int = 5
 OFF_FIRE_PERIOD: int = 3
 
+# columns used for ranking players within team (in order of priority)
+TOP_SCORER_SORT_COLUMNS: List[str] = ["goals_last_5", "goals_last_10", "goals_total", "shots_avg", "shot_efficiency",
+                                      "time_on_ice_min", "powerplay_time_min"]
+OFF_FIRE_SORT_COLUMNS: List[str] = ["goals_last_15", "assists_last_3", "goals_total", "shots_avg", "shot_efficiency",
+                                    "time_on_ice_min", "powerplay_time_min"]
 
-def convert_time_to_seconds(data: pd.DataFrame, column_name: str) -> int:
-    """Small transformation function for converting time from mm:ss format into seconds.
+# column of "goals in last K games" swept by sweep_scorer_reports()
+SWEEP_WINDOW_COLUMN: str = "goals_last_window"
+
+# precision of window means
+MEAN_DECIMALS: int = 9
+
+# game log columns, for which window sums & means are available
+WINDOW_COLUMNS: List[str] = ["goals", "assists", "points", "shots", "shotPct", "time_on_ice_seconds",
+                             "time_power_play_seconds"]
+
+
+def convert_time_column_to_seconds(data: pd.DataFrame, column_name: str) -> pd.Series:
+    """Vectorized transformation of time column from mm:ss format into seconds.
+
+    USAGE
+    _____
+    >>> convert_time_column_to_seconds(pd.DataFrame({"toi": ["18:05", "00:45", None]}), "toi").tolist()
+    [1085, 45, 0]
 
     :param data: Dataframe
     :param column_name: name of the column storing time data
 
-    :return: time converted to number of seconds
+    :return: Series with time converted to number of seconds
     """
-    time = data[column_name]
-    try:
-        m = int(str(time[:2]).lstrip("0"))
-        s = int(str(time[3:]).lstrip("0"))
-    except (ValueError, TypeError):
-        m = 0
-        s = 0
+    if column_name not in data:
+        return pd.Series(0, index=data.index)
 
-    total_s = m*60 + s
+    parts = data[column_name].astype("string").str.split(":", n=1, expand=True).reindex(columns=[0, 1])
+    minutes = pd.to_numeric(parts[0], errors="coerce").fillna(0)
+    seconds = pd.to_numeric(parts[1], errors="coerce").fillna(0)
 
-    return total_s
+    return (minutes * 60 + seconds).astype(int)
 
 
-def show_top_scorer_stats_from_schedule_matches(data: pd.DataFrame, top_n_players: int = 5,
-                                                average_stats_period: int = AVERAGE_STATS_PERIOD) -> pd.DataFrame:
+class WindowStore:
+    """Per-player prefix sums over date-ordered game log, which make any "last K games" sum or mean O(1) per player.
+
+    NOTES
+    -----
+    Game log rows of every (name, team) player are ordered from the most recent match, so "last K games" are the first
+    K rows of the player. For each column a cumulative sum over all rows (and cumulative count of non-missing values)
+    is stored, therefore window sum is just a difference of two array items and windows of all players (or a whole
+    grid of windows) are computed with a single vectorized operation.
+
+    USAGE
+    _____
+    >>> log = pd.DataFrame({"name": ["A", "A", "A", "B"], "team": ["X", "X", "X", "X"], "goals": [1, 0, 2, 1],
+    ...                     "match_date": ["2023-01-03", "2023-01-01", "2023-01-02", "2023-01-01"]})
+    >>> store = WindowStore(log, columns=["goals"])
+    >>> store.window_sum("goals", 2).tolist()
+    [3.0, 1.0]
+    >>> store.window_sum("goals").tolist()
+    [3.0, 1.0]
+    >>> store.window_mean("goals", 1).tolist()
+    [1.0, 1.0]
     """
+    def __init__(self, data: pd.DataFrame, columns: Iterable[str] = WINDOW_COLUMNS):
+        df = data.reset_index(drop=True)
+        df = df.assign(time_on_ice_seconds=convert_time_column_to_seconds(df, "timeOnIce"),
+                       time_power_play_seconds=convert_time_column_to_seconds(df, "powerPlayTimeOnIce"))
+        df = df.sort_values(["name", "team", "match_date"], ascending=[True, True, False], kind="mergesort")
+
+        # boundaries of every player's rows within sorted game log
+        new_player = (df["name"].ne(df["name"].shift()) | df["team"].ne(df["team"].shift())).to_numpy()
+        self.starts: np.ndarray = np.flatnonzero(new_player)
+        self.counts: np.ndarray = np.diff(np.append(self.starts, len(df)))
+        self.players: pd.DataFrame = df.iloc[self.starts][["name", "team"]].reset_index(drop=True)
+
+        self.sums: Dict[str, np.ndarray] = {}
+        self.valid: Dict[str, np.ndarray] = {}
+        for column in columns:
+            values = pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=float) if column in df \
+                else np.full(len(df), np.nan)
+            is_valid = ~np.isnan(values)
+            self.sums[column] = np.concatenate([[0.0], np.cumsum(np.where(is_valid, values, 0.0))])
+            self.valid[column] = np.concatenate([[0], np.cumsum(is_valid)])
+
+    def _ends(self, window) -> np.ndarray:
+        """Get end offsets of windows; window can be None (all games), int or array of ints (grid of windows)."""
+        if window is None:
+            return self.starts + self.counts
+        window = np.asarray(window)
+        if window.ndim == 0:
+            return self.starts + np.minimum(self.counts, window)
+        return self.starts[:, None] + np.minimum(self.counts[:, None], window[None, :])
+
+    def _starts(self, window) -> np.ndarray:
+        return self.starts[:, None] if np.ndim(window) == 1 else self.starts
+
+    def window_sum(self, column: str, window=None) -> np.ndarray:
+        """Get sum of the column over last `window` games of every player.
+
+        :param column: name of the game log column
+        :param window: number of last games; int, array of ints (returns 2D array player x window) or None (all games)
+
+        :return: array of sums aligned with players
+        """
+        return self.sums[column][self._ends(window)] - self.sums[column][self._starts(window)]
+
+    def window_count(self, column: str, window=None) -> np.ndarray:
+        """Get number of non-missing values of the column over last `window` games of every player."""
+        return self.valid[column][self._ends(window)] - self.valid[column][self._starts(window)]
+
+    def window_mean(self, column: str, window=None) -> np.ndarray:
+        """Get mean of the column (missing values skipped) over last `window` games of every player.
 
-    :param data:
-    :param matches:
-    :param top_n_players:
-    :param average_stats_period:
+        :param column: name of the game log column
+        :param window: number of last games; int, array of ints (returns 2D array player x window) or None (all games)
+
+        :return: array of means aligned with players; NaN for players without any value
+        """
+        counts = self.window_count(column, window)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # rounding removes noise of prefix sum differences, so equal means stay equal when ranking ties
+            return np.where(counts > 0, np.round(self.window_sum(column, window) / counts, MEAN_DECIMALS), np.nan)
+
+
+def _rank_within_team(df_agg: pd.DataFrame, sort_columns: List[str]) -> pd.DataFrame:
+    """Sort aggregated stats by team and given columns (descending) and add rank of the player within his team."""
+    df_agg = df_agg.sort_values(["team"] + sort_columns, ascending=False)
+    df_agg["group_rank"] = df_agg.groupby("team")["name"].transform("cumcount")
+    return df_agg
+
+
+def top_scorer_aggregates(store: WindowStore, average_stats_period: int = AVERAGE_STATS_PERIOD) -> pd.DataFrame:
+    """Aggregate stats of every player used by top scorers report.
+
+    :param store: window store with player game logs
+    :param average_stats_period: number of last matches used for average stats
+
+    :return: new Dataframe with one row per player
+    """
+    return store.players.assign(
+        goals_total=store.window_sum("goals").astype(int),
+        goals_last_5=store.window_sum("goals", 5),
+        goals_last_10=store.window_sum("goals", 10),
+        assists_total=store.window_sum("assists").astype(int),
+        shot_efficiency=store.window_mean("shotPct", average_stats_period),
+        shots_avg=store.window_mean("shots", average_stats_period),
+        time_on_ice_min=store.window_mean("time_on_ice_seconds", average_stats_period) / 60,
+        powerplay_time_min=store.window_mean("time_power_play_seconds", average_stats_period) / 60
+    )
+
+
+def rank_top_scorers(df_agg: pd.DataFrame, top_n_players: int = 5,
+                     sort_columns: List[str] = TOP_SCORER_SORT_COLUMNS) -> pd.DataFrame:
+    """Rank players of every team by top scorers aggregates and keep top n of them.
+
+    :param df_agg: Dataframe with top scorer aggregates
+    :param top_n_players: number of players shown for every team
+    :param sort_columns: columns used for ranking players within team (in order of priority)
 
     :return: new Dataframe with top scorers stats
     """
-    df = data.reset_index()
-    df["time_on_ice_seconds"] = df.apply(convert_time_to_seconds, args=("timeOnIce",), axis=1)
-    df["time_power_play_seconds"] = df.apply(convert_time_to_seconds, args=("powerPlayTimeOnIce",), axis=1)
-    df_agg = df.assign(
-        goals_total=df["goals"],
-        assists_total=df["assists"],
-        goals_last_5=df[df["index"] < 5]["goals"],
-        goals_last_10=df[df["index"] < 10]["goals"],
-        time_on_ice_min=df[df["index"] < average_stats_period]["time_on_ice_seconds"],
-        powerplay_time_min=df[df["index"] < average_stats_period]["time_power_play_seconds"],
-        shot_efficiency=df[df["index"] < average_stats_period]["shotPct"],
-        shots_avg=df[df["index"] < average_stats_period]["shots"]
-    ).groupby(["name", "team"]).agg({"goals_total": sum, "goals_last_5": sum, "goals_last_10": sum, "assists_total": sum,
-                                     "shot_efficiency": np.mean, "shots_avg": np.mean,
-                                     "time_on_ice_min": lambda x: np.mean(x)/60,
-                                     "powerplay_time_min": lambda x: np.mean(x)/60}).reset_index()
-    df_agg.sort_values(["team", "goals_last_5", "goals_last_10", "goals_total", "shots_avg", "shot_efficiency",
-                        "time_on_ice_min", "powerplay_time_min", ], ascending=False, inplace=True)
-    df_agg["group_rank"] = df_agg.groupby("team")["name"].transform("cumcount")
+    df_agg = _rank_within_team(df_agg, sort_columns)
+
+    return df_agg[df_agg["group_rank"] < top_n_players]
+
+
+def off_fire_aggregates(store: WindowStore, average_stats_period: int = AVERAGE_STATS_PERIOD,
+                        off_fire_period: int = OFF_FIRE_PERIOD) -> pd.DataFrame:
+    """Aggregate stats of every player used by off fire scorers report.
 
-    df_top_scorers = df_agg[df_agg["group_rank"] < top_n_players]
+    :param store: window store with player game logs
+    :param average_stats_period: number of last matches used for average stats
+    :param off_fire_period: number of last matches without a goal
+
+    :return: new Dataframe with one row per player
+    """
+    return store.players.assign(
+        goals_total=store.window_sum("goals").astype(int),
+        goals_last_15=store.window_sum("goals", 15),
+        assists_total=store.window_sum("assists").astype(int),
+        shot_efficiency=store.window_mean("shotPct", average_stats_period),
+        shots_avg=store.window_mean("shots", average_stats_period),
+        goals_last_3=store.window_sum("goals", off_fire_period),
+        time_on_ice_min=store.window_mean("time_on_ice_seconds", average_stats_period) / 60,
+        assists_last_3=store.window_sum("assists", off_fire_period),
+        powerplay_time_min=store.window_mean("time_power_play_seconds", average_stats_period) / 60
+    )
+
+
+def rank_off_fire_scorers(df_agg: pd.DataFrame, top_n_players: int = 5,
+                          sort_columns: List[str] = OFF_FIRE_SORT_COLUMNS) -> pd.DataFrame:
+    """Rank players of every team by off fire aggregates and keep top n of them, who did not score recently.
+
+    :param df_agg: Dataframe with off fire aggregates
+    :param top_n_players: number of top players of every team considered
+    :param sort_columns: columns used for ranking players within team (in order of priority)
+
+    :return: new Dataframe with off fire scorers stats
+    """
+    df_agg = _rank_within_team(df_agg, sort_columns)
+
+    return df_agg[(df_agg["group_rank"] < top_n_players) & (df_agg["goals_last_3"] == 0)]
+
+
+@profile_stage()
+def show_top_scorer_stats_from_schedule_matches(data: pd.DataFrame, top_n_players: int = 5,
+                                                average_stats_period: int = AVERAGE_STATS_PERIOD,
+                                                store: WindowStore = None) -> pd.DataFrame:
+    """Show players of every team, who are "on fire" - scoring the most goals in recent matches.
+
+    :param data: Dataframe with player stats game logs
+    :param top_n_players: number of players shown for every team
+    :param average_stats_period: number of last matches used for average stats
+    :param store: window store built from data; it is built if not selected (it can be shared between reports)
+
+    :return: new Dataframe with top scorers stats
+    """
+    store = store or WindowStore(data)
+    df_top_scorers = rank_top_scorers(top_scorer_aggregates(store, average_stats_period), top_n_players)
 
     return df_top_scorers
 
 
+@profile_stage()
 def show_off_fire_scorer_stats_from_schedule_matches(data: pd.DataFrame, top_n_players: int = 5,
                                                      average_stats_period: int = AVERAGE_STATS_PERIOD,
-                                                     off_fire_period: int = OFF_FIRE_PERIOD) -> pd.DataFrame:
-    """
+                                                     off_fire_period: int = OFF_FIRE_PERIOD,
+                                                     store: WindowStore = None) -> pd.DataFrame:
+    """Show top players of every team, who are "off fire" - without a goal in the most recent matches.
 
-    :param data:
-    :param matches:
-    :param top_n_players:
-    :param average_stats_period:
-    :param off_fire_period:
+    :param data: Dataframe with player stats game logs
+    :param top_n_players: number of top players of every team considered
+    :param average_stats_period: number of last matches used for average stats
+    :param off_fire_period: number of last matches without a goal
+    :param store: window store built from data; it is built if not selected (it can be shared between reports)
 
     :return: new Dataframe with top scorers stats
     """
-    df = data.reset_index()
-    df["time_on_ice_seconds"] = df.apply(convert_time_to_seconds, args=("timeOnIce",), axis=1)
-    df["time_power_play_seconds"] = df.apply(convert_time_to_seconds, args=("powerPlayTimeOnIce",), axis=1)
-    df_agg = df.assign(
-        goals_total=df["goals"],
-        assists_total=df["assists"],
-        assists_last_3=df[df["index"] < off_fire_period]["assists"],
-        goals_last_3=df[df["index"] < off_fire_period]["goals"],
-        goals_last_15=df[df["index"] < 15]["goals"],
-        time_on_ice_min=df[df["index"] < average_stats_period]["time_on_ice_seconds"],
-        powerplay_time_min=df[df["index"] < average_stats_period]["time_power_play_seconds"],
-        shot_efficiency=df[df["index"] < average_stats_period]["shotPct"],
-        shots_avg=df[df["index"] < average_stats_period]["shots"]
-    ).groupby(["name", "team"]).agg({"goals_total": sum, "goals_last_15": sum, "assists_total": sum,
-                                     "shot_efficiency": np.mean, "shots_avg": np.mean, "goals_last_3": sum,
-                                     "time_on_ice_min": lambda x: np.mean(x)/60, "assists_last_3": sum,
-                                     "powerplay_time_min": lambda x: np.mean(x)/60}).reset_index()
-    df_agg.sort_values(["team", "goals_last_15", "assists_last_3", "goals_total", "shots_avg", "shot_efficiency",
-                        "time_on_ice_min", "powerplay_time_min", ], ascending=False, inplace=True)
-    df_agg["group_rank"] = df_agg.groupby("team")["name"].transform("cumcount")
-
-    df_top_scorers = df_agg[(df_agg["group_rank"] < top_n_players) & (df_agg["goals_last_3"] == 0)]
+    store = store or WindowStore(data)
+    df_top_scorers = rank_off_fire_scorers(off_fire_aggregates(store, average_stats_period, off_fire_period),
+                                           top_n_players)
 
     return df_top_scorers
+
+
+def _sort_columns(report_sort_columns: List[str], sort_key: Optional[str]) -> List[str]:
+    """Replace goal window of report sort columns (the first one) by swept window and put sort key in front of them."""
+    sort_columns = [SWEEP_WINDOW_COLUMN] + report_sort_columns[1:]
+    if sort_key is None:
+        return sort_columns
+    return [sort_key] + [column for column in sort_columns if column != sort_key]
+
+
+def sweep_scorer_reports(data: pd.DataFrame, windows: Iterable[int] = range(1, 21),
+                         top_n_values: Iterable[int] = (3, 5, 10), sort_keys: Iterable[Optional[str]] = (None,),
+                         off_fire_periods: Iterable[int] = (OFF_FIRE_PERIOD,),
+                         average_stats_period: int = AVERAGE_STATS_PERIOD, store: WindowStore = None) -> pd.DataFrame:
+    """Evaluate both scorer reports for a whole grid of (window, top_n, sort key) configurations.
+
+    NOTES
+    -----
+    Every configuration is ranked by the same aggregate and ranking functions as the reports themselves:
+        - window K is the "goals in last K games" column ranking players first (goals_last_5 of top scorers report,
+          goals_last_15 of off fire report); it is stored in goals_last_window column,
+        - off fire period is off_fire_period of off fire report,
+        - sort key is aggregate column (e.g. "goals_total" or "shots_avg") put in front of report sort columns;
+          None keeps report sort columns.
+    Goal sums of all windows come from a single vectorized window store query (player x window grid) and players are
+    ranked once per (window, sort key) for the largest top_n; smaller top_n values only filter the ranking.
+
+    USAGE
+    _____
+    >>> rng = np.random.default_rng(0)
+    >>> log = pd.DataFrame({"name": np.repeat(list("ABCDEF"), 20), "team": np.repeat(["X", "Y"], 60),
+    ...                     "match_date": np.tile(pd.date_range("2023-01-01", periods=20).astype(str), 6),
+    ...                     "goals": rng.poisson(0.4, 120), "assists": rng.poisson(0.5, 120),
+    ...                     "shots": rng.poisson(2, 120), "timeOnIce": "15:00"})
+    >>> sweep = sweep_scorer_reports(log, windows=[3, 5, 15], top_n_values=[2, 3])
+    >>> def sweep_point(report: str, window: int) -> pd.DataFrame:
+    ...     return sweep[(sweep["report"] == report) & (sweep["window"] == window) & (sweep["top_n"] == 3)]
+    >>> direct = show_top_scorer_stats_from_schedule_matches(log, top_n_players=3)
+    >>> sweep_point("on_fire", 5)[direct.columns].reset_index(drop=True).equals(direct.reset_index(drop=True))
+    True
+    >>> direct = show_off_fire_scorer_stats_from_schedule_matches(log, top_n_players=3)
+    >>> sweep_point("off_fire", 15)[direct.columns].reset_index(drop=True).equals(direct.reset_index(drop=True))
+    True
+    >>> sweep_point("on_fire", 15)[["name", "goals_last_window", "goals_last_5"]].values.tolist()[:3]
+    [['F', 12.0, 2.0], ['D', 8.0, 2.0], ['E', 6.0, 1.0]]
+
+    :param data: Dataframe with player stats game logs
+    :param windows: numbers of last games, whose goals rank players first
+    :param top_n_values: numbers of top players of every team
+    :param sort_keys: aggregate columns ranked first; None for report sort columns
+    :param off_fire_periods: numbers of last matches without a goal
+    :param average_stats_period: number of last matches used for average stats
+    :param store: window store built from data; it is built if not selected
+
+    :return: Dataframe with report columns and configuration columns report, sort_key, window, off_fire_period, top_n
+    """
+    windows, top_n_values = list(windows), sorted(top_n_values)
+    store = store or WindowStore(data)
+
+    # goals of every player in last K games for all windows at once (player x window)
+    window_goals = store.window_sum("goals", windows)
+    top = top_scorer_aggregates(store, average_stats_period)
+    off = {period: off_fire_aggregates(store, average_stats_period, period) for period in off_fire_periods}
+
+    def configurations(df_ranked: pd.DataFrame, **params) -> List[pd.DataFrame]:
+        return [df_ranked[df_ranked["group_rank"] < top_n].assign(**params, top_n=top_n) for top_n in top_n_values]
+
+    frames = []
+    for index, window in enumerate(windows):
+        goals = {SWEEP_WINDOW_COLUMN: window_goals[:, index]}
+        for sort_key in sort_keys:
+            on_fire = rank_top_scorers(top.assign(**goals), top_n_values[-1],
+                                       _sort_columns(TOP_SCORER_SORT_COLUMNS, sort_key))
+            frames += configurations(on_fire, report="on_fire", sort_key=sort_key, window=window,
+                                     off_fire_period=None)
+            for period, df_agg in off.items():
+                off_fire = rank_off_fire_scorers(df_agg.assign(**goals), top_n_values[-1],
+                                                 _sort_columns(OFF_FIRE_SORT_COLUMNS, sort_key))
+                frames += configurations(off_fire, report="off_fire", sort_key=sort_key, window=window,
+                                         off_fire_period=period)
+
+    if not frames:
+        return pd.DataFrame(columns=["report", "sort_key", "window", "off_fire_period", "top_n"])
+
+    return pd.concat(frames, ignore_index=True)
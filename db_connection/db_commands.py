@@ -1,9 +1,17 @@
+import uuid
 import psycopg2
 from logging import Logger
-from typing import List, Tuple, Any
-from utils import MyDBConnectionFetch, MyDBConnectionTransaction
+from typing import List, Tuple, Any, Dict, Iterator, Union
+import numpy as np
+import pandas as pd
+from utils import (MyDBConnectionFetch, MyDBConnectionTransaction, records_to_dataframe, records_to_numpy,
+                   profile_stage)
 
+# number of rows transferred from server-side cursor at once
+CHUNK_SIZE: int = 10000
 
+
+@profile_stage()
 def insert_many_db(db_configuration: dict, query: str, logger: Logger, values: List[Tuple[Any, ...]]) -> str:
     try:
         with MyDBConnectionTransaction(configuration_parameters=db_configuration, logger=logger) as (conn, cur):
@@ -16,6 +24,7 @@ def insert_many_db(db_configuration: dict, query: str, logger: Logger, values: L
         return query
 
 
+@profile_stage()
 def update_db(db_configuration: dict, query: str, logger: Logger) -> str:
     try:
         with MyDBConnectionTransaction(configuration_parameters=db_configuration, logger=logger) as (conn, cur):
@@ -28,6 +37,7 @@ def update_db(db_configuration: dict, query: str, logger: Logger) -> str:
         return query
 
 
+@profile_stage()
 def fetch_from_db(db_configuration: dict, query: str, logger: Logger) -> List[Tuple[Any, ...]]:
     try:
         with MyDBConnectionFetch(configuration_parameters=db_configuration, logger=logger) as (conn, cur):
@@ -39,3 +49,42 @@ def fetch_from_db(db_configuration: dict, query: str, logger: Logger) -> List[Tu
     else:
         return cur.fetchall()
 
+
+@profile_stage()
+def fetch_from_db_chunked(db_configuration: dict, query: str, logger: Logger, chunk_size: int = CHUNK_SIZE,
+                          dtypes: Dict[str, Any] = None,
+                          as_numpy: bool = False) -> Iterator[Union[pd.DataFrame, Dict[str, np.ndarray]]]:
+    """Stream result of a large query in chunks through server-side cursor, so memory usage stays bounded.
+
+    USAGE
+    _____
+    >>> for df in fetch_from_db_chunked(config, SELECT_PLAYER_STATS_QUERY, logger, dtypes=PLAYER_STATS_DTYPES):
+    ...     process(df)
+
+    :param db_configuration: DB connection parameters
+    :param query: select statement
+    :param logger: Logger object
+    :param chunk_size: number of rows in one chunk
+    :param dtypes: dictionary {column: dtype} used for typing of the chunks
+    :param as_numpy: yield dictionaries {column: array} instead of Dataframes
+
+    :return: iterator of Dataframe (or NumPy column) chunks
+    """
+    build_chunk = records_to_numpy if as_numpy else records_to_dataframe
+    try:
+        with MyDBConnectionFetch(configuration_parameters=db_configuration, logger=logger,
+                                 cursor_name=f"chunked_{uuid.uuid4().hex}", itersize=chunk_size) as (conn, cur):
+            try:
+                cur.execute(query)
+                while rows := cur.fetchmany(chunk_size):
+                    yield build_chunk(rows, [column.name for column in cur.description], dtypes)
+            finally:
+                # server-side cursor is closed before its connection, also when the consumer stops early
+                cur.close()
+    # errors are re-raised, so a failure in the middle of the stream is never seen as complete (truncated) result
+    except psycopg2.Error as err:
+        logger.exception("Postgres database connector related error occurred", exc_info=err)
+        raise
+    except Exception as err:
+        logger.exception("Unhanded non database connector related error occurred", exc_info=err)
+        raise
@@ -1,9 +1,16 @@
 from asyncpg.pool import Pool
 import asyncpg
-from typing import Tuple, Any, List
+from typing import Tuple, Any, List, Dict, AsyncIterator, Union
 from logging import Logger
+import numpy as np
+import pandas as pd
+from utils import records_to_dataframe, records_to_numpy, profile_stage
 
+# number of rows transferred from server-side cursor at once
+CHUNK_SIZE: int = 10000
 
+
+@profile_stage()
 async def update_db_async(pool: Pool, query: str, values: List[tuple], logger: Logger) -> str:
     try:
         async with pool.acquire() as conn:
@@ -13,3 +20,44 @@ async def update_db_async(pool: Pool, query: str, values: List[tuple], logger: L
         logger.exception("Postgres database connector related error occurred", exc_info=err)
     except Exception as err:
         logger.exception("Unhanded non database connector related error occurred", exc_info=err)
+
+
+@profile_stage()
+async def fetch_db_chunked_async(pool: Pool, query: str, logger: Logger, *args, chunk_size: int = CHUNK_SIZE,
+                                 dtypes: Dict[str, Any] = None,
+                                 as_numpy: bool = False) -> AsyncIterator[Union[pd.DataFrame, Dict[str, np.ndarray]]]:
+    """Stream result of a large query in chunks through asyncpg server-side cursor, so memory usage stays bounded.
+
+    USAGE
+    _____
+    >>> async for df in fetch_db_chunked_async(pool, SELECT_PLAYER_STATS_QUERY, logger, dtypes=PLAYER_STATS_DTYPES):
+    ...     process(df)
+
+    :param pool: asyncpg connection pool
+    :param query: select statement
+    :param logger: Logger object
+    :param args: query arguments
+    :param chunk_size: number of rows in one chunk
+    :param dtypes: dictionary {column: dtype} used for typing of the chunks
+    :param as_numpy: yield dictionaries {column: array} instead of Dataframes
+
+    :return: asynchronous iterator of Dataframe (or NumPy column) chunks
+    """
+    build_chunk = records_to_numpy if as_numpy else records_to_dataframe
+    try:
+        async with pool.acquire() as conn:
+            # cursors can be used only within a transaction; asyncpg cursor has no close(), it is closed on the server
+            # when its transaction ends (also when the consumer stops early or the stream fails)
+            async with conn.transaction():
+                statement = await conn.prepare(query)
+                columns = [attribute.name for attribute in statement.get_attributes()]
+                cursor = await statement.cursor(*args)
+                while rows := await cursor.fetch(chunk_size):
+                    yield build_chunk(rows, columns, dtypes)
+    # errors are re-raised, so a failure in the middle of the stream is never seen as complete (truncated) result
+    except asyncpg.PostgresError as err:
+        logger.exception("Postgres database connector related error occurred", exc_info=err)
+        raise
+    except Exception as err:
+        logger.exception("Unhanded non database connector related error occurred", exc_info=err)
+        raise
@@ -0,0 +1,254 @@
+"""Module storing dependency-aware concurrent loader of teams, players and player_stats tables.
+
+Tables form a DAG given by their foreign keys (teams <- players, teams <- player_stats) and player_stats rows
+reference players. Every batch declares keys it provides (committed team / player ids) and keys it requires, so it
+starts as soon as all its referenced teams and players are committed, while independent batches run concurrently
+across the asyncpg pool.
+"""
+import asyncio
+import re
+import time
+from logging import Logger
+from pathlib import Path
+from typing import List, Tuple, Dict, Any, NamedTuple, Set, Hashable
+import asyncpg
+from asyncpg.pool import Pool
+from utils import FILES_DIR
+from queries import (CREATE_TEAMS_TABLE_QUERY, CREATE_PLAYERS_TABLE_QUERY, CREATE_PLAYERS_STATS_TABLE_QUERY,
+                     INSERT_INTO_TEAMS_TABLE_QUERY, INSERT_INTO_PLAYERS_TABLE_QUERY)
+from parse_json_for_db import parse_teams_insert, parse_player_insert, parse_player_stats_insert
+
+TEAMS: str = "teams"
+PLAYERS: str = "players"
+PLAYER_STATS: str = "player_stats"
+STAGES: List[str] = [TEAMS, PLAYERS, PLAYER_STATS]
+
+
+class Batch(NamedTuple):
+    """Group of insert statements committed in a single transaction."""
+    stage: str
+    statements: List[Tuple[str, List[tuple]]]
+    provides: Set[Hashable]
+    requires: Set[Hashable]
+
+
+def to_asyncpg_placeholders(query: str) -> str:
+    """Replace psycopg2 '%s' placeholders with asyncpg positional '$n' placeholders.
+
+    USAGE
+    _____
+    >>> to_asyncpg_placeholders("INSERT INTO teams(api_id, name) VALUES(%s, %s)")
+    'INSERT INTO teams(api_id, name) VALUES($1, $2)'
+    """
+    counter = iter(range(1, query.count("%s") + 1))
+    return re.sub(r"%s", lambda match: f"${next(counter)}", query)
+
+
+def prepare_team_batches(teams_filename: str = "all_teams", archive=None) -> List[Batch]:
+    """Prepare single batch with all teams.
+
+    :param teams_filename: name of the filename with all teams data (without extension)
+    :param archive: archive (archive.Archive) with downloaded data; loose files are read if not selected
+
+    :return: list of batches
+    """
+    records = parse_teams_insert(teams_filename, archive)
+    return [Batch(stage=TEAMS, statements=[(to_asyncpg_placeholders(INSERT_INTO_TEAMS_TABLE_QUERY), records)],
+                  provides={(TEAMS, record[0]) for record in records}, requires=set())]
+
+
+def prepare_player_batches(files: List[Path], archive=None) -> List[Batch]:
+    """Prepare one batch of players per team.
+
+    :param files: list of player bio files (or archive keys)
+    :param archive: archive (archive.Archive) with downloaded data; loose files are read if not selected
+
+    :return: list of batches
+    """
+    query = to_asyncpg_placeholders(INSERT_INTO_PLAYERS_TABLE_QUERY)
+    records_by_team: Dict[int, List[tuple]] = {}
+    for file in files:
+        record = parse_player_insert(file, archive)
+        records_by_team.setdefault(record[0], []).append(record)
+
+    return [Batch(stage=PLAYERS, statements=[(query, records)],
+                  provides={(PLAYERS, record[1]) for record in records}, requires={(TEAMS, team_id)})
+            for team_id, records in records_by_team.items()]
+
+
+def prepare_player_stats_batches(files: List[Path], archive=None, player_ids: List[int] = None) -> List[Batch]:
+    """Prepare one batch of game log rows per player.
+
+    NOTES
+    -----
+    Rows with the same set of columns share insert statement and are inserted by a single executemany() call.
+
+    :param files: list of player stats files (or archive keys)
+    :param archive: archive (archive.Archive) with downloaded data; loose files are read if not selected
+    :param player_ids: API ids of players of the files; they are parsed from filenames if not selected
+
+    :return: list of batches
+    """
+    batches = []
+    for file, player_id in zip(files, player_ids or [None] * len(files)):
+        statements, records = parse_player_stats_insert(file=file, archive=archive, player_api_id=player_id)
+        if not records:
+            continue
+
+        grouped: Dict[str, List[tuple]] = {}
+        for statement, record in zip(statements, records):
+            grouped.setdefault(statement, []).append(record)
+
+        # record values start with (season, player_api_id, team_api_id, opponent_api_id, ...)
+        requires = {(PLAYERS, records[0][1])} | {(TEAMS, record[2]) for record in records} | \
+                   {(TEAMS, record[3]) for record in records}
+        batches.append(Batch(stage=PLAYER_STATS, statements=list(grouped.items()), provides=set(),
+                             requires=requires))
+
+    return batches
+
+
+def prepare_catalog_batches(catalog) -> List[Batch]:
+    """Prepare player and game log batches of all files registered in catalog (catalog.Catalog).
+
+    NOTES
+    -----
+    Files and API ids of players come from the catalog, so no directory is globbed and no id is parsed from filename.
+    Files of one kind can be stored in several locations (loose files or archives of different fetch runs).
+
+    :param catalog: catalog with registered files
+
+    :return: list of batches
+    """
+    batches = []
+    for kind, prepare in ((PLAYERS, prepare_player_batches), (PLAYER_STATS, prepare_player_stats_batches)):
+        rows_by_location: Dict[str, list] = {}
+        for row in catalog.files(kind):
+            rows_by_location.setdefault(row["location"], []).append(row)
+
+        for location, rows in rows_by_location.items():
+            files = [catalog.file_path(row) for row in rows]
+            if kind == PLAYERS:
+                batches += prepare(files, catalog.archive(location))
+            else:
+                batches += prepare(files, catalog.archive(location), [row["api_id"] for row in rows])
+
+    return batches
+
+
+async def _run_batch(pool: Pool, batch: Batch, logger: Logger) -> bool:
+    """Insert all statements of the batch within one transaction."""
+    try:
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                for query, values in batch.statements:
+                    await conn.executemany(command=query, args=values)
+    except asyncpg.PostgresError as err:
+        logger.exception("Postgres database connector related error occurred", exc_info=err)
+    except Exception as err:
+        logger.exception("Unhanded non database connector related error occurred", exc_info=err)
+    else:
+        return True
+    return False
+
+
+async def load_batches(pool: Pool, batches: List[Batch], logger: Logger) -> Dict[str, Dict[str, Any]]:
+    """Load batches concurrently; every batch waits only for batches providing keys it requires.
+
+    NOTES
+    -----
+    Required keys, which are not provided by any batch of this load, are expected to be already stored in database.
+    Batch, whose dependency failed, is skipped (it would violate foreign key constraint anyway).
+
+    :param pool: asyncpg connection pool
+    :param batches: list of batches
+    :param logger: Logger object
+
+    :return: throughput report {stage: {committed, rows, failed, skipped, seconds, rows_per_second}}
+    """
+    committed: Dict[Hashable, asyncio.Future] = {}
+    loop = asyncio.get_running_loop()
+    for batch in batches:
+        for key in batch.provides:
+            committed[key] = loop.create_future()
+
+    report = {stage: {"committed": 0, "rows": 0, "failed": 0, "skipped": 0, "start": None, "end": None}
+              for stage in STAGES}
+
+    async def run(batch: Batch) -> None:
+        stage_report = report[batch.stage]
+        succeeded = False
+        try:
+            dependencies = [committed[key] for key in batch.requires if key in committed]
+            succeeded = all(await asyncio.gather(*dependencies))
+
+            start = time.perf_counter()
+            if succeeded:
+                succeeded = await _run_batch(pool, batch, logger)
+                stage_report["committed" if succeeded else "failed"] += 1
+                stage_report["rows"] += sum(len(values) for _, values in batch.statements) if succeeded else 0
+            else:
+                stage_report["skipped"] += 1
+            end = time.perf_counter()
+
+            stage_report["start"] = min(start, stage_report["start"] or start)
+            stage_report["end"] = max(end, stage_report["end"] or end)
+        finally:
+            # dependent batches must never wait forever
+            for key in batch.provides:
+                if not committed[key].done():
+                    committed[key].set_result(succeeded)
+
+    await asyncio.gather(*[run(batch) for batch in batches])
+
+    for stage_report in report.values():
+        start, end = stage_report.pop("start"), stage_report.pop("end")
+        stage_report["seconds"] = round(end - start, 4) if start is not None else 0.0
+        stage_report["rows_per_second"] = round(stage_report["rows"] / stage_report["seconds"], 1) \
+            if stage_report["seconds"] else 0.0
+
+    return report
+
+
+async def load_all(pool: Pool, logger: Logger, teams_filename: str = "all_teams", files_dir: Path = FILES_DIR,
+                   create_tables: bool = True, archive=None, catalog=None) -> Dict[str, Dict[str, Any]]:
+    """Load teams, players and player_stats tables from downloaded files.
+
+    :param pool: asyncpg connection pool
+    :param logger: Logger object
+    :param teams_filename: name of the filename with all teams data (without extension)
+    :param files_dir: path to files directory
+    :param create_tables: (re)create all three tables before loading
+    :param archive: archive (archive.Archive) with downloaded players and game logs; loose files are read if not
+        selected (teams are always read from loose file, unless they were archived too)
+    :param catalog: catalog (catalog.Catalog) with registered players and game log files; it is used instead of
+        globbing files directory (or archive keys)
+
+    :return: throughput report per stage (including time spent by parsing files)
+    """
+    if create_tables:
+        async with pool.acquire() as conn:
+            await conn.execute(CREATE_TEAMS_TABLE_QUERY + CREATE_PLAYERS_TABLE_QUERY +
+                               CREATE_PLAYERS_STATS_TABLE_QUERY)
+
+    start = time.perf_counter()
+    if catalog is not None:
+        batches = prepare_team_batches(teams_filename) + prepare_catalog_batches(catalog)
+    elif archive is not None:
+        team_archive = archive if archive.contains("schedule", teams_filename) else None
+        batches = prepare_team_batches(teams_filename, team_archive) + \
+            prepare_player_batches(sorted(archive.keys("players")), archive) + \
+            prepare_player_stats_batches(sorted(archive.keys("player_stats")), archive)
+    else:
+        batches = prepare_team_batches(teams_filename) + \
+            prepare_player_batches(sorted((files_dir / "players").glob("*.json"))) + \
+            prepare_player_stats_batches(sorted((files_dir / "player_stats").glob("*.json")))
+    parse_seconds = round(time.perf_counter() - start, 4)
+
+    report = await load_batches(pool, batches, logger)
+    report["parse"] = {"batches": len(batches), "seconds": parse_seconds}
+
+    for stage, stage_report in report.items():
+        print(f"Stage [{stage}]: [{stage_report}]")
+
+    return report
@@ -1,15 +1,25 @@
 from typing import List, Tuple, Any, Union
 import json
 from pathlib import Path
-from utils import FILES_DIR, FrozenJSON
+from utils import FILES_DIR, FrozenJSON, profile_stage
 import re
 
 
-def parse_teams_insert(filename: str) -> List[Tuple[Any, ...]]:
+def _load_json(file: Union[Path, str], endpoint: str, archive=None) -> dict:
+    """Load data from loose JSON file or, when archive (archive.Archive) is selected, from its record with the same
+    key as file name (without extension)."""
+    if archive is not None:
+        return archive.load_json(endpoint, Path(file).name.removesuffix(".json"))
+
+    with open(file, encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+@profile_stage()
+def parse_teams_insert(filename: str, archive=None) -> List[Tuple[Any, ...]]:
     # get teams file
     teams_file = FILES_DIR / "schedule" / (filename + ".json")
-    with open(teams_file, encoding="utf-8") as fh:
-        data = json.load(fh)
+    data = _load_json(teams_file, "schedule", archive)
 
     # store json data into FrozenJSON for easier attributes navigation
     json_navigator = FrozenJSON(data)
@@ -20,10 +30,10 @@ def parse_teams_insert(filename: str) -> List[Tuple[Any, ...]]:
     return insert_records
 
 
-def parse_player_insert(file: Path) -> Tuple[Any, ...]:
+@profile_stage()
+def parse_player_insert(file: Path, archive=None) -> Tuple[Any, ...]:
     # get teams file
-    with open(file, encoding="utf-8") as fh:
-        data = json.load(fh)
+    data = _load_json(file, "players", archive)
 
     # store json data into FrozenJSON for easier attributes navigation
     json_navigator = FrozenJSON(data)
@@ -38,7 +48,9 @@ def parse_player_insert(file: Path) -> Tuple[Any, ...]:
     return insert_records
 
 
-def parse_player_stats_insert(file: Path) -> Tuple[List[str], List[Tuple[Any, ...]]]:
+@profile_stage()
+def parse_player_stats_insert(file: Path, archive=None,
+                              player_api_id: int = None) -> Tuple[List[str], List[Tuple[Any, ...]]]:
     def format_attribute(name: str) -> str:
         new = ""
         for letter in name:
@@ -49,8 +61,8 @@ def parse_player_stats_insert(file: Path) -> Tuple[List[str], List[Tuple[Any, ..
         return new
 
     # get teams file
-    with open(file, encoding="utf-8") as fh:
-        data = json.load(fh)
+    file = Path(file)
+    data = _load_json(file, "player_stats", archive)
 
     # store json data into FrozenJSON for easier attributes navigation
     json_navigator = FrozenJSON(data)
@@ -61,9 +73,9 @@ def parse_player_stats_insert(file: Path) -> Tuple[List[str], List[Tuple[Any, ..
     # insert_command: str = "INSERT INTO player_stats({})\nVALUES(%s{})"
     insert_command: str = "INSERT INTO player_stats({})\nVALUES({})"
 
-    # get player api id name from filename
-
-    player_api_id: str = re.search(r"(?=_*)\d+(?=)", file.name).group(0)
+    # get player api id name from filename, when it is not known (e.g. from catalog)
+    if player_api_id is None:
+        player_api_id = re.search(r"(?=_*)\d+(?=)", file.name).group(0)
     insert_records_dict = [{
                             "season": splits[i].season,
                             "player_api_id": int(player_api_id),
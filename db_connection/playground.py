@@ -8,6 +8,13 @@ from parse_json_for_db import *
 from db_commands import update_db, insert_many_db
 from db_commans_async import update_db_async
 from db_param import *
+from loader import load_all
+
+try:
+    # catalog of the project root is available, when it is on PYTHONPATH (e.g. PYTHONPATH=.. python playground.py)
+    from catalog import Catalog, CATALOG_PATH
+except ImportError:
+    Catalog, CATALOG_PATH = None, None
 
 DB_CONNECTION_CONFIG: Path = Path("database.ini")
 PLAYERS_DIR: Path = FILES_DIR / "players"
@@ -19,23 +26,6 @@ async def main():
     # get logger for DB connection
     logger = get_logger()
 
-    # get and parse DB connection configuration
-    config = get_db_config(filename=DB_CONNECTION_CONFIG)
-
-    create_tbl_result = update_db(
-        db_configuration=config,
-        logger=logger,
-        query=CREATE_PLAYERS_STATS_TABLE_QUERY
-    )
-    print(create_tbl_result)
-
-    insert_statements: List[str] = []
-    insert_records: List[Tuple[Any, ...]] = []
-    for file in PLAYER_STATS_DIR.glob("*"):
-        result = parse_player_stats_insert(file=file)
-        insert_statements += result[0]
-        insert_records += result[1]
-
     async with asyncpg.create_pool(
         host=HOST,
         port=PORT,
@@ -43,14 +33,14 @@ async def main():
         database=DATABASE,
         password=PASSWORD
     ) as pool:
-        coro_to_do = [
-            update_db_async(pool=pool, query=insert_statements[i],
-                            values=[insert_records[i]], logger=logger) for i in range(len(insert_statements))]
-
-        result = await asyncio.gather(*coro_to_do, return_exceptions=True)
-        # await update_db_async(pool=pool, query=insert_statements[0], values=[insert_records[0]], logger=logger)
-        # await update_db_async(pool=pool, query=insert_statements[1], values=[insert_records[1]], logger=logger)
-        # await update_db_async(pool=pool, query=insert_records[0], logger=logger)
+        # teams are loaded first, players & player stats batches right after their teams (and players) are committed
+        # files registered in catalog are loaded by their API ids, otherwise files directory is globbed
+        if Catalog is not None and CATALOG_PATH.exists():
+            with Catalog() as catalog:
+                report = await load_all(pool=pool, logger=logger, catalog=catalog)
+        else:
+            report = await load_all(pool=pool, logger=logger)
+        print(report)
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -92,4 +92,25 @@ CREATE TABLE player_stats
         FOREIGN KEY (opponent_api_id)
             REFERENCES teams(api_id)
 );
-"""
\ No newline at end of file
+"""
+
+SELECT_PLAYER_STATS_QUERY: str = """
+SELECT player_api_id, team_api_id, opponent_api_id, season, match_date, goals, assists, points, shots, shot_pct,
+time_on_ice, power_play_time_on_ice, is_home, is_win
+FROM player_stats
+ORDER BY player_api_id, match_date DESC
+"""
+
+# column types of player_stats chunks; compact types keep memory of multi-season history low
+PLAYER_STATS_DTYPES: dict = {
+    "player_api_id": "int32",
+    "team_api_id": "int16",
+    "opponent_api_id": "int16",
+    "goals": "int16",
+    "assists": "int16",
+    "points": "int16",
+    "shots": "int16",
+    "shot_pct": "float32",
+    "is_home": "bool",
+    "is_win": "bool"
+}
@@ -1,4 +1,7 @@
 from collections import abc
+from typing import List, Dict, Sequence, Any
+import numpy as np
+import pandas as pd
 import psycopg2
 import functools
 import datetime
@@ -9,6 +12,14 @@ from configparser import ConfigParser
 from pathlib import Path
 from logging import Logger
 
+try:
+    # profiling hooks of the project root are available, when it is on PYTHONPATH (e.g. PYTHONPATH=.. python loader.py)
+    from profiling import profile_stage
+except ImportError:
+    def profile_stage(name: str = None):
+        """No-op replacement of profiling.profile_stage(), when profiling module is not available."""
+        return lambda func: func
+
 # path to files directory
 FILES_DIR = Path().cwd().parent / "files"
 
@@ -84,10 +95,19 @@ class MyDBConnectionTransaction:
 
 
 class MyDBConnectionFetch:
-    """ """
-    def __init__(self, configuration_parameters: dict, logger: Logger):
+    """Connection for running select statements.
+
+    NOTES
+    -----
+    When cursor_name is given, server-side (named) cursor is created, which keeps the result set on the server and
+    transfers only rows requested by fetchmany().
+    """
+    def __init__(self, configuration_parameters: dict, logger: Logger, cursor_name: str = None,
+                 itersize: int = 2000):
         self.connection = psycopg2.connect(**configuration_parameters)
-        self.cursor = self.connection.cursor()
+        self.cursor = self.connection.cursor(name=cursor_name)
+        if cursor_name:
+            self.cursor.itersize = itersize
         self.logger = logger
 
     def __enter__(self):
@@ -104,6 +124,48 @@ class MyDBConnectionFetch:
         self.cursor.close()
 
 
+def records_to_dataframe(rows: Sequence[Sequence[Any]], columns: List[str],
+                         dtypes: Dict[str, Any] = None) -> pd.DataFrame:
+    """Build typed Dataframe chunk from fetched rows.
+
+    USAGE
+    _____
+    >>> records_to_dataframe([(1, 0.5), (2, 1.5)], ["id", "pct"], {"id": "int32"}).dtypes.tolist()
+    [dtype('int32'), dtype('float64')]
+
+    :param rows: fetched rows (tuples or records)
+    :param columns: column names in order of row values
+    :param dtypes: dictionary {column: dtype}; columns not mentioned keep inferred types
+
+    :return: Dataframe
+    """
+    df = pd.DataFrame.from_records(list(rows), columns=columns)
+    if dtypes:
+        df = df.astype({column: dtype for column, dtype in dtypes.items() if column in df})
+    return df
+
+
+def records_to_numpy(rows: Sequence[Sequence[Any]], columns: List[str],
+                     dtypes: Dict[str, Any] = None) -> Dict[str, np.ndarray]:
+    """Build typed NumPy column arrays from fetched rows.
+
+    USAGE
+    _____
+    >>> records_to_numpy([(1, 0.5), (2, 1.5)], ["id", "pct"], {"id": np.int16})["id"]
+    array([1, 2], dtype=int16)
+
+    :param rows: fetched rows (tuples or records)
+    :param columns: column names in order of row values
+    :param dtypes: dictionary {column: dtype}; columns not mentioned are stored as object arrays
+
+    :return: dictionary {column: array}
+    """
+    dtypes = dtypes or {}
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return {column: np.array(column_values, dtype=dtypes.get(column, object))
+            for column, column_values in zip(columns, values)}
+
+
 class FrozenJSON:
     """A read-only facade for navigating a JSON-like object using attribute notation.
 
@@ -1,20 +1,43 @@
 """Module storing few specific functions for running a program."""
+import asyncio
 import re
+import time
 from typing import Tuple, List, Dict
 import json
 from pathlib import Path
 import pandas as pd
-from utils import FrozenJSON, fetch_files, FILES_DIR
+from utils import FrozenJSON, HTTPClient, fetch_files, fetch_payloads, save_json, FILES_DIR
+from request_planner import plan_roster_requests, split_expanded_rosters, get_schedule_team_ids
+from archive import Archive
+from catalog import Catalog, content_hash
+from profiling import profile_stage
 
 # base URL for accessing NHL api endpoints
 BASE_URL = "https://statsapi.web.nhl.com/"
 
 
-async def get_schedule_file(start_date: str, end_date: str = None) -> str:
+def load_json(subfolder: str, filename: str, archive: Archive = None) -> dict:
+    """Load downloaded data either from archive or from loose JSON file.
+
+    :param subfolder: name of the sub-folder (archive endpoint), where data are stored
+    :param filename: name of the data filename (without extension)
+    :param archive: archive with downloaded data; loose JSON file is read if not selected
+
+    :return: JSON data
+    """
+    if archive is not None:
+        return archive.load_json(subfolder, filename)
+
+    with open(FILES_DIR / subfolder / (filename + ".json"), encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+async def get_schedule_file(start_date: str, end_date: str = None, client: HTTPClient = None) -> str:
     """Get list of matches for a selected date range.
 
     :param start_date: start date (day) of the date range
     :param end_date: end date (day) of the date range; if not selected start_date is used
+    :param client: shared HTTP client; temporary client is created if not selected
 
     :return: name of the data filename (without extension)
     """
@@ -26,25 +49,28 @@ async def get_schedule_file(start_date: str, end_date: str = None) -> str:
 
     url = BASE_URL + f"api/v1/schedule?startDate={start_date}&endDate={end_date}"
 
-    await fetch_files([url], [filename], "schedule")
+    await fetch_files([url], [filename], "schedule", client=client)
 
     return filename
 
 
-async def get_teams_file() -> str:
+async def get_teams_file(client: HTTPClient = None) -> str:
     """Get high-level data of all teams.
 
+    :param client: shared HTTP client; temporary client is created if not selected
+
     :return: name of the data filename (without extension)
     """
     url = BASE_URL + f"api/v1/teams"
     filename = "all_teams"
 
-    await fetch_files([url], [filename], "schedule")
+    await fetch_files([url], [filename], "schedule", client=client)
 
     return filename
 
 
-async def get_schedule_team_rosters(filename: str) -> Tuple[list, dict]:
+async def get_schedule_team_rosters(filename: str, client: HTTPClient = None, archive: Archive = None,
+                                    catalog: Catalog = None) -> Tuple[list, dict]:
     """Get team roster data based on given schedule.
 
     NOTES
@@ -52,6 +78,9 @@ async def get_schedule_team_rosters(filename: str) -> Tuple[list, dict]:
     Its not necessary to download team roster on every program run, only when roster changes are expected.
 
     :param filename: name of the schedule filename (without extension)
+    :param client: shared HTTP client; temporary client is created if not selected
+    :param archive: archive used for storing team rosters instead of loose files
+    :param catalog: catalog, where teams and their roster files are registered
 
     :return: tuple with list of team roster filenames and list of schedule matches
     """
@@ -63,16 +92,13 @@ async def get_schedule_team_rosters(filename: str) -> Tuple[list, dict]:
     # store json data into FrozenJSON for easier attributes navigation
     json_navigator = FrozenJSON(data)
 
-    # get list of URLs for requests and filenames for teams data
+    # get filenames for teams data
     number_of_games = json_navigator.dates[0].totalGames
-    away_links = [BASE_URL + json_navigator.dates[0].games[i].teams.away.team.link + "/roster" for i in range(number_of_games)]
     away_names = [json_navigator.dates[0].games[i].teams.away.team.name + "_roster" for i in range(number_of_games)]
-    home_links = [BASE_URL + json_navigator.dates[0].games[i].teams.home.team.link + "/roster" for i in range(number_of_games)]
     home_names = [json_navigator.dates[0].games[i].teams.home.team.name + "_roster" for i in range(number_of_games)]
 
-    urls = home_links + away_links
     filenames = home_names + away_names
-    await fetch_files(urls, filenames, "team_roster")
+    await get_expanded_team_rosters(get_schedule_team_ids(data), client, archive, catalog)
 
     filenames = [file.lower() for file in filenames]
     matches = {f"Match ({index})": [teams[0].replace("_roster", ""), teams[1].replace("_roster", "")]
@@ -81,6 +107,7 @@ async def get_schedule_team_rosters(filename: str) -> Tuple[list, dict]:
     return filenames, matches
 
 
+@profile_stage()
 def load_matches_from_schedule(filename: str) -> Tuple[list, dict]:
     """Prepare matches based on given schedule and team roster filenames for getting player stats in next steps.
 
@@ -106,60 +133,115 @@ def load_matches_from_schedule(filename: str) -> Tuple[list, dict]:
     return filenames, matches
 
 
-async def get_all_players_bio(filenames: list) -> List[str]:
-    """Get player stats data for list of teams.
+async def get_all_players_bio(filenames: list, client: HTTPClient = None, archive: Archive = None,
+                              catalog: Catalog = None) -> List[str]:
+    """Get player bio data for list of teams.
+
+    NOTES
+    -----
+    Player files are keyed by API id ("{full name}_{id}"), so players sharing the same name do not overwrite each
+    other.
 
     :param filenames: list of team roster filenames (without extension)
+    :param client: shared HTTP client; temporary client is created if not selected
+    :param archive: archive used for reading rosters and storing player data instead of loose files
+    :param catalog: catalog, where players and their downloaded files are registered
 
-    :return: list of player stats filenames
+    :return: list of player bio filenames
     """
-    # prepare lists for storing player URLs & names
-    player_links = []
-    player_names = []
-
-    # loop through all team rosters
-    for file in filenames:
-        player_file = FILES_DIR / "team_roster" / (file + ".json")
-        with open(player_file, encoding="utf-8") as fh:
-            data = json.load(fh)
+    players = read_roster_players(filenames, archive=archive, catalog=catalog)
+    player_links = [BASE_URL + f"api/v1/people/{api_id}" for api_id, *_ in players]
+    player_filenames = [f"{full_name}_{api_id}" for api_id, full_name, *_ in players]
 
-        json_navigator = FrozenJSON(data)
-
-        links = [BASE_URL + json_navigator.roster[i].person.link for i in
-                 range(len(json_navigator.roster))]
-        names = [json_navigator.roster[i].person.fullName for i in range(len(json_navigator.roster))]
-        player_links += links
-        player_names += names
+    save = archive.save if archive is not None else save_json
+    if catalog is not None:
+        save = catalog.tracking_save(save)
 
-    player_filenames = [name for name in player_names]
+    results = await fetch_files(player_links, player_filenames, "players", client=client, save=save)
 
-    await fetch_files(player_links, player_filenames, "players")
+    if catalog is not None:
+        catalog.add_players(players)
+        catalog.add_files("players", [(player[0], filename)
+                                      for player, filename, result in zip(players, player_filenames, results)
+                                      if not isinstance(result, Exception)], archive)
 
     return player_filenames
 
 
-async def get_all_team_rosters(filename: str) -> List[str]:
+async def get_all_team_rosters(filename: str = None, *, client: HTTPClient = None, archive: Archive = None,
+                               catalog: Catalog = None) -> List[str]:
     """Get team roster data for all teams.
 
     NOTES
     -----
-    This function can be used, when we need to get data for all teams and not considering a certain schedule.
+    This function can be used, when we need to get data for all teams and not considering a certain schedule. Teams
+    and their rosters come from a single 'teams?expand=team.roster' request, so the teams file is not needed; when it
+    is selected, only rosters of its teams are downloaded.
 
-    :param filename: name of the filename with all teams data (without extension)
+    :param filename: name of the filename with all teams data (without extension); all teams if not selected
+    :param client: shared HTTP client; temporary client is created if not selected
+    :param archive: archive used for storing team rosters instead of loose files
+    :param catalog: catalog, where teams and their roster files are registered
 
     :return: list of team roster filenames
     """
-    filenames, json_navigator = load_all_team_rosters(filename)
+    team_ids = None
+    if filename is not None:
+        _, json_navigator = load_all_team_rosters(filename)
+        team_ids = [team.id for team in json_navigator.teams]
 
-    number_of_teams = len(json_navigator.teams)
-    urls = [BASE_URL + json_navigator.teams[i].link + "/roster" for i in range(number_of_teams)]
+    return await get_expanded_team_rosters(team_ids, client, archive, catalog)
 
-    await fetch_files(urls, filenames, "team_roster")
-    filenames = [file.lower() for file in filenames]
+
+async def get_expanded_team_rosters(team_ids: list = None, client: HTTPClient = None, archive: Archive = None,
+                                    catalog: Catalog = None) -> List[str]:
+    """Get team roster data with minimum number of expanded requests and save them as per-team roster files.
+
+    NOTES
+    -----
+    Instead of one '/teams/{id}/roster' request per team, rosters are embedded into 'teams?expand=team.roster'
+    response(s), which are split into the same roster files afterwards. Response, which cannot be split (e.g. error
+    message without teams), is skipped, so rosters of other responses are still saved.
+
+    :param team_ids: API ids of teams; rosters of all teams are downloaded if not selected
+    :param client: shared HTTP client; temporary client is created if not selected
+    :param archive: archive used for storing team rosters instead of loose files
+    :param catalog: catalog, where teams and their roster files are registered
+
+    :return: list of team roster filenames
+    """
+    save = archive.save if archive is not None else save_json
+    urls = [BASE_URL + path for path in plan_roster_requests(team_ids)]
+    results = await fetch_payloads(urls, client)
+
+    loop = asyncio.get_running_loop()
+    filenames = []
+    for url, result in zip(urls, results):
+        if isinstance(result, Exception):
+            print(f"Exception for [{url}]: [{result!r}]")
+            continue
+        try:
+            rosters = split_expanded_rosters(result)
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Exception for [{url}]: [{e!r}]")
+            continue
+
+        # saving is blocking, so it runs in executor threads like in download_one()
+        await asyncio.gather(*[loop.run_in_executor(None, save, roster_data, roster_filename + ".json", "team_roster")
+                               for roster_filename, roster_data in rosters.items()])
+        filenames += list(rosters)
+
+        if catalog is not None:
+            teams = json.loads(result)["teams"]
+            catalog.add_teams([(team["id"], team["name"], team.get("abbreviation")) for team in teams])
+            fetched_at = time.time()
+            catalog.add_files("team_roster", [(team["id"], f"{team['name']}_roster") for team in teams], archive,
+                              hashes={key: (content_hash(data), fetched_at) for key, data in rosters.items()})
 
     return filenames
 
 
+@profile_stage()
 def load_all_team_rosters(filename: str) -> Tuple[List[str], FrozenJSON]:
     """Prepare team roster filenames for all teams.
 
@@ -181,26 +263,30 @@ def load_all_team_rosters(filename: str) -> Tuple[List[str], FrozenJSON]:
     return filenames, json_navigator
 
 
-async def get_player_stats(filenames: list) -> List[str]:
-    """Get player stats data for list of teams.
+def prepare_player_stats_requests(filenames: list, season: str = None, subfolder: str = "team_roster",
+                                  archive: Archive = None) -> Tuple[List[str], List[str]]:
+    """Prepare URLs and filenames for getting game log stats of all skaters from given team rosters.
 
     :param filenames: list of team roster filenames (without extension)
+    :param season: season in yyyyYYYY format (e.g. "20222023"); if not selected current season is used
+    :param subfolder: name of the sub-folder, where team roster files are stored
+    :param archive: archive with team rosters; loose files are read if not selected
 
-    :return: list of player stats filenames
+    :return: tuple with list of player stats URLs and list of player stats filenames (without extension)
     """
     # prepare lists for storing player URLs & names
     player_links = []
     player_names = []
 
+    query = "/stats?stats=gameLog"
+    if season:
+        query += f"&season={season}"
+
     # loop through all team rosters
     for file in filenames:
-        player_file = FILES_DIR / "team_roster" / (file + ".json")
-        with open(player_file, encoding="utf-8") as fh:
-            data = json.load(fh)
+        json_navigator = FrozenJSON(load_json(subfolder, file, archive))
 
-        json_navigator = FrozenJSON(data)
-
-        links = [BASE_URL + json_navigator.roster[i].person.link + "/stats?stats=gameLog"
+        links = [BASE_URL + json_navigator.roster[i].person.link + query
                  for i in range(len(json_navigator.roster)) if json_navigator.roster[i].position.name != "Goalie"]
         names = [json_navigator.roster[i].person.fullName + f"_{json_navigator.roster[i].person.id}"
                  for i in range(len(json_navigator.roster)) if json_navigator.roster[i].position.name != "Goalie"]
@@ -209,34 +295,148 @@ async def get_player_stats(filenames: list) -> List[str]:
 
     player_filenames = [name + "_stats" for name in player_names]
 
-    await fetch_files(player_links, player_filenames, "player_stats")
+    return player_links, player_filenames
+
+
+def read_roster_players(filenames: list, subfolder: str = "team_roster", archive: Archive = None,
+                        catalog: Catalog = None) -> List[Tuple[int, str, int, str, str]]:
+    """Read all players of given team rosters.
+
+    :param filenames: list of team roster filenames (without extension)
+    :param subfolder: name of the sub-folder, where team roster files are stored
+    :param archive: archive with team rosters; loose files are read if not selected
+    :param catalog: catalog with registered team rosters, which provides team ids; team id is None if not selected
+
+    :return: list of (api_id, full_name, team_api_id, position, position_type) tuples
+    """
+    players = []
+    for file in filenames:
+        roster_row = catalog.file_by_key("team_roster", file) if catalog is not None else None
+        team_api_id = roster_row["api_id"] if roster_row is not None else None
+        for player in load_json(subfolder, file, archive)["roster"]:
+            players.append((player["person"]["id"], player["person"]["fullName"], team_api_id,
+                            player["position"]["name"], player["position"]["type"]))
+
+    return players
+
+
+async def get_player_stats(filenames: list, client: HTTPClient = None, archive: Archive = None,
+                           catalog: Catalog = None) -> List[str]:
+    """Get player stats data for list of teams.
+
+    :param filenames: list of team roster filenames (without extension)
+    :param client: shared HTTP client; temporary client is created if not selected
+    :param archive: archive used for reading rosters and storing game logs instead of loose files
+    :param catalog: catalog, where players and their game log files are registered
+
+    :return: list of player stats filenames
+    """
+    player_links, player_filenames = prepare_player_stats_requests(filenames, archive=archive)
+
+    save = archive.save if archive is not None else save_json
+    if catalog is not None:
+        save = catalog.tracking_save(save)
+
+    # game log requests are the most numerous, so slow responses are hedged to cut the tail latency of the whole run
+    results = await fetch_files(player_links, player_filenames, "player_stats", hedge=True, client=client, save=save)
+
+    if catalog is not None:
+        players = read_roster_players(filenames, archive=archive, catalog=catalog)
+        catalog.add_players(players)
+        player_ids = {f"{full_name}_{api_id}_stats".lower(): api_id for api_id, full_name, *_ in players}
+        catalog.add_files("player_stats", [(player_ids[filename.lower()], filename)
+                                           for filename, result in zip(player_filenames, results)
+                                           if not isinstance(result, Exception)], archive)
 
     return player_filenames
 
 
-def load_player_stats_into_dataframe(filename: str) -> pd.DataFrame:
+async def get_player_stats_by_id(player_ids: list, catalog: Catalog, client: HTTPClient = None,
+                                 archive: Archive = None, season: str = None) -> List[int]:
+    """Get game log stats only for chosen players registered in catalog (e.g. refresh of a few players).
+
+    :param player_ids: API ids of players
+    :param catalog: catalog with registered players
+    :param client: shared HTTP client; temporary client is created if not selected
+    :param archive: archive used for storing game logs instead of loose files
+    :param season: season in yyyyYYYY format (e.g. "20222023"); if not selected current season is used
+
+    :return: list of API ids of players, whose game logs were downloaded
+    """
+    query = "/stats?stats=gameLog" + (f"&season={season}" if season else "")
+    players = [player for player in (catalog.player(api_id) for api_id in player_ids) if player is not None]
+
+    links = [BASE_URL + f"api/v1/people/{player['api_id']}" + query for player in players]
+    filenames = [f"{player['full_name']}_{player['api_id']}_stats" for player in players]
+    save = catalog.tracking_save(archive.save if archive is not None else save_json)
+
+    results = await fetch_files(links, filenames, "player_stats", hedge=True, client=client, save=save)
+
+    fetched = [(player["api_id"], filename) for player, filename, result in zip(players, filenames, results)
+               if not isinstance(result, Exception)]
+    catalog.add_files("player_stats", fetched, archive)
+
+    return [api_id for api_id, _ in fetched]
+
+
+@profile_stage()
+def load_player_stats_into_dataframe(filename: str, archive: Archive = None) -> pd.DataFrame:
     """Load player stats data from JSON into Dataframe.
 
     :param filename: player stats filename (without extension)
+    :param archive: archive with player stats; loose file is read if not selected
 
     :return: Dataframe with player stats data
     """
-    filepath = Path().cwd() / "files" / "player_stats" / (filename + ".json")
-    with open(filepath, encoding="utf-8") as fh:
-        data = json.load(fh)
+    if archive is not None:
+        data = archive.load_json("player_stats", filename)
+    else:
+        filepath = Path().cwd() / "files" / "player_stats" / (filename + ".json")
+        with open(filepath, encoding="utf-8") as fh:
+            data = json.load(fh)
 
-    json_navig = FrozenJSON(data)
+    # get player name and API id from filename (e.g. "Connor McDavid_8478402_stats")
+    match = re.search(r"^(\D+)_(\d*)", filename)
+    player_id = int(match[2]) if match[2] else None
+
+    return player_stats_frame(data, match[1], player_id)
+
+
+@profile_stage()
+def load_player_stats_by_id(player_id: int, catalog: Catalog) -> pd.DataFrame:
+    """Load player stats data of a player registered in catalog into Dataframe.
 
-    # get player name from filename
-    player_name = re.search(r"^(\D+)_", filename)[1]
+    :param player_id: API id of the player
+    :param catalog: catalog with registered players and their game log files
+
+    :return: Dataframe with player stats data
+    """
+    return player_stats_frame(catalog.load_json("player_stats", player_id), catalog.player(player_id)["full_name"],
+                              player_id)
+
+
+def player_stats_frame(data: dict, player_name: str, player_id: int = None) -> pd.DataFrame:
+    """Convert game log JSON data of a player into Dataframe.
+
+    :param data: game log JSON data
+    :param player_name: name of the player
+    :param player_id: API id of the player (identifies game log rows, as names are not unique)
+
+    :return: Dataframe with player stats data
+    """
+    json_navig = FrozenJSON(data)
 
     # {"team": json_navig.stats[0].splits[0].team.name} => splits[0] index should ensure, that current team name for
     # player will be picked up (this can happen in case of trades during the season)
-    stats = [{"name": player_name} | {"team": json_navig.stats[0].splits[0].team.name} |
-             {"opponent": json_navig.stats[0].splits[i].opponent.name} |
-             {"match_date": json_navig.stats[0].splits[i].date} |
+    # every attribute access wraps the whole list again, so splits are navigated only once per file
+    splits = json_navig.stats[0].splits
+    stats = [{"name": player_name, "player_id": player_id} | {"team": splits[0].team.name} |
+             {"opponent": splits[i].opponent.name} |
+             {"match_date": splits[i].date} |
+             {"match_team": splits[i].team.name} |
+             {"is_home": splits[i].isHome, "is_win": splits[i].isWin} |
              data["stats"][0]["splits"][i]["stat"]
-             for i in range(len(json_navig.stats[0].splits))]
+             for i in range(len(splits))]
 
     df = pd.DataFrame(stats)
 
@@ -0,0 +1,200 @@
+"""Module storing incremental maintenance of scorer reports, when new games are added into player game logs."""
+from pathlib import Path
+from typing import Set
+import numpy as np
+import pandas as pd
+from utils import FILES_DIR
+from data_analysis import (WindowStore, top_scorer_aggregates, off_fire_aggregates, rank_top_scorers,
+                           rank_off_fire_scorers, convert_time_column_to_seconds, AVERAGE_STATS_PERIOD,
+                           OFF_FIRE_PERIOD)
+
+STATE_PATH: Path = FILES_DIR / "aggregates" / "scorer_reports_state.pkl"
+
+# largest "last K games" window used by the reports
+MAX_WINDOW: int = 15
+
+# game log columns kept for recent games of every player
+RECENT_COLUMNS = ["name", "team", "match_date", "goals", "assists", "points", "shots", "shotPct", "timeOnIce",
+                  "powerPlayTimeOnIce"]
+PLAYER_KEY = ["name", "team"]
+# API id identifies the same player across teams (names are not unique, e.g. two players named Sebastian Aho)
+PLAYER_ID = "player_id"
+
+
+class IncrementalScorerReports:
+    """Persisted aggregate state per (player, team), which is updated only for players with new games.
+
+    NOTES
+    -----
+    State consists of:
+        - last MAX_WINDOW games of every player (enough for all rolling windows of both reports),
+        - season totals of every player (goals, assists, games, time on ice) and date of his last game,
+        - per player aggregates and ranked reports.
+    When new game log rows arrive, only players with newer games than stored are re-aggregated and rankings are
+    re-computed only for their teams, so the cost of a nightly refresh depends on the number of games played that
+    night and not on the size of the league history.
+
+    USAGE
+    _____
+    >>> log = pd.DataFrame({"name": ["A", "A", "B"], "team": ["X", "X", "X"], "goals": [1, 0, 0],
+    ...                     "match_date": ["2023-01-01", "2023-01-02", "2023-01-01"], "assists": [0, 1, 0],
+    ...                     "shots": [2, 1, 1], "timeOnIce": "15:00"})
+    >>> reports = IncrementalScorerReports()
+    >>> reports.update(log)
+    {'X'}
+    >>> reports.on_fire["name"].tolist()
+    ['A', 'B']
+    >>> reports.update(log)
+    set()
+
+    Players sharing a name are told apart by their API id, so a new game of one of them keeps the other one:
+
+    >>> log = pd.DataFrame({"name": ["A", "A", "B"], "team": ["X", "Y", "Y"], "player_id": [1, 2, 3],
+    ...                     "match_date": "2023-01-01", "goals": [1, 1, 0], "assists": 0, "shots": 1,
+    ...                     "timeOnIce": "15:00"})
+    >>> reports = IncrementalScorerReports()
+    >>> sorted(reports.update(log))
+    ['X', 'Y']
+    >>> reports.update(log.iloc[[0]].assign(match_date="2023-01-02"))
+    {'X'}
+    >>> reports.on_fire[["name", "team"]].values.tolist()
+    [['A', 'Y'], ['B', 'Y'], ['A', 'X']]
+
+    Player traded to another team (the same API id) is removed from his old team:
+
+    >>> sorted(reports.update(log.iloc[[0]].assign(team="Z", match_date="2023-01-03")))
+    ['X', 'Z']
+    >>> reports.on_fire[["name", "team"]].values.tolist()
+    [['A', 'Z'], ['A', 'Y'], ['B', 'Y']]
+    """
+    def __init__(self, top_n_players: int = 5, average_stats_period: int = AVERAGE_STATS_PERIOD,
+                 off_fire_period: int = OFF_FIRE_PERIOD):
+        self.top_n_players = top_n_players
+        self.average_stats_period = average_stats_period
+        self.off_fire_period = off_fire_period
+        self.max_window = max(MAX_WINDOW, average_stats_period, off_fire_period)
+
+        self.recent = pd.DataFrame(columns=RECENT_COLUMNS).set_index(PLAYER_KEY, drop=False)
+        self.totals = pd.DataFrame(columns=["goals_total", "assists_total", "games", "time_on_ice_seconds",
+                                            "last_match_date", PLAYER_ID],
+                                   index=pd.MultiIndex.from_tuples([], names=PLAYER_KEY))
+        self.top_aggregates = pd.DataFrame()
+        self.off_fire_aggregates = pd.DataFrame()
+        self.on_fire = pd.DataFrame()
+        self.off_fire = pd.DataFrame()
+
+    @classmethod
+    def load(cls, path: Path = STATE_PATH, **kwargs) -> "IncrementalScorerReports":
+        """Load persisted state; new empty state is created if there is none yet.
+
+        :param path: path to the state file
+        :param kwargs: report parameters used for new state
+
+        :return: IncrementalScorerReports object
+        """
+        if path.exists():
+            return pd.read_pickle(path)
+        return cls(**kwargs)
+
+    def save(self, path: Path = STATE_PATH) -> None:
+        """Persist the state.
+
+        :param path: path to the state file
+
+        :return: None
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        pd.to_pickle(self, path)
+
+    def _new_rows(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Get game log rows, which are newer than the last stored game of the player."""
+        last_dates = self.totals["last_match_date"].reindex(pd.MultiIndex.from_frame(data[PLAYER_KEY]))
+        is_new = last_dates.isna().to_numpy() | (data["match_date"].to_numpy() > last_dates.fillna("").to_numpy())
+        return data[is_new]
+
+    def _drop_players(self, keys: pd.MultiIndex) -> None:
+        """Remove state of given players."""
+        self.recent = self.recent[~self.recent.index.isin(keys)]
+        self.totals = self.totals[~self.totals.index.isin(keys)]
+        if not self.top_aggregates.empty:
+            self.top_aggregates = self.top_aggregates[~self.top_aggregates.index.isin(keys)]
+            self.off_fire_aggregates = self.off_fire_aggregates[~self.off_fire_aggregates.index.isin(keys)]
+
+    def update(self, data: pd.DataFrame) -> Set[str]:
+        """Apply new game log rows to the state and refresh rankings of affected teams.
+
+        NOTES
+        -----
+        Data can contain whole game logs (already applied games are skipped) or only new games of the players. Player,
+        who appears with a new team after a trade, is expected to come with his whole game log. Trades are recognized
+        by the 'player_id' column; rows without API id are never matched with players of other teams.
+
+        :param data: Dataframe with player stats game logs (as created by load_player_stats_into_dataframe())
+
+        :return: set of teams, whose rankings were re-computed
+        """
+        new_rows = self._new_rows(data.reset_index(drop=True))
+        if new_rows.empty:
+            return set()
+
+        changed = pd.MultiIndex.from_frame(new_rows[PLAYER_KEY].drop_duplicates())
+        affected_teams = set(changed.get_level_values("team"))
+
+        if PLAYER_ID not in new_rows:
+            new_rows = new_rows.assign(**{PLAYER_ID: np.nan})
+
+        # players traded to another team are stored under a new (name, team) key with the same API id
+        changed_ids = set(new_rows[PLAYER_ID].dropna())
+        stale = self.totals.index[self.totals[PLAYER_ID].isin(changed_ids).to_numpy() &
+                                  ~self.totals.index.isin(changed)]
+        affected_teams |= set(stale.get_level_values("team"))
+        self._drop_players(stale)
+
+        # season totals
+        new_rows = new_rows.assign(time_on_ice_seconds=convert_time_column_to_seconds(new_rows, "timeOnIce"))
+        new_totals = new_rows.groupby(PLAYER_KEY).agg(goals_total=("goals", "sum"), assists_total=("assists", "sum"),
+                                                      games=("goals", "size"),
+                                                      time_on_ice_seconds=("time_on_ice_seconds", "sum"),
+                                                      last_match_date=("match_date", "max"),
+                                                      **{PLAYER_ID: (PLAYER_ID, "last")})
+        old_totals = self.totals.reindex(new_totals.index)
+        numeric_columns = ["goals_total", "assists_total", "games", "time_on_ice_seconds"]
+        new_totals[numeric_columns] = new_totals[numeric_columns].add(old_totals[numeric_columns].fillna(0))
+        self.totals = pd.concat([self.totals[~self.totals.index.isin(changed)], new_totals])
+
+        # last games of changed players
+        recent_rows = pd.concat([self.recent[self.recent.index.isin(changed)].reset_index(drop=True),
+                                 new_rows.reindex(columns=RECENT_COLUMNS)], ignore_index=True)
+        recent_rows = recent_rows.sort_values(PLAYER_KEY + ["match_date"], ascending=[True, True, False])
+        recent_rows = recent_rows.groupby(PLAYER_KEY).head(self.max_window).set_index(PLAYER_KEY, drop=False)
+        self.recent = pd.concat([self.recent[~self.recent.index.isin(changed)], recent_rows])
+
+        # aggregates of changed players; totals come from the whole season, windows from the last games
+        store = WindowStore(recent_rows.reset_index(drop=True))
+        totals = self.totals.reindex(pd.MultiIndex.from_frame(store.players))
+        top = top_scorer_aggregates(store, self.average_stats_period)
+        off = off_fire_aggregates(store, self.average_stats_period, self.off_fire_period)
+        for df_agg in (top, off):
+            df_agg["goals_total"] = totals["goals_total"].to_numpy().astype(int)
+            df_agg["assists_total"] = totals["assists_total"].to_numpy().astype(int)
+            df_agg.index = pd.MultiIndex.from_frame(store.players)
+
+        self.top_aggregates = pd.concat([self.top_aggregates[~self.top_aggregates.index.isin(changed)]
+                                         if not self.top_aggregates.empty else None, top])
+        self.off_fire_aggregates = pd.concat([self.off_fire_aggregates[~self.off_fire_aggregates.index.isin(changed)]
+                                              if not self.off_fire_aggregates.empty else None, off])
+
+        self._rerank(affected_teams)
+
+        return affected_teams
+
+    def _rerank(self, teams: Set[str]) -> None:
+        """Re-compute rankings of given teams and replace them in both reports."""
+        def replace(report: pd.DataFrame, aggregates: pd.DataFrame, rank_function) -> pd.DataFrame:
+            team_aggregates = aggregates[aggregates["team"].isin(teams)].reset_index(drop=True)
+            ranked = rank_function(team_aggregates, self.top_n_players)
+            kept = report[~report["team"].isin(teams)] if not report.empty else None
+            return pd.concat([kept, ranked]).sort_values(["team", "group_rank"], ascending=[False, True])
+
+        self.on_fire = replace(self.on_fire, self.top_aggregates, rank_top_scorers)
+        self.off_fire = replace(self.off_fire, self.off_fire_aggregates, rank_off_fire_scorers)
@@ -0,0 +1,371 @@
+"""Module storing incremental live-game polling, which applies changed player stat lines of games in progress.
+
+Live feed of every game is downloaded in full only once. Afterwards only its diff feed
+('api/v1/game/<gamePk>/feed/live/diffPatch?startTimecode=<timecode>') is polled, which returns JSON patches of the feed
+changed since the given timecode (an empty list, when nothing happened). Skater stat lines touched by the patches are
+converted into game log rows and upserted into the in-memory game logs, so reports can be refreshed while games are in
+progress without re-downloading full season game logs of all players.
+"""
+import asyncio
+import json
+import re
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set
+import pandas as pd
+from utils import HTTPClient, LatencyTracker, LATENCY_TRACKER, client_session, fetch_data_adaptive
+from get_data_stats_files import BASE_URL, load_json
+
+# game states driving the polling interval
+PRE_GAME: str = "pre_game"
+LIVE: str = "live"
+INTERMISSION: str = "intermission"
+FINAL: str = "final"
+
+# polling intervals in seconds
+LIVE_INTERVAL: float = 10
+INTERMISSION_INTERVAL: float = 60
+MIN_PRE_GAME_INTERVAL: float = 60
+MAX_PRE_GAME_INTERVAL: float = 900
+# failed polls are retried after LIVE_INTERVAL seconds, doubled after every further failure up to this limit
+MAX_RETRY_INTERVAL: float = 300
+
+# skater stat changes are located by patch paths like /liveData/boxscore/teams/home/players/ID8478402/stats/...
+PLAYER_STATS_PATH = re.compile(r"^/liveData/boxscore/teams/(home|away)/players/ID(\d+)/stats/skaterStats")
+
+# game log rows are identified by API id of the player (names are not unique)
+GAME_KEY: List[str] = ["player_id", "match_date"]
+
+
+def apply_patch(document: dict, operations: List[dict]) -> dict:
+    """Apply JSON patch operations (RFC 6902) to the document in place.
+
+    NOTES
+    -----
+    Diff feed uses only 'add', 'replace' and 'remove' operations; other operations raise ValueError and the caller
+    falls back to the full feed.
+
+    USAGE
+    _____
+    >>> feed = {"metaData": {"timeStamp": "20230102_010000"}, "plays": [1]}
+    >>> apply_patch(feed, [{"op": "replace", "path": "/metaData/timeStamp", "value": "20230102_010010"},
+    ...                    {"op": "add", "path": "/plays/-", "value": 2}, {"op": "remove", "path": "/plays/0"}])
+    {'metaData': {'timeStamp': '20230102_010010'}, 'plays': [2]}
+
+    :param document: JSON document
+    :param operations: list of patch operations
+
+    :return: patched document
+    """
+    for operation in operations:
+        *parents, last = [part.replace("~1", "/").replace("~0", "~") for part in operation["path"].split("/")[1:]]
+        target = document
+        for part in parents:
+            target = target[int(part)] if isinstance(target, list) else target[part]
+
+        op = operation["op"]
+        if isinstance(target, list):
+            index = len(target) if last == "-" else int(last)
+            if op == "add":
+                target.insert(index, operation["value"])
+            elif op == "replace":
+                target[index] = operation["value"]
+            elif op == "remove":
+                del target[index]
+            else:
+                raise ValueError(f"Unsupported patch operation [{op}]")
+        elif op in ("add", "replace"):
+            target[last] = operation["value"]
+        elif op == "remove":
+            del target[last]
+        else:
+            raise ValueError(f"Unsupported patch operation [{op}]")
+
+    return document
+
+
+def changed_players(operations: List[dict]) -> Set[str]:
+    """Get boxscore keys of players (e.g. 'home/ID8478402'), whose skater stats are touched by patch operations.
+
+    >>> sorted(changed_players([{"op": "replace", "path": "/liveData/boxscore/teams/away/players/ID8478402/stats/"
+    ...                                                   "skaterStats/goals", "value": 1},
+    ...                         {"op": "replace", "path": "/liveData/linescore/currentPeriod", "value": 2}]))
+    ['away/ID8478402']
+    """
+    keys = set()
+    for operation in operations:
+        match = PLAYER_STATS_PATH.match(operation["path"])
+        if match:
+            keys.add(f"{match[1]}/ID{match[2]}")
+    return keys
+
+
+def game_state(feed: dict) -> str:
+    """Get polling state of the game from its live feed.
+
+    >>> game_state({"gameData": {"status": {"abstractGameState": "Live"}},
+    ...             "liveData": {"linescore": {"intermissionInfo": {"inIntermission": True}}}})
+    'intermission'
+    """
+    status = feed["gameData"]["status"]["abstractGameState"]
+    if status == "Final":
+        return FINAL
+    if status == "Preview":
+        return PRE_GAME
+    if feed.get("liveData", {}).get("linescore", {}).get("intermissionInfo", {}).get("inIntermission"):
+        return INTERMISSION
+    return LIVE
+
+
+def poll_interval(feed: dict, now: float = None) -> Optional[float]:
+    """Get number of seconds until the next poll of the game; None when the game is over.
+
+    NOTES
+    -----
+    Games in progress are polled every LIVE_INTERVAL seconds. Intermission lasts until its remaining time runs out.
+    Pre-game polls are spread until the scheduled start (at least MIN_PRE_GAME_INTERVAL, at most MAX_PRE_GAME_INTERVAL
+    apart), as the start is often delayed.
+
+    USAGE
+    _____
+    >>> poll_interval({"gameData": {"status": {"abstractGameState": "Preview"},
+    ...                             "datetime": {"dateTime": "2023-01-03T00:00:00Z"}}}, now=1672700000.0)
+    900
+    >>> poll_interval({"gameData": {"status": {"abstractGameState": "Final"}}}) is None
+    True
+
+    :param feed: live feed of the game
+    :param now: current UNIX time; time.time() is used if not selected
+
+    :return: number of seconds or None
+    """
+    state = game_state(feed)
+    if state == FINAL:
+        return None
+    if state == LIVE:
+        return LIVE_INTERVAL
+    if state == INTERMISSION:
+        remaining = feed["liveData"]["linescore"]["intermissionInfo"].get("intermissionTimeRemaining", 0)
+        return max(min(remaining, INTERMISSION_INTERVAL), LIVE_INTERVAL)
+
+    start = datetime.strptime(feed["gameData"]["datetime"]["dateTime"], "%Y-%m-%dT%H:%M:%SZ")
+    until_start = start.replace(tzinfo=timezone.utc).timestamp() - (now or time.time())
+    return min(max(until_start, MIN_PRE_GAME_INTERVAL), MAX_PRE_GAME_INTERVAL)
+
+
+class LiveGame:
+    """Live feed of a single game kept up to date by its diff feed.
+
+    USAGE
+    _____
+    >>> game = LiveGame(2022020600, "2023-01-02")
+    >>> game.poll_url
+    'https://statsapi.web.nhl.com/api/v1/game/2022020600/feed/live'
+    """
+    def __init__(self, game_pk: int, match_date: str):
+        self.game_pk = game_pk
+        self.match_date = match_date
+        self.feed: Optional[dict] = None
+        self.requests = 0
+
+    @property
+    def timecode(self) -> Optional[str]:
+        return self.feed["metaData"]["timeStamp"] if self.feed is not None else None
+
+    @property
+    def poll_url(self) -> str:
+        """Get URL of the diff feed since the last applied timecode (full feed before the first poll)."""
+        url = BASE_URL + f"api/v1/game/{self.game_pk}/feed/live"
+        if self.feed is None:
+            return url
+        return url + f"/diffPatch?startTimecode={self.timecode}"
+
+    def apply(self, response: bytes) -> Set[str]:
+        """Apply response of the live feed or of the diff feed.
+
+        NOTES
+        -----
+        Diff feed returns list of {"diff": [operations]} items; full feed (the first poll or a fallback) and the end of
+        the game (result decides 'is_win' of all game log rows) mark all players of the boxscore as changed.
+        Responses of other shape (e.g. {"message": "Game data not found"}) raise ValueError and the feed is
+        left unchanged.
+
+        USAGE
+        _____
+        >>> game = LiveGame(2022020600, "2023-01-02")
+        >>> game.apply(b'{"message": "Game data not found"}')
+        Traceback (most recent call last):
+        ...
+        ValueError: Unexpected live feed response of game [2022020600]
+
+        :param response: bytes response from request
+
+        :return: set of boxscore keys of changed players
+        """
+        self.requests += 1
+        data = json.loads(response)
+        if isinstance(data, dict) and {"gameData", "liveData", "metaData"} <= data.keys():
+            self.feed = data
+            return self._all_players()
+        if self.feed is None or not isinstance(data, list) or not all(isinstance(item, dict) and "diff" in item
+                                                                      for item in data):
+            raise ValueError(f"Unexpected live feed response of game [{self.game_pk}]")
+
+        was_final = game_state(self.feed) == FINAL
+        operations = [operation for item in data for operation in item["diff"]]
+        try:
+            apply_patch(self.feed, operations)
+        except (KeyError, IndexError, ValueError, TypeError):
+            # feed is out of sync, so the next poll downloads the full feed again
+            self.feed = None
+            return set()
+
+        if not was_final and game_state(self.feed) == FINAL:
+            return self._all_players()
+        return changed_players(operations)
+
+    def _all_players(self) -> Set[str]:
+        teams = self.feed["liveData"]["boxscore"]["teams"]
+        return {f"{side}/{player}" for side in ("home", "away") for player in teams[side]["players"]}
+
+    def game_log_rows(self, players: Set[str]) -> pd.DataFrame:
+        """Convert skater stats of given players into game log rows (as created by load_player_stats_into_dataframe()).
+
+        :param players: boxscore keys of players
+
+        :return: Dataframe with one row per skater
+        """
+        teams = self.feed["liveData"]["boxscore"]["teams"]
+        final = game_state(self.feed) == FINAL
+        rows = []
+        for key in sorted(players):
+            side, player_id = key.split("/")
+            opponent_side = "away" if side == "home" else "home"
+            player = teams[side]["players"].get(player_id, {})
+            stats = player.get("stats", {}).get("skaterStats")
+            if stats is None:
+                # goalies and scratched players have no skater stats
+                continue
+
+            goals, assists, shots = stats.get("goals", 0), stats.get("assists", 0), stats.get("shots", 0)
+            team_goals = teams[side]["teamStats"]["teamSkaterStats"]["goals"]
+            opponent_goals = teams[opponent_side]["teamStats"]["teamSkaterStats"]["goals"]
+            stat = {"timeOnIce": stats.get("timeOnIce"), "assists": assists, "goals": goals,
+                    "pim": stats.get("penaltyMinutes", 0), "shots": shots, "games": 1, "hits": stats.get("hits"),
+                    "powerPlayGoals": stats.get("powerPlayGoals"),
+                    "powerPlayPoints": stats.get("powerPlayGoals", 0) + stats.get("powerPlayAssists", 0),
+                    "powerPlayTimeOnIce": stats.get("powerPlayTimeOnIce"),
+                    "evenTimeOnIce": stats.get("evenTimeOnIce"), "penaltyMinutes": str(stats.get("penaltyMinutes", 0)),
+                    "shortHandedGoals": stats.get("shortHandedGoals"),
+                    "shortHandedPoints": stats.get("shortHandedGoals", 0) + stats.get("shortHandedAssists", 0),
+                    "shortHandedTimeOnIce": stats.get("shortHandedTimeOnIce"), "blocked": stats.get("blocked"),
+                    "plusMinus": stats.get("plusMinus"), "points": goals + assists}
+            if shots:
+                stat["shotPct"] = round(goals / shots * 100, 1)
+
+            rows.append({"name": player["person"]["fullName"], "player_id": player["person"]["id"],
+                         "team": teams[side]["team"]["name"], "opponent": teams[opponent_side]["team"]["name"],
+                         "match_date": self.match_date, "match_team": teams[side]["team"]["name"],
+                         "is_home": side == "home", "is_win": team_goals > opponent_goals if final else None} | stat)
+
+        return pd.DataFrame(rows)
+
+
+def load_live_games(filename: str) -> Dict[str, LiveGame]:
+    """Prepare live games of a schedule downloaded by get_schedule_file().
+
+    :param filename: name of the schedule filename (without extension)
+
+    :return: dictionary {match name: LiveGame} with the same match names as load_matches_from_schedule()
+    """
+    data = load_json("schedule", filename)
+    games = [LiveGame(game["gamePk"], day["date"]) for day in data["dates"] for game in day["games"]]
+    return {f"Match ({index})": game for index, game in enumerate(games, start=1)}
+
+
+def upsert_game_log_rows(data: pd.DataFrame, rows: pd.DataFrame) -> pd.DataFrame:
+    """Replace game log rows of the same player (API id) and date by new rows (or append them).
+
+    >>> data = pd.DataFrame({"name": ["A", "A", "A"], "player_id": [1, 1, 2],
+    ...                      "match_date": ["2023-01-01", "2023-01-02", "2023-01-02"], "goals": [1, 0, 0]})
+    >>> upsert_game_log_rows(data, pd.DataFrame({"name": ["A"], "player_id": [1], "match_date": ["2023-01-02"],
+    ...                                          "goals": [2]}))
+      name  player_id  match_date  goals
+    0    A          1  2023-01-02      2
+    1    A          1  2023-01-01      1
+    2    A          2  2023-01-02      0
+
+    :param data: Dataframe with player stats game logs (with 'player_id' column, see load_player_stats_by_id())
+    :param rows: Dataframe with new game log rows
+
+    :return: new Dataframe with game logs, where new rows come first (game logs are ordered from the most recent game)
+    """
+    if rows.empty:
+        return data
+    replaced = pd.MultiIndex.from_frame(data[GAME_KEY]).isin(pd.MultiIndex.from_frame(rows[GAME_KEY]))
+    return pd.concat([rows, data[~replaced]], ignore_index=True)
+
+
+async def poll_live_games(games: Dict[str, LiveGame], data: pd.DataFrame, client: HTTPClient = None,
+                          on_update: Callable[[str, pd.DataFrame], None] = None,
+                          tracker: LatencyTracker = LATENCY_TRACKER) -> pd.DataFrame:
+    """Poll live games until all of them are final and apply changed player stat lines to game logs.
+
+    NOTES
+    -----
+    Every game is polled by its own task with interval given by the game state, so there is one small diff request
+    per game and interval. Failures are handled per game, so they never stop polling of other games: failed requests
+    (including non-2xx responses) and responses, which cannot be applied, are logged and retried with a backoff
+    (LIVE_INTERVAL seconds doubled up to MAX_RETRY_INTERVAL). Diff feed is retried from the last applied timecode;
+    the full feed is downloaded again only when patches cannot be applied to the feed (see LiveGame.apply()).
+
+    USAGE
+    _____
+    >>> async def run(df_agg: pd.DataFrame) -> pd.DataFrame:
+    ...     async with HTTPClient() as client:
+    ...         schedule_file = await get_schedule_file("2023-01-02", client=client)
+    ...         return await poll_live_games(load_live_games(schedule_file), df_agg, client=client,
+    ...                                      on_update=lambda match, df: print(match, len(df)))
+
+    :param games: dictionary {match name: LiveGame}
+    :param data: Dataframe with player stats game logs
+    :param client: shared HTTP client; temporary client is created if not selected
+    :param on_update: function called with match name and updated game logs after every change
+    :param tracker: latency tracker used for adaptive timeouts
+
+    :return: new Dataframe with game logs including stat lines of live games
+    """
+    state = {"data": data}
+
+    async def poll(match: str, game: LiveGame, session) -> None:
+        retry_interval = LIVE_INTERVAL
+        while True:
+            try:
+                # fetch_data() rejects non-2xx responses
+                response = await fetch_data_adaptive(session, game.poll_url, tracker)
+                players = game.apply(response)
+                if game.feed is None:
+                    continue
+
+                if players:
+                    state["data"] = upsert_game_log_rows(state["data"], game.game_log_rows(players))
+                interval = poll_interval(game.feed)
+            except Exception as e:
+                print(f"Polling of [{match}] failed: [{e!r}]; retry in [{retry_interval}] seconds")
+                await asyncio.sleep(retry_interval)
+                retry_interval = min(retry_interval * 2, MAX_RETRY_INTERVAL)
+                continue
+
+            retry_interval = LIVE_INTERVAL
+            if players and on_update is not None:
+                on_update(match, state["data"])
+
+            if interval is None:
+                print(f"[{match}] is final after [{game.requests}] requests")
+                return
+            await asyncio.sleep(interval)
+
+    async with client_session(client) as session:
+        await asyncio.gather(*[poll(match, game, session) for match, game in games.items()])
+
+    return state["data"]
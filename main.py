@@ -1,47 +1,64 @@
 import asyncio
-from utils import silence_event_loop_closed
+from utils import silence_event_loop_closed, HTTPClient
 from asyncio.proactor_events import _ProactorBasePipeTransport
 from get_data_stats_files import *
-from data_analysis import show_top_scorer_stats_from_schedule_matches, show_off_fire_scorer_stats_from_schedule_matches
+from report_cache import fingerprint, cached_top_scorer_stats, cached_off_fire_scorer_stats
+from match_reports import build_match_reports, MatchReport
 
 _ProactorBasePipeTransport.__del__ = silence_event_loop_closed(_ProactorBasePipeTransport.__del__)
 
 SCHEDULE_DATE = "2023-01-02"  # must be yyyy-MM-dd format
 
 
-async def main(schedule_date: str = None) -> Tuple[pd.DataFrame, pd.DataFrame, dict]:
-    # get schedule
-    if schedule_date:
-        schedule_file = await get_schedule_file(schedule_date)
-        teams_files, matches = load_matches_from_schedule(schedule_file)
-    else:
-        teams_file, _ = load_all_team_rosters("all_teams")
-        matches = None
-
-    # get player stats
-    player_files = await get_player_stats(teams_files)
-
-    # load player stats into Dataframe
-    concat_data = [load_player_stats_into_dataframe(file) for file in player_files]
+async def main(schedule_date: str = None,
+               catalog: Catalog = None) -> Tuple[pd.DataFrame, pd.DataFrame, dict, Dict[str, MatchReport]]:
+    # teams, players and their files are looked up by API id in catalog
+    if catalog is None:
+        with Catalog() as catalog:
+            return await main(schedule_date, catalog)
+
+    # one HTTP client (connection pool) is shared by all fetch phases
+    async with HTTPClient() as client:
+        # get schedule & team rosters
+        if schedule_date:
+            schedule_file = await get_schedule_file(schedule_date, client=client)
+            await get_schedule_team_rosters(schedule_file, client=client, catalog=catalog)
+            teams_files, matches = load_matches_from_schedule(schedule_file)
+        else:
+            teams_files = await get_all_team_rosters(client=client, catalog=catalog)
+            matches = None
+
+        # get player stats
+        await get_player_stats(teams_files, client=client, catalog=catalog)
+
+    print(f"HTTP client stats: [{client.stats}]")
+
+    # load player stats of players from fetched rosters into Dataframe
+    player_ids = [api_id for api_id, *_ in read_roster_players(teams_files, catalog=catalog)
+                  if catalog.file("player_stats", api_id) is not None]
+    concat_data = [load_player_stats_by_id(api_id, catalog) for api_id in player_ids]
     df_agg = pd.concat(concat_data)
 
-    df_on_fire_scorers = show_top_scorer_stats_from_schedule_matches(data=df_agg)
-    df_off_fire_scorers = show_off_fire_scorer_stats_from_schedule_matches(data=df_agg)
+    # reports of unchanged game logs are served from report cache
+    data_fingerprint = fingerprint(df_agg)
+    df_on_fire_scorers = cached_top_scorer_stats(data=df_agg, data_fingerprint=data_fingerprint)
+    df_off_fire_scorers = cached_off_fire_scorer_stats(data=df_agg, data_fingerprint=data_fingerprint)
+
+    # split reports into head-to-head reports of single matches
+    match_reports = None
+    if matches:
+        match_reports = build_match_reports(df_agg, matches, df_on_fire=df_on_fire_scorers,
+                                            df_off_fire=df_off_fire_scorers)
 
-    return df_on_fire_scorers, df_off_fire_scorers, matches
+    return df_on_fire_scorers, df_off_fire_scorers, matches, match_reports
 
 
 if __name__ == "__main__":
     # df, matches = asyncio.run(main(schedule_date=SCHEDULE_DATE))
 
-    teams_file, _ = load_all_team_rosters("all_teams")
-    result = asyncio.run(get_player_stats(teams_file))
+    with Catalog() as main_catalog:
+        teams_file = asyncio.run(get_all_team_rosters(catalog=main_catalog))
+        result = asyncio.run(get_player_stats(teams_file, catalog=main_catalog))
     print(result)
     # print(matches)
     # print(df)
-
-
-
-
-
-
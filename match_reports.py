@@ -0,0 +1,113 @@
+"""Module storing per-match head-to-head reports for matches of a schedule."""
+from typing import Dict, List, NamedTuple, Tuple
+import pandas as pd
+from data_analysis import (WindowStore, show_top_scorer_stats_from_schedule_matches,
+                           show_off_fire_scorer_stats_from_schedule_matches, AVERAGE_STATS_PERIOD, OFF_FIRE_PERIOD)
+
+
+class MatchReport(NamedTuple):
+    """Head-to-head report of a single match."""
+    home: str
+    away: str
+    on_fire: pd.DataFrame
+    off_fire: pd.DataFrame
+    head_to_head: pd.DataFrame
+
+
+HEAD_TO_HEAD_COLUMNS: List[str] = ["match_date", "team", "opponent", "team_goals", "opponent_goals", "is_home",
+                                   "is_win"]
+
+
+def head_to_head_results(data: pd.DataFrame) -> Dict[Tuple[str, str], pd.DataFrame]:
+    """Get past results of every (team, opponent) pair from player game logs.
+
+    NOTES
+    -----
+    Team goals are sum of goals of its skaters (goalie goals and shootout goals are not part of skater game logs). Team
+    of a game is taken from 'match_team' column, so games of traded players count for the team they played for.
+
+    :param data: Dataframe with player stats game logs
+
+    :return: dictionary {(team, opponent): Dataframe with one row per match}
+    """
+    team_column = "match_team" if "match_team" in data else "team"
+    data = data.reindex(columns=[team_column, "opponent", "match_date", "goals", "is_home", "is_win"])
+    results = data.groupby([team_column, "opponent", "match_date"], as_index=False).agg(
+        team_goals=("goals", "sum"), is_home=("is_home", "first"), is_win=("is_win", "first")
+    ).rename(columns={team_column: "team"})
+
+    # goals of the opponent are goals of the same match seen from the other side
+    opponent_goals = results[["team", "opponent", "match_date", "team_goals"]].rename(
+        columns={"team": "opponent", "opponent": "team", "team_goals": "opponent_goals"})
+    results = results.merge(opponent_goals, on=["team", "opponent", "match_date"], how="left")
+    results = results.sort_values("match_date", ascending=False)[HEAD_TO_HEAD_COLUMNS]
+
+    return {pair: df.reset_index(drop=True) for pair, df in results.groupby(["team", "opponent"])}
+
+
+def _match_report(teams: List[str], on_fire_by_team: Dict[str, pd.DataFrame],
+                  off_fire_by_team: Dict[str, pd.DataFrame],
+                  results_by_pair: Dict[Tuple[str, str], pd.DataFrame]) -> MatchReport:
+    """Assemble report of a single match from team level aggregates shared by all matches."""
+    home, away = teams
+    empty = pd.DataFrame()
+
+    return MatchReport(
+        home=home,
+        away=away,
+        on_fire=pd.concat([on_fire_by_team.get(home, empty), on_fire_by_team.get(away, empty)]),
+        off_fire=pd.concat([off_fire_by_team.get(home, empty), off_fire_by_team.get(away, empty)]),
+        head_to_head=results_by_pair.get((home, away), pd.DataFrame(columns=HEAD_TO_HEAD_COLUMNS))
+    )
+
+
+def build_match_reports(data: pd.DataFrame, matches: Dict[str, List[str]], top_n_players: int = 5,
+                        average_stats_period: int = AVERAGE_STATS_PERIOD, off_fire_period: int = OFF_FIRE_PERIOD,
+                        df_on_fire: pd.DataFrame = None,
+                        df_off_fire: pd.DataFrame = None) -> Dict[str, MatchReport]:
+    """Build head-to-head report (on fire & off fire scorers of both teams and their past results) for every match.
+
+    NOTES
+    -----
+    Team level aggregates are computed only once (and only for teams playing in given matches) and shared by all
+    matches, so assembling a match report is only a lookup of its teams. Matches of multiple schedules (e.g. a whole
+    week) can be merged into a single dictionary, as long as their names are unique.
+
+    USAGE
+    _____
+    >>> log = pd.DataFrame({"name": ["A", "B"], "team": ["X", "Y"], "opponent": ["Y", "X"], "goals": [1, 0],
+    ...                     "match_date": ["2023-01-01", "2023-01-01"], "is_home": [True, False],
+    ...                     "is_win": [True, False], "timeOnIce": "15:00"})
+    >>> reports = build_match_reports(log, {"Match (1)": ["X", "Y"]})
+    >>> reports["Match (1)"].on_fire["name"].tolist()
+    ['A', 'B']
+    >>> reports["Match (1)"].head_to_head[["team_goals", "opponent_goals"]].values.tolist()
+    [[1, 0]]
+
+    :param data: Dataframe with player stats game logs
+    :param matches: dictionary {match name: [home team, away team]} (as created by load_matches_from_schedule())
+    :param top_n_players: number of players of every team considered
+    :param average_stats_period: number of last matches used for average stats
+    :param off_fire_period: number of last matches without a goal
+    :param df_on_fire: already computed on fire scorers report; it is computed if not selected
+    :param df_off_fire: already computed off fire scorers report; it is computed if not selected
+
+    :return: dictionary {match name: MatchReport}
+    """
+    teams = {team for match_teams in matches.values() for team in match_teams}
+
+    if df_on_fire is None or df_off_fire is None:
+        team_data = data[data["team"].isin(teams)]
+        store = WindowStore(team_data)
+        df_on_fire = show_top_scorer_stats_from_schedule_matches(team_data, top_n_players, average_stats_period,
+                                                                 store)
+        df_off_fire = show_off_fire_scorer_stats_from_schedule_matches(team_data, top_n_players,
+                                                                       average_stats_period, off_fire_period, store)
+
+    on_fire_by_team = dict(tuple(df_on_fire[df_on_fire["team"].isin(teams)].groupby("team")))
+    off_fire_by_team = dict(tuple(df_off_fire[df_off_fire["team"].isin(teams)].groupby("team")))
+    team_column = "match_team" if "match_team" in data else "team"
+    results_by_pair = head_to_head_results(data[data[team_column].isin(teams)])
+
+    return {name: _match_report(match_teams, on_fire_by_team, off_fire_by_team, results_by_pair)
+            for name, match_teams in matches.items()}
@@ -0,0 +1,274 @@
+"""Module storing opt-in profiling hooks, which capture CPU and allocation statistics of pipeline stages.
+
+Profiling is switched on by NHL_STATS_PROFILE=1 environment variable, which must be set before the program starts.
+Without it profile_stage() returns decorated function unchanged, so the hooks have no overhead at all. Results are
+written into a run directory (NHL_STATS_PROFILE_DIR, or files/profiles/<timestamp> by default) at program exit:
+    - <stage>.prof: cProfile statistics of all calls of the stage (readable by pstats or snakeviz),
+    - <stage>.alloc.txt: source lines with the most memory allocated by the stage (only with NHL_STATS_PROFILE_LINES=1),
+    - summary.json & summary.txt: stages ranked by time and allocated bytes.
+
+Per call only traced memory counters are read, which is cheap even for stages called thousands of times (e.g. saving
+of a single file). Source line allocations need two tracemalloc snapshots per call, which cost far more than small
+stages themselves, so they are collected only on request.
+
+This module intentionally does not depend on any other module of the project, so it can be used by db_connection
+scripts as well.
+"""
+import asyncio
+import atexit
+import cProfile
+import functools
+import inspect
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Any, Optional, Tuple
+
+PROFILE_ENV_VAR: str = "NHL_STATS_PROFILE"
+PROFILE_DIR_ENV_VAR: str = "NHL_STATS_PROFILE_DIR"
+PROFILE_LINES_ENV_VAR: str = "NHL_STATS_PROFILE_LINES"
+PROFILING_ENABLED: bool = os.environ.get(PROFILE_ENV_VAR, "").lower() in ("1", "true", "yes")
+LINE_ALLOCATIONS_ENABLED: bool = os.environ.get(PROFILE_LINES_ENV_VAR, "").lower() in ("1", "true", "yes")
+
+# number of source lines kept in allocation reports
+TOP_ALLOCATIONS: int = 25
+
+
+class StageProfiler:
+    """Collector of cProfile statistics, traced memory peaks and timings per stage.
+
+    NOTES
+    -----
+    Allocated bytes of a call are the peak of traced memory during the call above traced memory at its start. Peak
+    counter of tracemalloc is reset by every call and its value is handed over to enclosing stages, so nested stages
+    are measured correctly; the counter is shared by all threads, so concurrently running stages share their peaks.
+    Only one cProfile profiler can be active in a thread, therefore stage nested in another profiled stage (or stage
+    running concurrently in the same event loop) is timed and traced, but its CPU profile is part of the outer stage.
+    Time of async stages is wall time including awaiting, and their allocations include work of concurrent tasks.
+    Async stages overlapping in one thread can finish in any order, therefore every call removes just its own frame.
+
+    USAGE
+    _____
+    >>> profiler = StageProfiler(Path("profiles"))
+    >>> async def stage(name: str, size: int, seconds: float, delay: float = 0) -> None:
+    ...     await asyncio.sleep(delay)
+    ...     with profiler.stage(name):
+    ...         data = bytearray(size)
+    ...         del data
+    ...         await asyncio.sleep(seconds)
+    >>> async def run() -> None:
+    ...     await asyncio.gather(stage("short", 0, 0.01), stage("long", 10 ** 7, 0.1),
+    ...                          stage("later", 0, 0.01, delay=0.05))
+    >>> asyncio.run(run())
+    >>> profiler.totals["long"]["allocated_bytes"] >= 10 ** 7
+    True
+    >>> tracemalloc.stop()
+
+    :param run_dir: directory, where results are written
+    :param line_allocations: take tracemalloc snapshots around every call to get allocations per source line
+    """
+    def __init__(self, run_dir: Path, line_allocations: bool = LINE_ALLOCATIONS_ENABLED):
+        self.run_dir = run_dir
+        self.line_allocations = line_allocations
+        self.totals: Dict[str, Dict[str, Any]] = {}
+        self.profilers: Dict[Tuple[str, int], cProfile.Profile] = {}
+        self.allocations: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Profile code running within the context as a single call of the stage.
+
+        :param name: name of the stage
+
+        :return: None
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        before = self._snapshot() if self.line_allocations else None
+
+        # peak of enclosing stages is kept in their frames before the counter is reset for this call
+        frames = self._local.__dict__.setdefault("frames", [])
+        current, peak = tracemalloc.get_traced_memory()
+        for frame in frames:
+            frame["peak"] = max(frame["peak"], peak)
+        tracemalloc.reset_peak()
+        frame = {"start": current, "peak": current}
+        frames.append(frame)
+
+        profiler = None
+        if not getattr(self._local, "active", False):
+            profiler = self._profiler(name)
+            try:
+                profiler.enable()
+                self._local.active = True
+            except ValueError:
+                # another profiler is already active (e.g. stage running in other thread on Python 3.12+)
+                profiler = None
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self._local.active = False
+
+            # concurrent stages of other tasks may have started later and still be running (frames are compared by
+            # identity, as frames of different stages can be equal)
+            del frames[next(index for index, item in enumerate(frames) if item is frame)]
+            peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            for outer_frame in frames:
+                outer_frame["peak"] = max(outer_frame["peak"], peak)
+
+            differences = None
+            if before is not None:
+                differences = [diff for diff in self._snapshot().compare_to(before, "lineno") if diff.size_diff > 0]
+            self._record(name, seconds, peak - frame["start"], differences)
+
+    def _profiler(self, name: str) -> cProfile.Profile:
+        """Get profiler of the stage in current thread; it accumulates statistics of all calls."""
+        key = (name, threading.get_ident())
+        with self._lock:
+            if key not in self.profilers:
+                self.profilers[key] = cProfile.Profile()
+            return self.profilers[key]
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        """Take snapshot of traced allocations without allocations made by snapshots and by the profiler itself."""
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                                          tracemalloc.Filter(False, __file__)])
+
+    def _record(self, name: str, seconds: float, allocated_bytes: int, differences: Optional[list]) -> None:
+        with self._lock:
+            totals = self.totals.setdefault(name, {"calls": 0, "seconds": 0.0, "allocated_bytes": 0,
+                                                   "max_allocated_bytes": 0})
+            totals["calls"] += 1
+            totals["seconds"] += seconds
+            totals["allocated_bytes"] += allocated_bytes
+            totals["max_allocated_bytes"] = max(totals["max_allocated_bytes"], allocated_bytes)
+
+            if differences is not None:
+                allocations = self.allocations.setdefault(name, Counter())
+                for diff in differences:
+                    allocations[str(diff.traceback[0])] += diff.size_diff
+
+    def summary(self) -> Dict[str, list]:
+        """Rank stages by total time and by allocated bytes.
+
+        :return: dictionary {"by_time": [...], "by_allocated_bytes": [...]} with stage totals
+        """
+        stages = [{"stage": name} | totals | {"seconds": round(totals["seconds"], 4)}
+                  for name, totals in self.totals.items()]
+        return {"by_time": sorted(stages, key=lambda stage: stage["seconds"], reverse=True),
+                "by_allocated_bytes": sorted(stages, key=lambda stage: stage["allocated_bytes"], reverse=True)}
+
+    def write(self) -> Path:
+        """Write statistics of all stages and their summary into the run directory.
+
+        :return: path to the run directory
+        """
+        if not self.totals:
+            return self.run_dir
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+
+        with self._lock:
+            stats: Dict[str, pstats.Stats] = {}
+            for (name, _), profiler in self.profilers.items():
+                if name in stats:
+                    stats[name].add(profiler)
+                else:
+                    stats[name] = pstats.Stats(profiler)
+            for name, stage_stats in stats.items():
+                stage_stats.dump_stats(self.run_dir / f"{name}.prof")
+
+            for name, allocations in self.allocations.items():
+                with open(self.run_dir / f"{name}.alloc.txt", "w", encoding="utf-8") as fh:
+                    for line, size in allocations.most_common(TOP_ALLOCATIONS):
+                        fh.write(f"{size / 1024:12.1f} KiB  {line}\n")
+
+            summary = self.summary()
+
+        with open(self.run_dir / "summary.json", "w", encoding="utf-8") as fh:
+            json.dump(summary, fh, indent=2)
+
+        with open(self.run_dir / "summary.txt", "w", encoding="utf-8") as fh:
+            for ranking, stages in summary.items():
+                fh.write(f"{ranking}\n")
+                for stage in stages:
+                    fh.write(f"  {stage['stage']:<55} calls={stage['calls']:<8} seconds={stage['seconds']:<12} "
+                             f"allocated_bytes={stage['allocated_bytes']}\n")
+
+        print(f"Profiles written into [{self.run_dir}]")
+
+        return self.run_dir
+
+
+PROFILER = StageProfiler(Path(os.environ.get(PROFILE_DIR_ENV_VAR) or
+                              Path.cwd() / "files" / "profiles" / datetime.now().strftime("%Y%m%d_%H%M%S")))
+
+if PROFILING_ENABLED:
+    atexit.register(PROFILER.write)
+
+
+def profile_stage(name: str = None) -> Callable:
+    """Decorator profiling every call of a function as a pipeline stage, when profiling is enabled.
+
+    NOTES
+    -----
+    Coroutine functions, generators and async generators are supported; generator stage lasts from its first to its
+    last item, so it includes time spent by the consumer.
+
+    USAGE
+    _____
+    >>> @profile_stage()
+    ... def parse(text: str) -> list:
+    ...     return text.split()
+    >>> parse("no overhead when profiling is off")
+    ['no', 'overhead', 'when', 'profiling', 'is', 'off']
+
+    :param name: name of the stage; name of the function is used if not selected
+
+    :return: decorated function (or the function itself, when profiling is disabled)
+    """
+    def decorator(func: Callable) -> Callable:
+        if not PROFILING_ENABLED:
+            return func
+
+        stage = name or func.__name__
+
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def wrapped(*args, **kwargs):
+                with PROFILER.stage(stage):
+                    async for item in func(*args, **kwargs):
+                        yield item
+        elif asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapped(*args, **kwargs):
+                with PROFILER.stage(stage):
+                    return await func(*args, **kwargs)
+        elif inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapped(*args, **kwargs):
+                with PROFILER.stage(stage):
+                    yield from func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            def wrapped(*args, **kwargs):
+                with PROFILER.stage(stage):
+                    return func(*args, **kwargs)
+
+        return wrapped
+
+    return decorator
@@ -0,0 +1,226 @@
+"""Module storing memoization of scorer reports keyed by fingerprint of their input game logs and parameters.
+
+Cached reports are kept in an in-memory LRU tier and in an on-disk tier (one pickle file per entry), which is shared by
+program runs and evicted by total size. Fingerprint changes as soon as any game log row of any player changes, so a
+stale report is never returned.
+"""
+import hashlib
+import pickle
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional
+import numpy as np
+import pandas as pd
+from utils import FILES_DIR
+from data_analysis import (WindowStore, show_top_scorer_stats_from_schedule_matches,
+                           show_off_fire_scorer_stats_from_schedule_matches, AVERAGE_STATS_PERIOD, OFF_FIRE_PERIOD)
+
+CACHE_DIR: Path = FILES_DIR / "report_cache"
+MAX_MEMORY_ENTRIES: int = 32
+MAX_DISK_BYTES: int = 256 * 2 ** 20
+
+# must be increased whenever report logic changes, so persisted reports of older logic are never returned
+REPORT_CACHE_VERSION: int = 1
+
+# errors of unreadable disk entries (e.g. pickled by another pandas version), which are treated as cache misses
+UNREADABLE_ENTRY_ERRORS = (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, TypeError,
+                           ValueError)
+
+
+def player_fingerprints(data: pd.DataFrame) -> pd.Series:
+    """Get content hash of game log of every player.
+
+    NOTES
+    -----
+    Row hashes are summed (with overflow) per player, so the hash does not depend on order of rows.
+
+    :param data: Dataframe with player stats game logs
+
+    :return: Series with uint64 hash per player name
+    """
+    row_hashes = pd.util.hash_pandas_object(data, index=False).to_numpy()
+    return pd.Series(row_hashes, index=data["name"].to_numpy()).groupby(level=0).sum()
+
+
+def fingerprint(data: pd.DataFrame) -> str:
+    """Get fingerprint of game logs of all players.
+
+    USAGE
+    _____
+    >>> df = pd.DataFrame({"name": ["A", "A", "B"], "goals": [1, 0, 2]})
+    >>> fingerprint(df) == fingerprint(df.iloc[::-1])
+    True
+    >>> fingerprint(df) == fingerprint(df.assign(goals=[1, 1, 2]))
+    False
+
+    :param data: Dataframe with player stats game logs
+
+    :return: hexadecimal fingerprint
+    """
+    players = player_fingerprints(data).sort_index()
+    digest = hashlib.sha1(",".join(players.index.astype(str)).encode("utf-8"))
+    digest.update(players.to_numpy(dtype=np.uint64).tobytes())
+    digest.update(",".join(f"{column}:{dtype}" for column, dtype in sorted(data.dtypes.astype(str).items()))
+                  .encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ReportCache:
+    """Two-tier cache of report Dataframes.
+
+    NOTES
+    -----
+    Entries of the disk tier are evicted by last access time (file modification time is refreshed on every hit),
+    whenever their total size exceeds max_disk_bytes. Disk tier can be switched off by cache_dir=None.
+
+    USAGE
+    _____
+    >>> cache = ReportCache(cache_dir=None)
+    >>> cache.get_or_compute("report", "fingerprint", {"top_n": 5}, lambda: pd.DataFrame({"x": [1]}))["x"].tolist()
+    [1]
+    >>> cache.get_or_compute("report", "fingerprint", {"top_n": 5}, lambda: 1 / 0)["x"].tolist()
+    [1]
+    >>> cache.stats
+    {'memory_hits': 1, 'disk_hits': 0, 'misses': 1}
+    """
+    def __init__(self, max_entries: int = MAX_MEMORY_ENTRIES, cache_dir: Optional[Path] = CACHE_DIR,
+                 max_disk_bytes: int = MAX_DISK_BYTES):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.memory: OrderedDict[str, pd.DataFrame] = OrderedDict()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(report: str, data_fingerprint: str, params: dict) -> str:
+        """Get cache key of a report computed from data with given fingerprint and parameters.
+
+        Key includes version of report logic and pandas version, so entries of other versions are never hit.
+        """
+        description = f"{REPORT_CACHE_VERSION}|{pd.__version__}|{report}|{data_fingerprint}|{sorted(params.items())}"
+        return hashlib.sha1(description.encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, df: pd.DataFrame) -> None:
+        self.memory[key] = df
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Get cached report; None if it is not cached in any tier."""
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return self.memory[key]
+
+        if self.cache_dir is not None:
+            path = self.cache_dir / f"{key}.pkl"
+            try:
+                with open(path, "rb") as fh:
+                    df = pickle.load(fh)
+            except FileNotFoundError:
+                return None
+            except UNREADABLE_ENTRY_ERRORS:
+                # entry, which cannot be read, is evicted and computed again
+                path.unlink(missing_ok=True)
+                return None
+            path.touch()
+            self.stats["disk_hits"] += 1
+            self._remember(key, df)
+            return df
+
+        return None
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        """Store report into both tiers."""
+        self._remember(key, df)
+        if self.cache_dir is None:
+            return
+
+        # write into temporary file first, so a concurrent reader never sees incomplete entry
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.cache_dir / f"{key}.pkl"
+        temporary_path = path.with_suffix(".tmp")
+        with open(temporary_path, "wb") as fh:
+            pickle.dump(df, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        temporary_path.replace(path)
+        self._evict()
+
+    def _evict(self) -> None:
+        """Remove least recently used disk entries until their total size fits the limit."""
+        entries = sorted((path.stat().st_mtime, path.stat().st_size, path) for path in self.cache_dir.glob("*.pkl"))
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total_bytes <= self.max_disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total_bytes -= size
+
+    def get_or_compute(self, report: str, data_fingerprint: str, params: dict,
+                       compute: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """Get cached report or compute and cache it.
+
+        :param report: name of the report
+        :param data_fingerprint: fingerprint of input data
+        :param params: parameters of the report
+        :param compute: function without arguments computing the report
+
+        :return: copy of the report (cached Dataframe cannot be modified by the caller)
+        """
+        key = self.key(report, data_fingerprint, params)
+        df = self.get(key)
+        if df is None:
+            self.stats["misses"] += 1
+            df = compute()
+            self.put(key, df)
+        return df.copy()
+
+
+# cache shared by all reports within the program run
+REPORT_CACHE = ReportCache()
+
+
+def cached_top_scorer_stats(data: pd.DataFrame, top_n_players: int = 5,
+                            average_stats_period: int = AVERAGE_STATS_PERIOD, store: WindowStore = None,
+                            cache: ReportCache = REPORT_CACHE, data_fingerprint: str = None) -> pd.DataFrame:
+    """Memoized show_top_scorer_stats_from_schedule_matches().
+
+    :param data: Dataframe with player stats game logs
+    :param top_n_players: number of players shown for every team
+    :param average_stats_period: number of last matches used for average stats
+    :param store: window store built from data, used only when report is computed
+    :param cache: report cache
+    :param data_fingerprint: already computed fingerprint of data (it can be shared between reports)
+
+    :return: new Dataframe with top scorers stats
+    """
+    return cache.get_or_compute(
+        "top_scorer_stats", data_fingerprint or fingerprint(data),
+        {"top_n_players": top_n_players, "average_stats_period": average_stats_period},
+        lambda: show_top_scorer_stats_from_schedule_matches(data, top_n_players, average_stats_period, store)
+    )
+
+
+def cached_off_fire_scorer_stats(data: pd.DataFrame, top_n_players: int = 5,
+                                 average_stats_period: int = AVERAGE_STATS_PERIOD,
+                                 off_fire_period: int = OFF_FIRE_PERIOD, store: WindowStore = None,
+                                 cache: ReportCache = REPORT_CACHE, data_fingerprint: str = None) -> pd.DataFrame:
+    """Memoized show_off_fire_scorer_stats_from_schedule_matches().
+
+    :param data: Dataframe with player stats game logs
+    :param top_n_players: number of top players of every team considered
+    :param average_stats_period: number of last matches used for average stats
+    :param off_fire_period: number of last matches without a goal
+    :param store: window store built from data, used only when report is computed
+    :param cache: report cache
+    :param data_fingerprint: already computed fingerprint of data (it can be shared between reports)
+
+    :return: new Dataframe with off fire scorers stats
+    """
+    return cache.get_or_compute(
+        "off_fire_scorer_stats", data_fingerprint or fingerprint(data),
+        {"top_n_players": top_n_players, "average_stats_period": average_stats_period,
+         "off_fire_period": off_fire_period},
+        lambda: show_off_fire_scorer_stats_from_schedule_matches(data, top_n_players, average_stats_period,
+                                                                 off_fire_period, store)
+    )
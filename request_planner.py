@@ -0,0 +1,91 @@
+"""Module storing request planner, which collapses per-team API calls into expanded bulk requests.
+
+NHL stats API supports 'expand' query parameter, which embeds related resources into a single response; e.g.
+'api/v1/teams?expand=team.roster' returns all teams together with their rosters. Planner turns a logical need into the
+minimum number of such requests and splits the bulk responses into the per-team files expected by downstream code.
+"""
+import json
+from typing import List, Dict, Iterable
+
+# maximal number of team ids put into a single 'teamId' filter, which keeps the URL length reasonable
+MAX_TEAM_IDS_PER_REQUEST: int = 64
+
+TEAMS_ENDPOINT: str = "api/v1/teams"
+
+
+def plan_roster_requests(team_ids: Iterable[int] = None, season: str = None,
+                         max_team_ids: int = MAX_TEAM_IDS_PER_REQUEST) -> List[str]:
+    """Plan requests for getting rosters of given teams.
+
+    USAGE
+    _____
+    >>> plan_roster_requests()
+    ['api/v1/teams?expand=team.roster']
+    >>> plan_roster_requests([10, 1, 10, 6], max_team_ids=2)
+    ['api/v1/teams?teamId=1,6&expand=team.roster', 'api/v1/teams?teamId=10&expand=team.roster']
+
+    :param team_ids: API ids of teams; rosters of all teams are requested if not selected
+    :param season: season in yyyyYYYY format; if not selected current season is used
+    :param max_team_ids: maximal number of team ids within one request
+
+    :return: list of endpoint paths relative to base URL
+    """
+    query = "expand=team.roster"
+    if season:
+        query += f"&season={season}"
+
+    if team_ids is None:
+        return [f"{TEAMS_ENDPOINT}?{query}"]
+
+    team_ids = sorted(set(team_ids))
+    chunks = [team_ids[i:i + max_team_ids] for i in range(0, len(team_ids), max_team_ids)]
+
+    return [f"{TEAMS_ENDPOINT}?teamId={','.join(str(team_id) for team_id in chunk)}&{query}" for chunk in chunks]
+
+
+def get_schedule_team_ids(data: dict) -> List[int]:
+    """Get API ids of all teams playing within given schedule.
+
+    :param data: schedule JSON data
+
+    :return: list of team ids (home teams first, then away teams) without duplicates
+    """
+    games = [game for date in data["dates"] for game in date["games"]]
+    team_ids = [game["teams"]["home"]["team"]["id"] for game in games] + \
+               [game["teams"]["away"]["team"]["id"] for game in games]
+
+    return list(dict.fromkeys(team_ids))
+
+
+def split_expanded_rosters(data: bytes) -> Dict[str, bytes]:
+    """Split response of 'teams?expand=team.roster' request into per-team roster files.
+
+    NOTES
+    -----
+    Every file has the same shape as response of 'teams/{id}/roster' endpoint and is keyed by the same filename
+    ("{team name}_roster") as used by get_all_team_rosters(), so the rest of the program is not affected.
+
+    USAGE
+    _____
+    >>> bulk = b'{"copyright": "NHL", "teams": [{"id": 1, "name": "Team A", "roster": {"roster": [], "link": "/r"}}]}'
+    >>> split_expanded_rosters(bulk)
+    {'team a_roster': b'{"copyright": "NHL", "roster": [], "link": "/r"}'}
+
+    :param data: bytes response of the expanded request
+
+    :return: dictionary {roster filename: roster data}; ValueError is raised for response without teams
+    """
+    json_data = json.loads(data)
+    if not isinstance(json_data, dict) or "teams" not in json_data:
+        raise ValueError(f"Response without teams cannot be split into rosters: [{str(json_data)[:200]}]")
+    copyright_note = json_data.get("copyright", "")
+
+    rosters = {}
+    for team in json_data["teams"]:
+        roster = team.get("roster", {})
+        roster_data = {"copyright": copyright_note,
+                       "roster": roster.get("roster", []),
+                       "link": roster.get("link", f"/{TEAMS_ENDPOINT}/{team['id']}/roster")}
+        rosters[f"{team['name']}_roster".lower()] = json.dumps(roster_data).encode("utf-8")
+
+    return rosters
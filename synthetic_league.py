@@ -0,0 +1,200 @@
+"""Module storing deterministic generator of synthetic league data in the same shape as NHL API responses.
+
+Generated files (all teams, schedule, team rosters and player game logs) are written into the same sub-folders as
+downloaded files, so all loaders and reports can run on a league of any size without network access.
+"""
+import json
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, NamedTuple
+import numpy as np
+
+SEASON: str = "20222023"
+SEASON_START: date = date(2022, 10, 7)
+
+# number of days between two consecutive game days
+GAME_DAY_STEP: int = 2
+
+GOALIES_PER_TEAM: int = 2
+POSITIONS: List[tuple] = [("C", "Center", "Forward"), ("L", "Left Wing", "Forward"), ("R", "Right Wing", "Forward"),
+                          ("D", "Defenseman", "Defenseman")]
+
+# syllables used for generated names; names must not contain digits (player name is parsed from filename)
+SYLLABLES: List[str] = ["an", "bel", "cor", "dan", "el", "fin", "gar", "hol", "is", "jor", "kel", "lan", "mar", "nor",
+                        "ol", "per", "quin", "ros", "sam", "tor", "ul", "vin", "wes", "yan", "zel"]
+FIRST_NAMES: List[str] = ["Adam", "Brad", "Connor", "David", "Erik", "Filip", "Jack", "Leon", "Mika", "Nathan",
+                          "Oskar", "Patrik", "Quinn", "Ryan", "Sidney", "Tomas", "Viktor", "William"]
+
+
+class League(NamedTuple):
+    """Names of generated files (without extension)."""
+    teams_filename: str
+    schedule_filename: str
+    roster_filenames: List[str]
+    player_stats_filenames: List[str]
+
+
+def _syllable_name(index: int, min_syllables: int = 2) -> str:
+    """Create unique capitalized name from index.
+
+    >>> _syllable_name(0), _syllable_name(1), _syllable_name(25)
+    ('Anan', 'Anbel', 'Belan')
+    """
+    syllables = []
+    while index or len(syllables) < min_syllables:
+        index, remainder = divmod(index, len(SYLLABLES))
+        syllables.append(SYLLABLES[remainder])
+    return "".join(reversed(syllables)).capitalize()
+
+
+def _time(seconds: int) -> str:
+    """Format number of seconds as mm:ss time used by the API.
+
+    >>> _time(1265)
+    '21:05'
+    """
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+def _write(files_dir: Path, subfolder: str, filename: str, data: dict) -> None:
+    path = files_dir / subfolder
+    path.mkdir(parents=True, exist_ok=True)
+    with open(path / (filename + ".json"), "w", encoding="utf-8") as fh:
+        json.dump(data, fh)
+
+
+def _skater_lines(rng: np.random.Generator, size: int, position_type: str) -> Dict[str, np.ndarray]:
+    """Draw stat lines of one skater for all his games."""
+    defenseman = position_type == "Defenseman"
+    time_on_ice = rng.normal(21 * 60 if defenseman else 16 * 60, 150, size).clip(300, 1800).astype(int)
+    shots = rng.poisson(1.6 if defenseman else 2.4, size)
+    goals = rng.binomial(shots, 0.05 if defenseman else 0.11)
+    assists = rng.poisson(0.35 if defenseman else 0.4, size)
+    power_play_goals = rng.binomial(goals, 0.2)
+    power_play_time = (rng.random(size) * 180).astype(int)
+
+    return {"time_on_ice": time_on_ice, "shots": shots, "goals": goals, "assists": assists,
+            "power_play_goals": power_play_goals, "power_play_time": power_play_time,
+            "even_time": time_on_ice - power_play_time, "hits": rng.poisson(1.5, size),
+            "blocked": rng.poisson(1.2 if defenseman else 0.5, size), "pim": 2 * rng.poisson(0.25, size),
+            "plus_minus": rng.integers(-2, 3, size), "shifts": rng.poisson(22, size)}
+
+
+def generate_league(files_dir: Path, n_teams: int = 32, players_per_team: int = 23, n_games: int = 82,
+                    season: str = SEASON, seed: int = 0) -> League:
+    """Generate synthetic league and write its files into files directory.
+
+    NOTES
+    -----
+    Every game day all teams are randomly paired (one team has a day off, when number of teams is odd) and every
+    skater of a team plays all its games. Team goals are sum of goals of its skaters; tied games are decided in
+    overtime. The same arguments always produce the same files.
+
+    USAGE
+    _____
+    >>> league = generate_league(Path("/tmp/league/files"), n_teams=8, players_per_team=20, n_games=20)
+    >>> len(league.player_stats_filenames)
+    144
+
+    :param files_dir: path to files directory, where 'schedule', 'team_roster' and 'player_stats' are created
+    :param n_teams: number of teams
+    :param players_per_team: number of players of every team (including goalies)
+    :param n_games: number of game days (games of a team, when number of teams is even)
+    :param season: season in yyyyYYYY format
+    :param seed: seed of random generator
+
+    :return: League with names of generated files
+    """
+    rng = np.random.default_rng(seed)
+    teams = [{"id": team_id, "name": f"{_syllable_name(team_id)} {_syllable_name(team_id * 7 + 3, 3)}",
+              "abbreviation": _syllable_name(team_id)[:3].upper(), "division": {"name": f"Division {team_id % 4}"},
+              "conference": {"name": f"Conference {team_id % 2}"}, "link": f"/api/v1/teams/{team_id}"}
+             for team_id in range(1, n_teams + 1)]
+    _write(files_dir, "schedule", "all_teams", {"teams": teams})
+
+    # rosters
+    rosters: Dict[int, List[dict]] = {}
+    player_id = 8470000
+    for team in teams:
+        roster = []
+        for index in range(players_per_team):
+            player_id += 1
+            if index < GOALIES_PER_TEAM:
+                code, name, position_type = "G", "Goalie", "Goalie"
+            else:
+                code, name, position_type = POSITIONS[index % len(POSITIONS)]
+            full_name = f"{FIRST_NAMES[player_id % len(FIRST_NAMES)]} {_syllable_name(player_id - 8470000, 3)}"
+            roster.append({"person": {"id": player_id, "fullName": full_name, "link": f"/api/v1/people/{player_id}"},
+                           "jerseyNumber": str(index + 1),
+                           "position": {"code": code, "name": name, "type": position_type, "abbreviation": code}})
+        rosters[team["id"]] = roster
+        _write(files_dir, "team_roster", (team["name"] + "_roster").lower(), {"roster": roster})
+
+    # schedule of game days; pairs are (home team index, away team index)
+    game_days = [(SEASON_START + timedelta(days=day * GAME_DAY_STEP)).isoformat() for day in range(n_games)]
+    pairings = [rng.permutation(n_teams)[:n_teams - n_teams % 2].reshape(-1, 2) for _ in game_days]
+
+    schedule = {"dates": [{"date": game_days[0], "totalGames": len(pairings[0]), "games": [
+        {"gamePk": int(2022020000 + index), "gameDate": game_days[0],
+         "teams": {"home": {"team": {"id": teams[home]["id"], "name": teams[home]["name"]}},
+                   "away": {"team": {"id": teams[away]["id"], "name": teams[away]["name"]}}}}
+        for index, (home, away) in enumerate(pairings[0], start=1)]}]}
+    schedule_filename = f"schedule_{game_days[0]}"
+    _write(files_dir, "schedule", schedule_filename, schedule)
+
+    # stat lines of all skaters for all games of their team
+    lines = {}
+    for team in teams:
+        for player in rosters[team["id"]]:
+            if player["position"]["type"] != "Goalie":
+                lines[player["person"]["id"]] = _skater_lines(rng, n_games, player["position"]["type"])
+
+    splits: Dict[int, List[dict]] = {player_id: [] for player_id in lines}
+    for day, (game_day, pairs) in enumerate(zip(game_days, pairings)):
+        for home, away in pairs:
+            home_team, away_team = teams[home], teams[away]
+            team_goals = {team["id"]: sum(int(lines[player["person"]["id"]]["goals"][day])
+                                          for player in rosters[team["id"]] if player["person"]["id"] in lines)
+                          for team in (home_team, away_team)}
+            is_ot = team_goals[home_team["id"]] == team_goals[away_team["id"]]
+            home_win = team_goals[home_team["id"]] > team_goals[away_team["id"]] or (is_ot and rng.random() < 0.5)
+
+            for team, opponent, is_home in ((home_team, away_team, True), (away_team, home_team, False)):
+                for player in rosters[team["id"]]:
+                    if player["person"]["id"] not in lines:
+                        continue
+                    line = {key: int(values[day]) for key, values in lines[player["person"]["id"]].items()}
+                    stat = {"timeOnIce": _time(line["time_on_ice"]), "assists": line["assists"],
+                            "goals": line["goals"], "pim": line["pim"], "shots": line["shots"], "games": 1,
+                            "hits": line["hits"], "powerPlayGoals": line["power_play_goals"],
+                            "powerPlayPoints": line["power_play_goals"],
+                            "powerPlayTimeOnIce": _time(line["power_play_time"]),
+                            "evenTimeOnIce": _time(line["even_time"]), "penaltyMinutes": str(line["pim"]),
+                            "gameWinningGoals": 0, "overTimeGoals": 0, "shortHandedGoals": 0,
+                            "shortHandedPoints": 0, "shortHandedTimeOnIce": "00:00", "blocked": line["blocked"],
+                            "plusMinus": line["plus_minus"], "points": line["goals"] + line["assists"],
+                            "shifts": line["shifts"]}
+                    if line["shots"]:
+                        stat["shotPct"] = round(line["goals"] / line["shots"] * 100, 1)
+                    splits[player["person"]["id"]].append({
+                        "season": season, "stat": stat,
+                        "team": {"id": team["id"], "name": team["name"], "link": team["link"]},
+                        "opponent": {"id": opponent["id"], "name": opponent["name"], "link": opponent["link"]},
+                        "date": game_day, "isHome": is_home, "isWin": home_win == is_home, "isOT": is_ot
+                    })
+
+    # game logs are ordered from the most recent game (as returned by the API)
+    player_stats_filenames = []
+    for team in teams:
+        for player in rosters[team["id"]]:
+            if player["person"]["id"] not in lines:
+                continue
+            filename = f"{player['person']['fullName']}_{player['person']['id']}_stats".lower()
+            _write(files_dir, "player_stats", filename,
+                   {"stats": [{"type": {"displayName": "gameLog"},
+                               "splits": splits[player["person"]["id"]][::-1]}]})
+            player_stats_filenames.append(filename)
+
+    return League(teams_filename="all_teams", schedule_filename=schedule_filename,
+                  roster_filenames=[(team["name"] + "_roster").lower() for team in teams],
+                  player_stats_filenames=player_stats_filenames)
@@ -1,20 +1,181 @@
 """Module storing few generic functions for running a program."""
+import contextlib
 import functools
 import itertools
+import re
 import time
-from typing import Callable, Any
+from typing import Callable, Any, Dict, Optional, AsyncIterator
 import aiohttp
 from aiohttp import ClientSession
 from pathlib import Path
+from urllib.parse import urlsplit
 import asyncio
 import keyword
-from collections import abc
+from collections import abc, deque
+from profiling import profile_stage
 
 # path to files directory
 FILES_DIR = Path().cwd() / "files"
 
+# default request timeout in seconds used until enough latencies are observed for an endpoint
+DEFAULT_TIMEOUT: float = 5
 
-async def download_one(session: ClientSession, url: str, filename: str, subfolder: str) -> str:
+
+class LatencyTracker:
+    """Observed latency distribution per API endpoint used for adaptive timeouts and request hedging.
+
+    NOTES
+    -----
+    Endpoint is identified by URL path with numeric ids replaced, so e.g. all player game log requests share one
+    distribution. Hedge budget allows only given ratio of requests to be duplicated, so hedging cannot flood the API.
+
+    USAGE
+    _____
+    >>> tracker = LatencyTracker(min_samples=3)
+    >>> tracker.endpoint("https://statsapi.web.nhl.com//api/v1/people/8471887/stats?stats=gameLog")
+    '/api/v1/people/{id}/stats'
+    >>> for latency in (0.1, 0.2, 0.3, 0.4):
+    ...     tracker.record("https://statsapi.web.nhl.com/api/v1/teams/1", latency)
+    >>> tracker.timeout("https://statsapi.web.nhl.com/api/v1/teams/2")
+    1.2
+    >>> tracker.timeout("https://statsapi.web.nhl.com/api/v1/schedule")
+    5
+    """
+    def __init__(self, window: int = 500, min_samples: int = 20, timeout_multiplier: float = 3,
+                 min_timeout: float = 1, max_timeout: float = 30, hedge_quantile: float = 0.95,
+                 hedge_ratio: float = 0.05):
+        self.window = window
+        self.min_samples = min_samples
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.hedge_quantile = hedge_quantile
+        self.hedge_ratio = hedge_ratio
+        self.latencies: Dict[str, deque] = {}
+        self.requests = 0
+        self.hedges = 0
+
+    @staticmethod
+    def endpoint(url: str) -> str:
+        return re.sub(r"/\d+", "/{id}", re.sub(r"/+", "/", urlsplit(url).path))
+
+    def record(self, url: str, latency: float) -> None:
+        self.latencies.setdefault(self.endpoint(url), deque(maxlen=self.window)).append(latency)
+
+    def quantile(self, url: str, q: float) -> Optional[float]:
+        """Get latency quantile of the endpoint; None if there are not enough observations yet."""
+        latencies = self.latencies.get(self.endpoint(url), ())
+        if len(latencies) < self.min_samples:
+            return None
+        ordered = sorted(latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def timeout(self, url: str) -> float:
+        """Get timeout for the endpoint as a multiple of its p99 latency."""
+        p99 = self.quantile(url, 0.99)
+        if p99 is None:
+            return DEFAULT_TIMEOUT
+        return round(min(max(p99 * self.timeout_multiplier, self.min_timeout), self.max_timeout), 3)
+
+    def hedge_delay(self, url: str) -> Optional[float]:
+        """Get delay after which duplicate request should be sent; None if hedging is not possible yet."""
+        return self.quantile(url, self.hedge_quantile)
+
+    def try_hedge(self) -> bool:
+        """Take one hedge from the budget, if still available."""
+        if self.hedges + 1 > self.hedge_ratio * self.requests:
+            return False
+        self.hedges += 1
+        return True
+
+
+# latency distribution shared by all requests within the program run
+LATENCY_TRACKER = LatencyTracker()
+
+# limits of the shared HTTP client connection pool
+CONNECTION_LIMIT: int = 100
+DNS_CACHE_SECONDS: int = 600
+KEEPALIVE_SECONDS: float = 60
+
+
+class HTTPClient:
+    """Long-lived HTTP client, which is shared by all fetch phases of a program run.
+
+    NOTES
+    -----
+    Single connection pool with DNS cache and keep-alive means, that DNS resolution and TCP/TLS handshakes are done only
+    for the first few requests, and all following requests (also from later phases) re-use opened connections.
+    Compressed responses are negotiated and decompressed transparently. Connection re-use can be checked through stats
+    counters.
+
+    USAGE
+    _____
+    >>> async def run():
+    ...     async with HTTPClient() as client:
+    ...         await get_schedule_file("2023-01-02", client=client)
+    ...         await get_all_team_rosters(client=client)
+    ...     print(client.stats)
+    """
+    def __init__(self, limit: int = CONNECTION_LIMIT, ttl_dns_cache: int = DNS_CACHE_SECONDS,
+                 keepalive_timeout: float = KEEPALIVE_SECONDS):
+        self.limit = limit
+        self.ttl_dns_cache = ttl_dns_cache
+        self.keepalive_timeout = keepalive_timeout
+        self.session: Optional[ClientSession] = None
+        self.stats = {"requests": 0, "connections_created": 0, "connections_reused": 0,
+                      "dns_resolutions": 0, "dns_cache_hits": 0}
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        """Create trace config, which counts requests, new & re-used connections and DNS lookups."""
+        def counter(name: str) -> Callable:
+            async def on_event(session, context, params):
+                self.stats[name] += 1
+            return on_event
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_end.append(counter("requests"))
+        trace_config.on_connection_create_end.append(counter("connections_created"))
+        trace_config.on_connection_reuseconn.append(counter("connections_reused"))
+        trace_config.on_dns_resolvehost_end.append(counter("dns_resolutions"))
+        trace_config.on_dns_cache_hit.append(counter("dns_cache_hits"))
+        return trace_config
+
+    async def start(self) -> None:
+        connector = aiohttp.TCPConnector(limit=self.limit, use_dns_cache=True, ttl_dns_cache=self.ttl_dns_cache,
+                                         keepalive_timeout=self.keepalive_timeout)
+        self.session = ClientSession(connector=connector, headers={"Accept-Encoding": "gzip, deflate"},
+                                     auto_decompress=True, trace_configs=[self._trace_config()])
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+@contextlib.asynccontextmanager
+async def client_session(client: HTTPClient = None) -> AsyncIterator[ClientSession]:
+    """Get session of the shared client, or session of a temporary client, which is closed afterwards.
+
+    :param client: shared HTTP client; temporary client is created if not selected
+
+    :return: ClientSession object
+    """
+    if client is not None:
+        yield client.session
+    else:
+        async with HTTPClient() as temporary_client:
+            yield temporary_client.session
+
+
+async def download_one(session: ClientSession, url: str, filename: str, subfolder: str,
+                       tracker: LatencyTracker = None, hedge: bool = False, save: Callable = None) -> str:
     """Get data from specific API endpoint and save data file to a local directory.
 
     NOTES
@@ -25,15 +186,22 @@ async def download_one(session: ClientSession, url: str, filename: str, subfolde
     :param url: URL for getting data from API
     :param filename: name of the file with downloaded data
     :param subfolder: name of the sub-folder, where downloaded files should be stored
+    :param tracker: latency tracker used for adaptive timeouts; fixed timeout is used if not selected
+    :param hedge: send duplicate request, when response is slower than tracked p95 latency
+    :param save: function storing downloaded data (e.g. Archive.save); save_json() is used if not selected
 
     :return: filename (for convenience, when showing results)
     """
-    data = await fetch_data(session, url)
+    if tracker:
+        data = await fetch_data_adaptive(session, url, tracker, hedge)
+    else:
+        data = await fetch_data(session, url)
     loop = asyncio.get_event_loop()
-    loop.run_in_executor(None, save_json, data, filename.lower() + ".json", subfolder)
+    await loop.run_in_executor(None, save or save_json, data, filename.lower() + ".json", subfolder)
     return filename
 
 
+@profile_stage()
 def save_json(data: bytes, filename: str, subfolder: str) -> None:
     """Small function for saving downloaded data.
 
@@ -73,28 +241,88 @@ async def fetch_data(session: ClientSession, url: str, timeout: float = 5) -> by
     :param url: URL for getting data from API
     :param timeout: limit for getting request response in seconds
 
-    :return: bytes response from request
+    :return: bytes response from request; aiohttp.ClientResponseError is raised for non-2xx status
     """
     request_timeout = aiohttp.ClientTimeout(total=timeout)
     async with session.get(url, timeout=request_timeout) as response:
+        # error pages (4xx, 5xx, 429) must not be stored or parsed as data
+        response.raise_for_status()
         data = await response.read()
         return data
 
 
-@async_timed()
-async def fetch_files(urls: list, filenames: list, subfolder: str) -> None:
+async def _fetch_recorded(session: ClientSession, url: str, tracker: LatencyTracker) -> bytes:
+    """Fetch data with timeout derived from endpoint latencies and record latency of the request."""
+    timeout = tracker.timeout(url)
+    start = time.perf_counter()
+    try:
+        data = await fetch_data(session, url, timeout)
+    except asyncio.TimeoutError:
+        # timed out request still tells us, that the endpoint is at least this slow
+        tracker.record(url, timeout)
+        raise
+    tracker.record(url, time.perf_counter() - start)
+    return data
+
+
+async def fetch_data_adaptive(session: ClientSession, url: str, tracker: LatencyTracker = LATENCY_TRACKER,
+                              hedge: bool = False) -> bytes:
+    """Asynchronous function for getting data from request with adaptive timeout and optional hedging.
+
+    NOTES
+    -----
+    If hedging is enabled and response does not arrive within p95 latency of the endpoint, a duplicate request is sent
+    (as long as hedge budget allows it) and whichever response arrives first is used; the other one is cancelled.
+
+    :param session: ClientSession object representing a session on which asynchronous requests will run
+    :param url: URL for getting data from API
+    :param tracker: latency tracker of API endpoints
+    :param hedge: enable sending of duplicate request for slow responses
+
+    :return: bytes response from request
     """
+    tracker.requests += 1
+    primary = asyncio.create_task(_fetch_recorded(session, url, tracker))
+    delay = tracker.hedge_delay(url) if hedge else None
+    if delay is None:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done or not tracker.try_hedge():
+        return await primary
+
+    pending = {primary, asyncio.create_task(_fetch_recorded(session, url, tracker))}
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                for other in pending:
+                    other.cancel()
+                return task.result()
+            error = task.exception()
+    raise error
+
+
+@profile_stage()
+@async_timed()
+async def fetch_files(urls: list, filenames: list, subfolder: str, tracker: LatencyTracker = LATENCY_TRACKER,
+                      hedge: bool = False, client: HTTPClient = None, save: Callable = None) -> list:
+    """Download data from list of API endpoints concurrently and save them as files.
 
     :param urls: list of URLs for getting data from API
     :param filenames: list of filenames for downloaded data
     :param subfolder: name of the sub-folder, where downloaded files should be stored
+    :param tracker: latency tracker used for adaptive timeouts; fixed timeout is used if None
+    :param hedge: send duplicate request for responses slower than tracked p95 latency
+    :param client: shared HTTP client; temporary client is created if not selected
+    :param save: function storing downloaded data (e.g. Archive.save); save_json() is used if not selected
 
-    :return: None
+    :return: list of results in the same order as urls; filename for successful download, exception otherwise
     """
     subfolder_iter = itertools.repeat(subfolder, len(urls))
-    connector = aiohttp.TCPConnector(limit_per_host=10000)
-    async with ClientSession(connector=connector) as session:
-        tasks = [download_one(session, url, filename, subfolder)
+    async with client_session(client) as session:
+        tasks = [download_one(session, url, filename, subfolder, tracker, hedge, save)
                  for url, filename, subfolder in zip(urls, filenames, subfolder_iter)]
         results = await asyncio.gather(*tasks, return_exceptions=True)
 
@@ -106,6 +334,22 @@ async def fetch_files(urls: list, filenames: list, subfolder: str) -> None:
         print(f"Exceptions: [{exceptions}]")
         print(f"Success results: [{success_status_codes}]")
 
+    return results
+
+
+@profile_stage()
+@async_timed()
+async def fetch_payloads(urls: list, client: HTTPClient = None) -> list:
+    """Download data from list of API endpoints concurrently and keep them in memory.
+
+    :param urls: list of URLs for getting data from API
+    :param client: shared HTTP client; temporary client is created if not selected
+
+    :return: list of results in the same order as urls; bytes response for successful request, exception otherwise
+    """
+    async with client_session(client) as session:
+        return await asyncio.gather(*[fetch_data(session, url) for url in urls], return_exceptions=True)
+
 
 def silence_event_loop_closed(func: Callable) -> Callable:
     """Custom wrapper function for silencing asyncio runtime error.
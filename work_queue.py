@@ -0,0 +1,383 @@
+"""Module storing durable work queue and coordinator/worker functions for fetching data in multiple processes.
+
+Work units (team rosters and player game logs) are stored in a database table and claimed by workers with time-limited
+leases. SQLite queue is enough for multiple worker processes on one machine, while Postgres queue can be shared by
+workers running on multiple hosts - no other service is needed. Workers fetch, write and parse their units: team rosters
+are parsed into player game log units and game logs into Dataframes pickled into files/parsed/player_stats. Downloaded
+and parsed files are written into FILES_DIR of the worker host (shared mount is needed to collect them in one place).
+
+USAGE
+_____
+coordinator:    python work_queue.py coordinator --teams-file all_teams
+worker(s):      python work_queue.py worker --processes 4
+shared queue:   python work_queue.py worker --processes 4 --db-config db_connection/database.ini
+"""
+import argparse
+import asyncio
+import functools
+import multiprocessing
+import os
+import socket
+import sqlite3
+import time
+from itertools import groupby
+from pathlib import Path
+from typing import List, Tuple, Iterable, Any, Callable
+from utils import HTTPClient, fetch_files, FILES_DIR
+from get_data_stats_files import (BASE_URL, load_all_team_rosters, prepare_player_stats_requests,
+                                  load_player_stats_into_dataframe)
+
+QUEUE_PATH: Path = FILES_DIR / "work_queue.sqlite"
+PARSED_DIR: Path = FILES_DIR / "parsed"
+
+# number of work units claimed by worker at once and duration of the claim
+CLAIM_BATCH_SIZE: int = 50
+LEASE_SECONDS: float = 60
+MAX_ATTEMPTS: int = 3
+IDLE_POLL_SECONDS: float = 1
+
+# work unit kinds
+ROSTER: str = "roster"
+PLAYER: str = "player"
+
+# work unit statuses
+PENDING: str = "pending"
+CLAIMED: str = "claimed"
+DONE: str = "done"
+FAILED: str = "failed"
+
+CREATE_WORK_QUEUE_TABLE_QUERY: str = """
+CREATE TABLE IF NOT EXISTS work_queue
+(
+    unit_id {id_type} PRIMARY KEY,
+    kind VARCHAR(16) NOT NULL,
+    url VARCHAR(512) UNIQUE NOT NULL,
+    filename VARCHAR(255) NOT NULL,
+    subfolder VARCHAR(255) NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    lease_owner VARCHAR(255),
+    lease_expires DOUBLE PRECISION,
+    attempts INT NOT NULL DEFAULT 0,
+    error TEXT
+);
+"""
+
+CLAIM_WORK_UNITS_QUERY: str = """
+UPDATE work_queue SET status = 'claimed', lease_owner = {p}, lease_expires = {p}, attempts = attempts + 1
+WHERE unit_id IN (
+    SELECT unit_id FROM work_queue
+    WHERE attempts < {p} AND (status IN ('pending', 'failed') OR (status = 'claimed' AND lease_expires < {p}))
+    ORDER BY unit_id
+    LIMIT {p}
+    {lock}
+)
+RETURNING unit_id, kind, url, filename, subfolder
+"""
+
+
+class WorkQueue:
+    """Durable work queue with claim/lease semantics stored in a database table.
+
+    NOTES
+    -----
+    Claiming is done with a single UPDATE ... RETURNING statement, therefore two workers never get the same unit. Unit
+    claimed by a worker, which crashed, becomes available again after its lease expires.
+
+    :param connect: function returning new DB-API connection
+    :param placeholder: query parameter placeholder used by DB-API driver
+    :param id_type: SQL type of auto-incremented primary key
+    :param lock: locking clause used when selecting units to be claimed
+    """
+    def __init__(self, connect: Callable[[], Any], placeholder: str, id_type: str, lock: str = ""):
+        self.connection = connect()
+        self.placeholder = placeholder
+        self.claim_query = CLAIM_WORK_UNITS_QUERY.format(p=placeholder, lock=lock)
+        self._execute(CREATE_WORK_QUEUE_TABLE_QUERY.format(id_type=id_type))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _execute(self, query: str, values: tuple = (), many: List[tuple] = None) -> List[tuple]:
+        """Run query within its own transaction and return fetched rows (if any)."""
+        cursor = self.connection.cursor()
+        try:
+            if many is not None:
+                cursor.executemany(query, many)
+            else:
+                cursor.execute(query, values)
+            rows = cursor.fetchall() if cursor.description else []
+            self.connection.commit()
+            return rows
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def enqueue(self, kind: str, urls: List[str], filenames: List[str], subfolder: str) -> None:
+        """Add work units into the queue; units with already queued URL are ignored.
+
+        :param kind: work unit kind
+        :param urls: list of URLs for getting data from API
+        :param filenames: list of filenames for downloaded data
+        :param subfolder: name of the sub-folder, where downloaded files should be stored
+
+        :return: None
+        """
+        p = self.placeholder
+        self._execute(f"INSERT INTO work_queue(kind, url, filename, subfolder) VALUES({p}, {p}, {p}, {p}) "
+                      f"ON CONFLICT (url) DO NOTHING",
+                      many=[(kind, url, filename, subfolder) for url, filename in zip(urls, filenames)])
+
+    def claim(self, owner: str, limit: int = CLAIM_BATCH_SIZE, lease_seconds: float = LEASE_SECONDS,
+              max_attempts: int = MAX_ATTEMPTS) -> List[Tuple[int, str, str, str, str]]:
+        """Claim batch of available work units.
+
+        :param owner: identifier of the claiming worker
+        :param limit: maximal number of claimed units
+        :param lease_seconds: duration of the claim, after which unit can be claimed by another worker
+        :param max_attempts: maximal number of attempts for a single unit
+
+        :return: list of (unit_id, kind, url, filename, subfolder) tuples
+        """
+        now = time.time()
+        rows = self._execute(self.claim_query, (owner, now + lease_seconds, max_attempts, now, limit))
+        return sorted(rows)
+
+    def finish(self, owner: str, results: Iterable[Tuple[int, str]]) -> None:
+        """Store results of processed units; units, whose lease was taken over by another worker, are skipped.
+
+        :param owner: identifier of the worker, which processed units
+        :param results: iterable of (unit_id, error) tuples; error is None for successful units
+
+        :return: None
+        """
+        p = self.placeholder
+        self._execute(f"UPDATE work_queue SET status = {p}, error = {p}, lease_owner = NULL, lease_expires = NULL "
+                      f"WHERE unit_id = {p} AND lease_owner = {p}",
+                      many=[(DONE if error is None else FAILED, error, unit_id, owner) for unit_id, error in results])
+
+    def outstanding(self, max_attempts: int = MAX_ATTEMPTS) -> int:
+        """Get number of units, which are not done and can still be (re)claimed or are held by a live lease.
+
+        NOTES
+        -----
+        Unit claimed for the last attempt by a worker, which crashed, is not outstanding after its lease expires, as
+        it can never be claimed again (otherwise workers would wait for it forever).
+
+        USAGE
+        _____
+        >>> import tempfile
+        >>> with SQLiteWorkQueue(Path(tempfile.mkdtemp()) / "queue.sqlite") as queue:
+        ...     queue.enqueue(PLAYER, ["https://example.com/1"], ["player_1"], "player_stats")
+        ...     claimed = queue.claim("crashed", lease_seconds=-1, max_attempts=1)
+        ...     queue.outstanding(max_attempts=1), queue.claim("worker", max_attempts=1)
+        (0, [])
+
+        :param max_attempts: maximal number of attempts for a single unit
+
+        :return: number of outstanding units
+        """
+        p = self.placeholder
+        rows = self._execute(f"SELECT COUNT(*) FROM work_queue "
+                             f"WHERE (status != {p} AND attempts < {p}) OR (status = {p} AND lease_expires >= {p})",
+                             (DONE, max_attempts, CLAIMED, time.time()))
+        return rows[0][0]
+
+    def summary(self) -> dict:
+        """Get number of units per kind and status.
+
+        :return: dictionary {(kind, status): count}
+        """
+        rows = self._execute("SELECT kind, status, COUNT(*) FROM work_queue GROUP BY kind, status")
+        return {(kind, status): count for kind, status, count in rows}
+
+
+class SQLiteWorkQueue(WorkQueue):
+    """Work queue stored in local SQLite file shared by worker processes on one machine."""
+    def __init__(self, path: Path = QUEUE_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        def connect():
+            connection = sqlite3.connect(path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            return connection
+
+        super().__init__(connect, placeholder="?", id_type="INTEGER")
+
+
+class PostgresWorkQueue(WorkQueue):
+    """Work queue stored in Postgres database shared by worker processes on multiple hosts.
+
+    :param configuration_parameters: psycopg2 connection parameters; {'host': str, 'database': str, 'user': str, ...}
+    """
+    def __init__(self, configuration_parameters: dict):
+        import psycopg2
+
+        super().__init__(lambda: psycopg2.connect(**configuration_parameters), placeholder="%s", id_type="SERIAL",
+                         lock="FOR UPDATE SKIP LOCKED")
+
+
+def enqueue_all_team_rosters(queue: WorkQueue, filename: str = "all_teams") -> int:
+    """Add roster work units of all teams into the queue.
+
+    :param queue: work queue
+    :param filename: name of the filename with all teams data (without extension)
+
+    :return: number of enqueued units
+    """
+    filenames, json_navigator = load_all_team_rosters(filename)
+    urls = [BASE_URL + team.link + "/roster" for team in json_navigator.teams]
+    queue.enqueue(ROSTER, urls, filenames, "team_roster")
+
+    return len(urls)
+
+
+def enqueue_player_stats(queue: WorkQueue, filenames: List[str]) -> int:
+    """Add player game log work units of given team rosters into the queue.
+
+    :param queue: work queue
+    :param filenames: list of team roster filenames (without extension)
+
+    :return: number of enqueued units
+    """
+    player_links, player_filenames = prepare_player_stats_requests(filenames)
+    queue.enqueue(PLAYER, player_links, player_filenames, "player_stats")
+
+    return len(player_links)
+
+
+def parse_unit(kind: str, filename: str) -> Tuple[List[str], List[str]]:
+    """Parse downloaded file of a work unit.
+
+    NOTES
+    -----
+    Team roster is parsed into requests for game logs of its skaters. Player game log is parsed into Dataframe, which
+    is pickled into PARSED_DIR/player_stats, so readers do not need to parse JSON again.
+
+    :param kind: work unit kind
+    :param filename: filename of downloaded data (without extension)
+
+    :return: tuple with list of player stats URLs and list of player stats filenames produced by the unit
+    """
+    if kind == ROSTER:
+        return prepare_player_stats_requests([filename])
+
+    path = PARSED_DIR / "player_stats" / (filename + ".pkl")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    load_player_stats_into_dataframe(filename).to_pickle(path)
+    return [], []
+
+
+async def run_worker(queue: WorkQueue, owner: str = None, batch_size: int = CLAIM_BATCH_SIZE,
+                     lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS) -> int:
+    """Claim and process work units until the queue is drained.
+
+    NOTES
+    -----
+    Unit is done only when it was downloaded with 2xx status and parsed; otherwise it is failed and claimed again
+    until max_attempts is reached. Successfully parsed team rosters are expanded into player game log units right
+    away by the worker, so other workers can start fetching players while rosters are still being downloaded.
+
+    :param queue: work queue
+    :param owner: identifier of the worker; host name and process id by default
+    :param batch_size: number of units claimed and downloaded concurrently
+    :param lease_seconds: duration of the claim
+    :param max_attempts: maximal number of attempts for a single unit
+
+    :return: number of processed units
+    """
+    owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+    processed = 0
+
+    async with HTTPClient() as client:
+        while True:
+            units = queue.claim(owner, limit=batch_size, lease_seconds=lease_seconds, max_attempts=max_attempts)
+            if not units:
+                # other workers might still hold leases of units, which can be returned back to the queue
+                if queue.outstanding(max_attempts=max_attempts) == 0:
+                    break
+                await asyncio.sleep(IDLE_POLL_SECONDS)
+                continue
+
+            units_by_subfolder = groupby(sorted(units, key=lambda unit: unit[4]), key=lambda unit: unit[4])
+            for subfolder, subfolder_units in units_by_subfolder:
+                subfolder_units = list(subfolder_units)
+                # fetch_data raises for non-2xx status, so error responses are failed results
+                results = await fetch_files([unit[2] for unit in subfolder_units],
+                                            [unit[3] for unit in subfolder_units], subfolder, client=client)
+
+                finished, player_links, player_filenames = [], [], []
+                for unit, result in zip(subfolder_units, results):
+                    if isinstance(result, Exception):
+                        finished.append((unit[0], repr(result)))
+                        continue
+                    try:
+                        links, filenames = parse_unit(unit[1], unit[3].lower())
+                    except Exception as e:
+                        finished.append((unit[0], repr(e)))
+                        continue
+                    finished.append((unit[0], None))
+                    player_links += links
+                    player_filenames += filenames
+
+                queue.finish(owner, finished)
+                if player_links:
+                    queue.enqueue(PLAYER, player_links, player_filenames, "player_stats")
+
+            processed += len(units)
+
+    return processed
+
+
+def _worker_process(queue_factory: Callable[[], WorkQueue], batch_size: int) -> None:
+    """Entry point of a worker process."""
+    with queue_factory() as queue:
+        processed = asyncio.run(run_worker(queue, batch_size=batch_size))
+    print(f"Worker {os.getpid()} processed [{processed}] units")
+
+
+def run_workers(queue_factory: Callable[[], WorkQueue], processes: int = os.cpu_count(),
+                batch_size: int = CLAIM_BATCH_SIZE) -> None:
+    """Run multiple worker processes on this machine and wait for them to drain the queue.
+
+    :param queue_factory: picklable function returning new work queue (every process needs own connection)
+    :param processes: number of worker processes
+    :param batch_size: number of units claimed and downloaded concurrently by each worker
+
+    :return: None
+    """
+    workers = [multiprocessing.Process(target=_worker_process, args=(queue_factory, batch_size))
+               for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch NHL API data with coordinator and worker processes.")
+    parser.add_argument("role", choices=["coordinator", "worker"])
+    parser.add_argument("--teams-file", default="all_teams", help="name of the file with all teams data")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="number of local worker processes")
+    parser.add_argument("--batch-size", type=int, default=CLAIM_BATCH_SIZE)
+    parser.add_argument("--db-config", type=Path, help="Postgres config file; local SQLite queue is used if not set")
+    args = parser.parse_args()
+
+    if args.db_config:
+        from db_connection.utils import get_db_config
+        factory = functools.partial(PostgresWorkQueue, get_db_config(filename=args.db_config))
+    else:
+        factory = SQLiteWorkQueue
+
+    if args.role == "coordinator":
+        with factory() as work_queue:
+            print(f"Enqueued [{enqueue_all_team_rosters(work_queue, args.teams_file)}] team rosters")
+    else:
+        run_workers(factory, processes=args.processes, batch_size=args.batch_size)